@@ -0,0 +1,26 @@
+"""sensor anomaly flags
+
+Revision ID: 3f9b2c7d1e84
+Revises: ecef8c04b7bc
+Create Date: 2026-10-19 10:12:41.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9b2c7d1e84'
+down_revision: Union[str, None] = 'ecef8c04b7bc'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('sensors_data', sa.Column('anomaly_flags', sa.SmallInteger(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('sensors_data', 'anomaly_flags')
@@ -0,0 +1,47 @@
+"""device events and daily usage
+
+Revision ID: 5c2e8f1a9d36
+Revises: b7e1d4a9c2f0
+Create Date: 2026-10-19 16:48:05.612394
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c2e8f1a9d36'
+down_revision: Union[str, None] = 'b7e1d4a9c2f0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('device_events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('device_id', sa.Integer(), nullable=False),
+    sa.Column('event_type', sa.String(), nullable=False),
+    sa.Column('source', sa.String(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['device_id'], ['devices.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_device_events_device_id_created_at', 'device_events', ['device_id', 'created_at'], unique=False)
+    op.create_table('device_daily_usage',
+    sa.Column('device_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('coffees', sa.Integer(), nullable=False),
+    sa.Column('active_time', sa.Float(), nullable=False),
+    sa.Column('cleanings', sa.Integer(), nullable=False),
+    sa.Column('last_cleaning', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['device_id'], ['devices.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('device_id', 'day')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('device_daily_usage')
+    op.drop_index('ix_device_events_device_id_created_at', table_name='device_events')
+    op.drop_table('device_events')
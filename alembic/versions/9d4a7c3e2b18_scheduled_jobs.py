@@ -0,0 +1,34 @@
+"""scheduled jobs
+
+Revision ID: 9d4a7c3e2b18
+Revises: 5c2e8f1a9d36
+Create Date: 2026-10-19 17:21:37.904116
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d4a7c3e2b18'
+down_revision: Union[str, None] = '5c2e8f1a9d36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('scheduled_jobs',
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('last_scheduled_for', sa.DateTime(), nullable=True),
+    sa.Column('last_started_at', sa.DateTime(), nullable=True),
+    sa.Column('last_finished_at', sa.DateTime(), nullable=True),
+    sa.Column('last_status', sa.String(), nullable=True),
+    sa.Column('last_duration', sa.Float(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('scheduled_jobs')
@@ -0,0 +1,31 @@
+"""sensors_data device/timestamp index
+
+Revision ID: b7e1d4a9c2f0
+Revises: 3f9b2c7d1e84
+Create Date: 2026-10-19 11:02:17.540921
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e1d4a9c2f0'
+down_revision: Union[str, None] = '3f9b2c7d1e84'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Built concurrently so ingest keeps writing while the index is created
+    with op.get_context().autocommit_block():
+        op.create_index('ix_sensors_data_device_id_timestamp', 'sensors_data', ['device_id', 'timestamp'],
+                        unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_sensors_data_device_id_timestamp', table_name='sensors_data',
+                      postgresql_concurrently=True)
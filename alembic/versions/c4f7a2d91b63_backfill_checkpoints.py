@@ -0,0 +1,34 @@
+"""backfill checkpoints
+
+Revision ID: c4f7a2d91b63
+Revises: 9d4a7c3e2b18
+Create Date: 2026-10-19 18:04:12.512730
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4f7a2d91b63'
+down_revision: Union[str, None] = '9d4a7c3e2b18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('backfill_checkpoints',
+    sa.Column('source', sa.String(), nullable=False),
+    sa.Column('worker', sa.Integer(), nullable=False),
+    sa.Column('workers', sa.Integer(), nullable=False),
+    sa.Column('position', sa.BigInteger(), nullable=False),
+    sa.Column('rows', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('source', 'worker')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('backfill_checkpoints')
@@ -0,0 +1,26 @@
+"""device presence
+
+Revision ID: e2b8d5f14a70
+Revises: c4f7a2d91b63
+Create Date: 2026-10-19 18:41:55.083412
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2b8d5f14a70'
+down_revision: Union[str, None] = 'c4f7a2d91b63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('devices', sa.Column('is_online', sa.Boolean(), server_default='false', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('devices', 'is_online')
@@ -0,0 +1,174 @@
+"""compact sensors_data: bigint identity, real levels, timestamptz
+
+Revision ID: f6a1c3e8d257
+Revises: e2b8d5f14a70
+Create Date: 2026-10-19 20:12:36.418205
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f6a1c3e8d257'
+down_revision: Union[str, None] = 'e2b8d5f14a70'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Rows copied per transaction during the backfill
+BATCH_SIZE = 50000
+
+# Widest columns first, so no row pays for alignment padding
+COMPACT_TABLE = """
+    CREATE TABLE IF NOT EXISTS sensors_data_shadow (
+        id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        "timestamp" timestamp with time zone,
+        device_id integer NOT NULL,
+        water_level real,
+        beans_level real,
+        anomaly_flags smallint NOT NULL DEFAULT 0
+    )
+"""
+
+ORIGINAL_TABLE = """
+    CREATE TABLE IF NOT EXISTS sensors_data_shadow (
+        id serial PRIMARY KEY,
+        device_id integer NOT NULL,
+        water_level double precision,
+        beans_level double precision,
+        "timestamp" timestamp without time zone,
+        anomaly_flags smallint NOT NULL DEFAULT 0
+    )
+"""
+
+# Old timestamps are UTC wall-clock time; AT TIME ZONE 'UTC' converts in either direction
+COMPACT_VALUES = {
+    'id': '{row}.id',
+    'timestamp': '{row}."timestamp" AT TIME ZONE \'UTC\'',
+    'device_id': '{row}.device_id',
+    'water_level': '{row}.water_level::real',
+    'beans_level': '{row}.beans_level::real',
+    'anomaly_flags': '{row}.anomaly_flags',
+}
+
+ORIGINAL_VALUES = {
+    **COMPACT_VALUES,
+    'water_level': '{row}.water_level::double precision',
+    'beans_level': '{row}.beans_level::double precision',
+}
+
+
+def rebuild_sensors_data(create_table, values, indexes):
+    """
+    Rebuild sensors_data under a new definition while ingest keeps writing.
+
+    A trigger mirrors every write into a shadow table, existing rows are copied over in
+    short batches, indexes are built concurrently, and only the final swap of the two
+    tables takes an exclusive lock. Every step can be rerun, so a cutover that gives up
+    on its lock_timeout can simply be retried.
+    """
+    columns = ', '.join(f'"{name}"' for name in values)
+    from_new = ', '.join(expression.format(row='NEW') for expression in values.values())
+    from_batch = ', '.join(expression.format(row='batch') for expression in values.values())
+    updates = ', '.join(f'"{name}" = EXCLUDED."{name}"' for name in values if name != 'id')
+
+    # 1. Shadow table, kept in sync from here on
+    op.execute(create_table)
+    op.execute(f"""
+        CREATE OR REPLACE FUNCTION sensors_data_sync() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                DELETE FROM sensors_data_shadow WHERE id = OLD.id;
+                RETURN OLD;
+            END IF;
+            INSERT INTO sensors_data_shadow ({columns}) VALUES ({from_new})
+            ON CONFLICT (id) DO UPDATE SET {updates};
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("DROP TRIGGER IF EXISTS sensors_data_sync ON sensors_data")
+    op.execute("""
+        CREATE TRIGGER sensors_data_sync AFTER INSERT OR UPDATE OR DELETE ON sensors_data
+        FOR EACH ROW EXECUTE FUNCTION sensors_data_sync()
+    """)
+
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+
+        # 2. Copy the existing rows, one committed batch at a time. FOR SHARE waits for
+        # in-flight updates of the batch, whose trigger copies then win over this one.
+        first, last = connection.execute(sa.text("SELECT min(id), max(id) FROM sensors_data")).one()
+        if first is not None:
+            copy_batch = sa.text(f"""
+                WITH batch AS (
+                    SELECT * FROM sensors_data WHERE id >= :start AND id < :end FOR SHARE
+                )
+                INSERT INTO sensors_data_shadow ({columns}) SELECT {from_batch} FROM batch
+                ON CONFLICT (id) DO NOTHING
+            """)
+            for start in range(first, last + 1, BATCH_SIZE):
+                connection.execute(copy_batch, {'start': start, 'end': start + BATCH_SIZE})
+
+        # 3. Indexes and the foreign key, without blocking writes. A concurrent build that
+        # failed leaves an INVALID index behind, which IF NOT EXISTS would keep.
+        invalid = connection.execute(sa.text("""
+            SELECT index.relname FROM pg_index
+            JOIN pg_class index ON index.oid = pg_index.indexrelid
+            WHERE pg_index.indrelid = 'sensors_data_shadow'::regclass AND NOT pg_index.indisvalid
+        """)).scalars().all()
+        for index in invalid:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index}")
+        for name, definition in indexes:
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name}_shadow ON sensors_data_shadow {definition}")
+        op.execute("""
+            DO $$ BEGIN
+                ALTER TABLE sensors_data_shadow ADD CONSTRAINT sensors_data_shadow_device_id_fkey
+                    FOREIGN KEY (device_id) REFERENCES devices (id) ON DELETE CASCADE NOT VALID;
+            EXCEPTION WHEN duplicate_object THEN NULL;
+            END $$
+        """)
+        op.execute("ALTER TABLE sensors_data_shadow VALIDATE CONSTRAINT sensors_data_shadow_device_id_fkey")
+        op.execute("ANALYZE sensors_data_shadow")
+
+    # 4. Cutover: the shadow table is complete, swap it in under a short exclusive lock
+    op.execute("SET LOCAL lock_timeout = '10s'")
+    op.execute("LOCK TABLE sensors_data, sensors_data_shadow IN ACCESS EXCLUSIVE MODE")
+    op.execute("DROP TRIGGER sensors_data_sync ON sensors_data")
+    op.execute("DROP FUNCTION sensors_data_sync()")
+    op.execute("DROP TABLE sensors_data")
+    op.execute("ALTER TABLE sensors_data_shadow RENAME TO sensors_data")
+    op.execute("ALTER INDEX sensors_data_shadow_pkey RENAME TO sensors_data_pkey")
+    op.execute("ALTER TABLE sensors_data RENAME CONSTRAINT sensors_data_shadow_device_id_fkey "
+               "TO sensors_data_device_id_fkey")
+    for name, _ in indexes:
+        op.execute(f"ALTER INDEX {name}_shadow RENAME TO {name}")
+    # The id sequence is looked up through the column, which works for identity and
+    # serial columns alike. Rows copied with their ids don't advance it.
+    op.execute("""
+        DO $$
+        DECLARE
+            seq regclass := pg_get_serial_sequence('sensors_data', 'id')::regclass;
+        BEGIN
+            IF to_regclass('sensors_data_id_seq') IS NULL THEN
+                EXECUTE format('ALTER SEQUENCE %s RENAME TO sensors_data_id_seq', seq);
+            END IF;
+            PERFORM setval(seq, coalesce((SELECT max(id) FROM sensors_data), 0) + 1, false);
+        END $$
+    """)
+
+
+def upgrade() -> None:
+    # ix_sensors_data_id is dropped with the old table: the primary key already indexes id
+    rebuild_sensors_data(COMPACT_TABLE, COMPACT_VALUES, [
+        ('ix_sensors_data_device_id_timestamp', '(device_id, "timestamp")'),
+    ])
+
+
+def downgrade() -> None:
+    rebuild_sensors_data(ORIGINAL_TABLE, ORIGINAL_VALUES, [
+        ('ix_sensors_data_id', '(id)'),
+        ('ix_sensors_data_device_id_timestamp', '(device_id, "timestamp")'),
+    ])
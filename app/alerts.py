@@ -0,0 +1,211 @@
+import asyncio
+import json
+import logging
+import operator
+from datetime import datetime
+
+import httpx
+from sqlalchemy import select
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.metrics import metrics
+from app.models import Device
+from app.stream import EventStream, PermanentSendError, event_stream
+from app.usage import load_usage
+
+logger = logging.getLogger(__name__)
+
+# Same thresholds as the statistics screen (see get_water_status / get_beans_status in sensors_routes).
+# A rule fires when `field op value` becomes true and resolves once `field op clear` is false again.
+DEFAULT_ALERT_RULES = [
+    {"name": "water_critical", "field": "water_level", "op": "<", "value": 20, "clear": 25, "severity": "critical"},
+    {"name": "beans_low", "field": "beans_level", "op": "<", "value": 50, "clear": 55, "severity": "warning"},
+    {"name": "cleaning_overdue", "field": "days_since_cleaning", "op": ">", "value": 30, "severity": "warning"},
+]
+
+OPERATORS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+alerts_fired = metrics.counter("alerts_total", "Alert transitions by rule and state")
+
+
+class AlertRule:
+    __slots__ = ("name", "field", "op", "value", "severity", "check", "holds")
+
+    def __init__(self, name, field, op, value, severity="warning", clear=None):
+        if op not in OPERATORS:
+            raise ValueError(f"Unknown operator in alert rule {name}: {op}")
+        compare = OPERATORS[op]
+        clear = value if clear is None else clear
+        self.name = name
+        self.field = field
+        self.op = op
+        self.value = value
+        self.severity = severity
+        # Condition to start firing, and the (hysteresis) condition to keep firing
+        self.check = lambda reading: compare(reading, value)
+        self.holds = lambda reading: compare(reading, clear)
+
+
+def compile_rules(specs):
+    return [AlertRule(**spec) for spec in specs]
+
+
+class AlertEngine:
+    """
+    Evaluates alert rules on every ingested reading, from memory only.
+
+    The state per device is a bitmask of the rules currently firing, so a rule only
+    produces an alert when it starts or stops firing. Readings without the rule's
+    field leave its state unchanged. `days_since_cleaning` is derived from the last
+    cleaning time loaded at startup and updated on `cleaning_completed`.
+    """
+
+    def __init__(self, rules, notifier):
+        self.rules = rules
+        self.notifier = notifier
+        self.needs_cleaning = any(rule.field == "days_since_cleaning" for rule in rules)
+        self.firing = {}
+        self.last_cleaning = {}
+
+    async def load(self):
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(Device.id, Device.last_cleaning_time))
+            devices = result.all()
+            usage = await load_usage(db, [device_id for device_id, _ in devices])
+
+        for device_id, last_cleaning in devices:
+            cleaned = usage.get(device_id)
+            if cleaned and cleaned.last_cleaning and (last_cleaning is None or cleaned.last_cleaning > last_cleaning):
+                last_cleaning = cleaned.last_cleaning
+            if last_cleaning is not None:
+                self.last_cleaning[device_id] = last_cleaning
+        logger.info("Loaded %s alert rules for %s devices", len(self.rules), len(devices))
+
+    def forget(self, device_id):
+        self.firing.pop(device_id, None)
+        self.last_cleaning.pop(device_id, None)
+
+    def evaluate(self, record, now=None):
+        """Apply one normalized reading and return the alerts it triggered or resolved."""
+        device_id = record["device_id"]
+        now = now or datetime.utcnow()
+        values = record
+        if self.needs_cleaning:
+            if record["event"] == "cleaning_completed":
+                self.last_cleaning[device_id] = now
+            # Devices created after startup count from the first reading
+            last_cleaning = self.last_cleaning.setdefault(device_id, now)
+            values = {**record, "days_since_cleaning": (now - last_cleaning).total_seconds() / 86400}
+
+        firing = previous = self.firing.get(device_id, 0)
+        alerts = []
+        for index, rule in enumerate(self.rules):
+            reading = values.get(rule.field)
+            if reading is None:
+                continue
+            bit = 1 << index
+            active = firing & bit
+            if (rule.holds(reading) if active else rule.check(reading)) == bool(active):
+                continue
+
+            firing ^= bit
+            state = "resolved" if active else "triggered"
+            alerts_fired.inc(rule=rule.name, state=state)
+            alerts.append({
+                "rule": rule.name,
+                "severity": rule.severity,
+                "state": state,
+                "device_id": device_id,
+                "field": rule.field,
+                "value": reading,
+                "threshold": rule.value,
+                "at": now,
+            })
+
+        if firing != previous:
+            self.firing[device_id] = firing
+        for alert in alerts:
+            logger.warning("Alert %s %s for device %s: %s=%s",
+                           alert["rule"], alert["state"], device_id, alert["field"], alert["value"])
+            self.notifier.publish("webhooks", device_id, alert)
+            event_stream.publish("alerts", device_id, alert)
+        return alerts
+
+    def active(self, device_id):
+        firing = self.firing.get(device_id, 0)
+        return [rule.name for index, rule in enumerate(self.rules) if firing & (1 << index)]
+
+
+# 4xx responses that can succeed when the same request is sent again
+RETRYABLE_STATUSES = {408, 425, 429}
+
+
+def retryable(error):
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status >= 500 or status in RETRYABLE_STATUSES
+    return True
+
+
+class WebhookSink:
+    """
+    POSTs each batch as {"alerts": [...]} to every webhook URL.
+
+    When some URLs fail, the retry of the same batch only goes to those. A URL that
+    rejects the batch with a client error isn't retried.
+    """
+
+    def __init__(self, urls, timeout):
+        self.urls = urls
+        self.timeout = timeout
+        self.client = None
+        self.batch = None
+        self.remaining = []
+
+    async def start(self):
+        self.client = httpx.AsyncClient(timeout=self.timeout)
+
+    async def post(self, url, body):
+        response = await self.client.post(url, content=body, headers={"Content-Type": "application/json"})
+        response.raise_for_status()
+
+    async def send_batch(self, batch):
+        if batch is not self.batch:
+            self.batch, self.remaining = batch, list(self.urls)
+
+        body = b'{"alerts":[' + b",".join(value for _, _, value in batch) + b"]}"
+        results = await asyncio.gather(*(self.post(url, body) for url in self.remaining), return_exceptions=True)
+        failed = [(url, result) for url, result in zip(self.remaining, results) if isinstance(result, Exception)]
+        self.remaining = [url for url, error in failed if retryable(error)]
+        if self.remaining:
+            raise RuntimeError("; ".join(f"{url}: {error}" for url, error in failed))
+        if failed:
+            raise PermanentSendError("; ".join(f"{url}: {error}" for url, error in failed))
+
+    async def stop(self):
+        if self.client:
+            await self.client.aclose()
+            self.client = None
+
+
+webhook_urls = [url.strip() for url in settings.alert_webhook_urls.split(",") if url.strip()]
+alert_notifier = EventStream(
+    WebhookSink(webhook_urls, settings.alert_webhook_timeout) if webhook_urls else None,
+    "alerts",
+    settings.alert_batch_size,
+    settings.alert_linger,
+    settings.alert_queue_size,
+    settings.alert_max_attempts
+)
+alert_engine = AlertEngine(
+    compile_rules(json.loads(settings.alert_rules) if settings.alert_rules else DEFAULT_ALERT_RULES),
+    alert_notifier
+)
@@ -0,0 +1,171 @@
+import math
+import time
+from array import array
+from datetime import datetime
+from collections import deque
+import logging
+
+from app.config import settings
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Per-metric flag bits; water_level uses bits 0-3 and beans_level bits 4-7
+OUT_OF_RANGE = 1
+SPIKE = 2
+JUMP = 4
+STUCK = 8
+
+FLAG_NAMES = {OUT_OF_RANGE: "out_of_range", SPIKE: "spike", JUMP: "jump", STUCK: "stuck"}
+METRICS = ("water_level", "beans_level")
+FLAG_BITS = 4
+
+anomalies_detected = metrics.counter("sensor_anomalies_total", "Anomalous sensor readings by metric and kind")
+
+
+def describe_flags(flags):
+    names = []
+    for offset, metric in enumerate(METRICS):
+        for bit, name in FLAG_NAMES.items():
+            if flags & (bit << (offset * FLAG_BITS)):
+                names.append(f"{metric}:{name}")
+    return names
+
+
+class AnomalyDetector:
+    """
+    Incremental per-device statistics for the ingest path.
+
+    State is kept in flat arrays indexed by device id (two slots per device, one
+    per metric), so a device costs about 60 bytes and no past data is queried.
+    """
+
+    def __init__(self, alpha, spike_sigma, min_std, max_drop, refill_level, stuck_brews, warmup,
+                 max_devices, quarantine_size):
+        self.alpha = alpha
+        self.spike_sigma = spike_sigma
+        self.min_std = min_std
+        self.max_drop = max_drop
+        self.refill_level = refill_level
+        self.stuck_brews = stuck_brews
+        self.warmup = warmup
+        self.max_devices = max_devices
+
+        self.mean = array("f")
+        self.var = array("f")
+        self.last = array("d")
+        self.last_change = array("d")
+        self.samples = array("H")
+        self.brews_since_change = array("H")
+
+        self.quarantined = deque(maxlen=quarantine_size)
+
+    def _slot(self, device_id):
+        if device_id < 0 or device_id >= self.max_devices:
+            return None
+        size = (device_id + 1) * len(METRICS)
+        missing = size - len(self.samples)
+        if missing > 0:
+            # Grow in blocks so consecutive new devices don't resize the arrays one at a time
+            missing = max(missing, min(len(self.samples), self.max_devices * len(METRICS) - len(self.samples)))
+            for column in (self.mean, self.var, self.last, self.last_change):
+                column.extend([0.0] * missing)
+            for column in (self.samples, self.brews_since_change):
+                column.extend([0] * missing)
+        return device_id * len(METRICS)
+
+    def record_brew(self, device_id):
+        slot = self._slot(device_id)
+        if slot is None:
+            return
+        for pos in range(slot, slot + len(METRICS)):
+            if self.samples[pos] and self.brews_since_change[pos] < 0xFFFF:
+                self.brews_since_change[pos] += 1
+
+    def check(self, device_id, water_level, beans_level, now=None):
+        slot = self._slot(device_id)
+        if slot is None:
+            return 0
+
+        now = now or time.time()
+        flags = 0
+        for offset, value in enumerate((water_level, beans_level)):
+            if value is None:
+                continue
+            metric_flags = self._check_metric(slot + offset, float(value), now)
+            if metric_flags:
+                for bit, name in FLAG_NAMES.items():
+                    if metric_flags & bit:
+                        anomalies_detected.inc(metric=METRICS[offset], kind=name)
+                flags |= metric_flags << (offset * FLAG_BITS)
+        return flags
+
+    def _check_metric(self, pos, value, now):
+        if not 0 <= value <= 100:
+            return OUT_OF_RANGE
+
+        if self.samples[pos] == 0:
+            self._reset(pos, value, now)
+            return 0
+
+        flags = 0
+        last = self.last[pos]
+        if value > last and value >= self.refill_level:
+            # Refill: start the statistics over from the new level
+            self._reset(pos, value, now)
+            return 0
+
+        if last - value > self.max_drop:
+            flags |= JUMP
+
+        if self.samples[pos] >= self.warmup:
+            std = max(math.sqrt(self.var[pos]), self.min_std)
+            if abs(value - self.mean[pos]) > self.spike_sigma * std:
+                flags |= SPIKE
+
+        if value != last:
+            self.last[pos] = value
+            self.last_change[pos] = now
+            self.brews_since_change[pos] = 0
+        elif self.brews_since_change[pos] >= self.stuck_brews:
+            flags |= STUCK
+
+        diff = value - self.mean[pos]
+        increment = self.alpha * diff
+        self.mean[pos] += increment
+        self.var[pos] = (1 - self.alpha) * (self.var[pos] + diff * increment)
+        if self.samples[pos] < 0xFFFF:
+            self.samples[pos] += 1
+        return flags
+
+    def _reset(self, pos, value, now):
+        self.mean[pos] = value
+        self.var[pos] = 0.0
+        self.last[pos] = value
+        self.last_change[pos] = now
+        self.samples[pos] = 1
+        self.brews_since_change[pos] = 0
+
+    def quarantine(self, device_id, water_level, beans_level, flags):
+        self.quarantined.append({
+            "device_id": device_id,
+            "water_level": water_level,
+            "beans_level": beans_level,
+            "anomaly_flags": flags,
+            "anomalies": describe_flags(flags),
+            "timestamp": datetime.utcnow(),
+        })
+        logger.warning("Quarantined sensor reading from device %s: %s", device_id, describe_flags(flags))
+
+
+anomaly_detector = AnomalyDetector(
+    alpha=settings.anomaly_ewma_alpha,
+    spike_sigma=settings.anomaly_spike_sigma,
+    min_std=settings.anomaly_min_std,
+    max_drop=settings.anomaly_max_drop,
+    refill_level=settings.anomaly_refill_level,
+    stuck_brews=settings.anomaly_stuck_brews,
+    warmup=settings.anomaly_warmup,
+    max_devices=settings.anomaly_max_devices,
+    quarantine_size=settings.anomaly_quarantine_size,
+)
@@ -0,0 +1,210 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+from datetime import date, datetime, timedelta, timezone, time as dt_time
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from sqlalchemy import select, delete, func, any_, bindparam, ARRAY, BigInteger
+
+from app.config import settings
+from app.database import AsyncSessionLocal, init_engine, dispose_engine
+from app.models import SensorData
+from app.query_cache import query_cache, CACHE_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_COLUMNS = [
+    SensorData.id,
+    SensorData.device_id,
+    SensorData.water_level,
+    SensorData.beans_level,
+    SensorData.timestamp,
+    SensorData.anomaly_flags,
+]
+
+ARCHIVE_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("device_id", pa.int32()),
+    ("water_level", pa.float64()),
+    ("beans_level", pa.float64()),
+    ("timestamp", pa.timestamp("us")),
+    ("anomaly_flags", pa.int16()),
+])
+
+MANIFEST_FILE = "manifest.json"
+
+
+def manifest_path():
+    return os.path.join(settings.archive_dir, MANIFEST_FILE)
+
+
+def load_manifest():
+    try:
+        with open(manifest_path()) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"ranges": {}}
+
+
+def save_manifest(manifest):
+    os.makedirs(settings.archive_dir, exist_ok=True)
+    tmp_path = manifest_path() + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path())
+
+
+def day_bounds(day):
+    start = datetime.combine(day, dt_time.min)
+    return start, start + timedelta(days=1)
+
+
+async def archive_day(day):
+    start, end = day_bounds(day)
+    path = os.path.join(settings.archive_dir, f"date={day.isoformat()}", "sensors_data.parquet")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+
+    rows = 0
+    writer = pq.ParquetWriter(tmp_path, ARCHIVE_SCHEMA, compression=settings.archive_compression)
+    try:
+        async with AsyncSessionLocal() as db:
+            # Server-side cursor: rows arrive in chunks and are transposed straight into column batches
+            result = await db.stream(
+                select(*ARCHIVE_COLUMNS)
+                .where(SensorData.timestamp >= start, SensorData.timestamp < end)
+                .order_by(SensorData.device_id, SensorData.timestamp)
+                .execution_options(yield_per=settings.archive_chunk_size)
+            )
+            async for chunk in result.partitions():
+                columns = zip(*chunk)
+                batch = pa.RecordBatch.from_arrays(
+                    [pa.array(column, type=field.type) for column, field in zip(columns, ARCHIVE_SCHEMA)],
+                    schema=ARCHIVE_SCHEMA
+                )
+                await asyncio.to_thread(writer.write_batch, batch)
+                rows += len(chunk)
+    finally:
+        await asyncio.to_thread(writer.close)
+
+    os.replace(tmp_path, path)
+    logger.info("Archived %s sensor readings for %s to %s", rows, day, path)
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "rows": rows,
+        "path": os.path.relpath(path, settings.archive_dir),
+        "archived_at": datetime.utcnow().isoformat(),
+        "pruned": False,
+    }
+
+
+async def prune_day(day, entry):
+    """
+    Delete the rows written to the day's Parquet file, by id. Rows committed to the
+    day after it was archived (late readings, backfills) are not in the file and stay.
+    """
+    start, end = day_bounds(day)
+    table = await asyncio.to_thread(pq.read_table, os.path.join(settings.archive_dir, entry["path"]), columns=["id"])
+    ids = table.column("id").to_pylist()
+    if len(ids) != entry["rows"]:
+        logger.warning("Not pruning %s: %s rows in the archive file, %s in the manifest", day, len(ids), entry['rows'])
+        return False
+
+    statement = delete(SensorData).where(SensorData.id == any_(bindparam("ids", type_=ARRAY(BigInteger))))
+    pruned = 0
+    async with AsyncSessionLocal() as db:
+        for chunk_start in range(0, len(ids), settings.archive_chunk_size):
+            result = await db.execute(statement, {"ids": ids[chunk_start:chunk_start + settings.archive_chunk_size]})
+            pruned += result.rowcount
+        # Delivered on commit, also when pruning from the CLI
+        await db.execute(select(func.pg_notify(CACHE_CHANNEL, "archive:*")))
+        remaining = (await db.execute(
+            select(func.count(SensorData.id))
+            .where(SensorData.timestamp >= start, SensorData.timestamp < end)
+        )).scalar_one()
+        await db.commit()
+
+    query_cache.invalidate_all()
+    logger.info("Pruned %s archived sensor readings for %s", pruned, day)
+    if remaining:
+        logger.warning("%s sensor readings for %s were written after it was archived and are kept", remaining, day)
+    return True
+
+
+async def run_archive(before=None, prune=None):
+    if before is None:
+        # Day bounds are UTC
+        before = datetime.now(timezone.utc).date() - timedelta(days=settings.archive_after_days)
+    if prune is None:
+        prune = settings.archive_prune
+
+    manifest = load_manifest()
+    archived = manifest["ranges"]
+
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(func.date(func.timezone("UTC", SensorData.timestamp)))
+            .where(SensorData.timestamp < datetime.combine(before, dt_time.min))
+            .distinct()
+        )
+        days = sorted(result.scalars().all())
+
+    for day in days:
+        if day.isoformat() not in archived:
+            archived[day.isoformat()] = await archive_day(day)
+            save_manifest(manifest)
+
+    if prune:
+        for day_key, entry in sorted(archived.items()):
+            if not entry["pruned"] and await prune_day(date.fromisoformat(day_key), entry):
+                entry["pruned"] = True
+                save_manifest(manifest)
+
+    return manifest
+
+
+def read_archive(device_id, start=None, end=None, limit=100):
+    manifest = load_manifest()
+    paths = [
+        os.path.join(settings.archive_dir, entry["path"])
+        for day_key, entry in sorted(manifest["ranges"].items(), reverse=True)
+        if (start is None or entry["end"] > start.isoformat()) and (end is None or entry["start"] <= end.isoformat())
+    ]
+    if not paths:
+        return []
+
+    condition = ds.field("device_id") == device_id
+    if start is not None:
+        condition &= ds.field("timestamp") >= pa.scalar(start, type=pa.timestamp("us"))
+    if end is not None:
+        condition &= ds.field("timestamp") < pa.scalar(end, type=pa.timestamp("us"))
+
+    table = ds.dataset(paths, schema=ARCHIVE_SCHEMA, format="parquet").to_table(filter=condition)
+    table = table.sort_by([("timestamp", "descending")]).slice(0, limit)
+    return table.to_pylist()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Archive sensor history to Parquet")
+    parser.add_argument("--before", type=date.fromisoformat,
+                        help="Archive days before this date (default: ARCHIVE_AFTER_DAYS ago)")
+    parser.add_argument("--prune", action="store_true", default=None,
+                        help="Delete archived days from the database")
+    args = parser.parse_args()
+
+    init_engine()
+    try:
+        manifest = await run_archive(before=args.before, prune=args.prune)
+    finally:
+        await dispose_engine()
+    print(json.dumps(manifest, indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,197 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import logging
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import Depends, HTTPException, Request
+from sqlalchemy import select
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.metrics import metrics
+from app.models import Device
+
+logger = logging.getLogger(__name__)
+
+SCRYPT_PREFIX = "scrypt"
+
+hash_seconds = metrics.histogram("auth_password_hash_seconds", "Time to hash or verify one password",
+                                 buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+token_checks = metrics.counter("auth_token_checks_total", "Bearer token checks by result")
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class PasswordHasher:
+    """
+    scrypt password hashes computed on a small thread pool, off the event loop.
+
+    hashlib.scrypt releases the GIL, so a hash costs the loop nothing but the hand-off;
+    the semaphore bounds the work queued behind the pool. Hashes are stored as
+    `scrypt$n$r$p$salt$key`; anything else is a legacy plain text password.
+    """
+
+    def __init__(self, workers, n, r, p):
+        self.workers = workers
+        self.params = (n, r, p)
+        self.executor = None
+        self.slots = None
+        # Verified against when the user doesn't exist, so a login costs the same either way
+        self.dummy_hash = f"{SCRYPT_PREFIX}${n}${r}${p}${_b64encode(bytes(16))}${_b64encode(bytes(32))}"
+
+    def _hash(self, password, salt, n, r, p):
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * r * n, dklen=32)
+
+    def hash_sync(self, password):
+        salt = secrets.token_bytes(16)
+        n, r, p = self.params
+        key = self._hash(password, salt, n, r, p)
+        return f"{SCRYPT_PREFIX}${n}${r}${p}${_b64encode(salt)}${_b64encode(key)}"
+
+    def verify_sync(self, password, stored):
+        """Return (matches, needs_rehash)."""
+        parts = stored.split("$")
+        if len(parts) != 6 or parts[0] != SCRYPT_PREFIX:
+            return hmac.compare_digest(password.encode(), stored.encode()), True
+
+        n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+        key = self._hash(password, _b64decode(parts[4]), n, r, p)
+        return hmac.compare_digest(key, _b64decode(parts[5])), (n, r, p) != self.params
+
+    async def _run(self, func, *args):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+            self.slots = asyncio.Semaphore(self.workers * 4)
+
+        async with self.slots:
+            started = time.perf_counter()
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+            finally:
+                hash_seconds.observe(time.perf_counter() - started)
+
+    async def hash(self, password):
+        return await self._run(self.hash_sync, password)
+
+    async def verify(self, password, stored):
+        return await self._run(self.verify_sync, password, stored)
+
+    def shutdown(self):
+        if self.executor:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+
+class TokenSigner:
+    """
+    Stateless bearer tokens `user_id.expires.signature` signed with HMAC-SHA256.
+
+    Checking one is a split, an HMAC and a comparison, with no database lookup.
+    """
+
+    def __init__(self, secret, ttl):
+        # Only without AUTH_REQUIRED (see check_auth_config): tokens of one worker fail on the others
+        if not secret:
+            secret = secrets.token_hex(32)
+        self.key = secret.encode()
+        self.ttl = ttl
+
+    def _sign(self, message):
+        return _b64encode(hmac.new(self.key, message.encode(), hashlib.sha256).digest())
+
+    def issue(self, user_id, now=None):
+        expires = int((now or time.time()) + self.ttl)
+        message = f"{user_id}.{expires}"
+        return f"{message}.{self._sign(message)}", expires
+
+    def verify(self, token, now=None):
+        """Return the user id of a valid, unexpired token, else None."""
+        try:
+            user_id, expires, signature = token.split(".")
+            expired = int(expires) < (now or time.time())
+            user_id = int(user_id)
+        except ValueError:
+            return None
+        if not hmac.compare_digest(signature.encode(), self._sign(f"{user_id}.{expires}").encode()) or expired:
+            return None
+        return user_id
+
+
+password_hasher = PasswordHasher(
+    settings.auth_hash_workers, settings.auth_scrypt_n, settings.auth_scrypt_r, settings.auth_scrypt_p)
+token_signer = TokenSigner(settings.auth_secret, settings.auth_token_ttl)
+admin_users = {int(user_id) for user_id in settings.auth_admin_users.split(",") if user_id.strip()}
+
+
+def check_auth_config():
+    """Called on startup: every worker has to sign and check tokens with the same key."""
+    if settings.auth_required and not settings.auth_secret:
+        raise RuntimeError("AUTH_SECRET must be set when AUTH_REQUIRED is true")
+
+
+async def require_user(request: Request):
+    """Dependency for authenticated routes; returns the user id of the bearer token."""
+    if not settings.auth_required:
+        return None
+
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    user_id = token_signer.verify(token.strip()) if scheme.lower() == "bearer" else None
+    if user_id is None:
+        token_checks.inc(result="rejected")
+        raise HTTPException(status_code=401, detail="Invalid or missing token",
+                            headers={"WWW-Authenticate": "Bearer"})
+
+    token_checks.inc(result="accepted")
+    request.state.user_id = user_id
+    return user_id
+
+
+async def require_admin(user_id=Depends(require_user)):
+    """Dependency for admin routes: the token's user must be listed in AUTH_ADMIN_USERS."""
+    if settings.auth_required and user_id not in admin_users:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return user_id
+
+
+async def require_self(id: int, user_id=Depends(require_user)):
+    """Dependency for /users/{id} routes that change the account: only its own token may."""
+    if settings.auth_required and id != user_id:
+        raise HTTPException(status_code=403, detail="Not allowed for another user")
+    return user_id
+
+
+async def check_device_owner(user_id, device_id):
+    """
+    404 unless the device belongs to the user (not checked without AUTH_REQUIRED).
+
+    Read from the database, not the per-process device cache: an owner change made
+    through another worker has to take effect here at once.
+    """
+    if not settings.auth_required:
+        return
+    async with AsyncSessionLocal() as db:
+        owner = (await db.execute(select(Device.user_id).where(Device.id == device_id))).scalar_one_or_none()
+    if owner is None or owner != user_id:
+        raise HTTPException(status_code=404, detail="Device not found")
+
+
+def check_assignee(user_id, owner_id):
+    """403 unless the user may give a device to `owner_id`: themselves, or anyone for admins."""
+    if settings.auth_required and owner_id != user_id and user_id not in admin_users:
+        raise HTTPException(status_code=403, detail="Not allowed to assign a device to another user")
+
+
+async def require_device_owner(device_id: int = 1, user_id=Depends(require_user)):
+    """Dependency for routes taking a `device_id` query parameter."""
+    await check_device_owner(user_id, device_id)
+    return user_id
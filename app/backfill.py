@@ -0,0 +1,211 @@
+import argparse
+import asyncio
+import csv
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+import asyncpg
+import orjson
+
+from app.config import settings
+from app.database import get_database_url
+from app.ingest import normalize
+from app.query_cache import query_cache, CACHE_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+SENSOR_COLUMNS = ["device_id", "water_level", "beans_level", "timestamp", "anomaly_flags"]
+
+SAVE_CHECKPOINT = """
+    INSERT INTO backfill_checkpoints (source, worker, workers, position, rows, updated_at)
+    VALUES ($1, $2, $3, $4, $5, $6)
+    ON CONFLICT (source, worker) DO UPDATE
+    SET position = EXCLUDED.position, rows = backfill_checkpoints.rows + EXCLUDED.rows,
+        updated_at = EXCLUDED.updated_at
+"""
+
+
+def parse_timestamp(value):
+    """ISO 8601 string or epoch seconds -> UTC datetime (naive strings are UTC), None if unusable."""
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            pass
+    try:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return datetime.fromtimestamp(value, timezone.utc)
+        timestamp = datetime.fromisoformat(value)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+    # COPY into timestamptz reads naive datetimes as local time, so always send UTC
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(timezone.utc)
+
+
+def to_row(payload):
+    """Normalize one archived reading like live ingest; returns a sensors_data row or None."""
+    # Live ingest defaults a missing device_id to device 1, a dump must name the device
+    if payload.get("device_id") in (None, ""):
+        return None
+    record = normalize(payload)
+    if record is None or (record["water_level"] is None and record["beans_level"] is None):
+        return None
+    timestamp = parse_timestamp(payload.get("timestamp"))
+    if timestamp is None:
+        return None
+    return record["device_id"], record["water_level"], record["beans_level"], timestamp, 0
+
+
+def read_rows(path, start=0):
+    """
+    Stream (end offset, row or None) for each line of an NDJSON or CSV dump (optionally .gz),
+    starting at byte offset `start`. CSV files need a header line and one record per line.
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    is_csv = path.removesuffix(".gz").endswith(".csv")
+    with opener(path, "rb") as dump:
+        header = None
+        if is_csv:
+            header = next(csv.reader([dump.readline().decode()]))
+        if start > dump.tell():
+            dump.seek(start)
+        offset = dump.tell()
+
+        for line in dump:
+            offset += len(line)
+            if not line.strip():
+                continue
+            try:
+                if is_csv:
+                    payload = dict(zip(header, next(csv.reader([line.decode()]))))
+                else:
+                    payload = orjson.loads(line)
+                row = to_row(payload) if isinstance(payload, dict) else None
+            except (ValueError, UnicodeDecodeError):
+                row = None
+            yield offset, row
+
+
+def read_chunk(rows, size):
+    chunk = []
+    for item in rows:
+        chunk.append(item)
+        if len(chunk) >= size:
+            break
+    return chunk
+
+
+class Backfill:
+    """
+    Loads dumps into sensors_data with COPY, `workers` connections in parallel.
+
+    Devices are split between the workers by id, and each worker commits its COPY
+    together with its checkpoint (the byte offset it has loaded up to), so a
+    restarted run skips exactly the rows that were committed. The same commit
+    notifies the service's query caches of the devices it loaded.
+    """
+
+    def __init__(self, dsn, workers, batch_size):
+        self.dsn = dsn
+        self.workers = workers
+        self.batch_size = batch_size
+        self.connections = []
+        self.devices = set()
+
+    async def connect(self):
+        self.connections = [await asyncpg.connect(self.dsn) for _ in range(self.workers)]
+        self.devices = {row["id"] for row in await self.connections[0].fetch("SELECT id FROM devices")}
+
+    async def close(self):
+        await asyncio.gather(*(connection.close() for connection in self.connections))
+        self.connections = []
+
+    async def checkpoints(self, source, restart=False):
+        connection = self.connections[0]
+        if restart:
+            await connection.execute("DELETE FROM backfill_checkpoints WHERE source = $1", source)
+            return [0] * self.workers
+
+        rows = await connection.fetch(
+            "SELECT worker, workers, position FROM backfill_checkpoints WHERE source = $1", source)
+        if any(row["workers"] != self.workers for row in rows):
+            raise ValueError(f"{source} was loaded with {rows[0]['workers']} workers, resume with the same number "
+                             f"or pass --restart")
+        positions = [0] * self.workers
+        for row in rows:
+            positions[row["worker"]] = row["position"]
+        return positions
+
+    async def copy(self, worker, source, rows, position):
+        connection = self.connections[worker]
+        async with connection.transaction():
+            if rows:
+                await connection.copy_records_to_table("sensors_data", columns=SENSOR_COLUMNS, records=rows)
+                # Delivered on commit, like the invalidations of archive pruning
+                for payload in query_cache.payloads(sorted({row[0] for row in rows})):
+                    await connection.execute("SELECT pg_notify($1, $2)", CACHE_CHANNEL, payload)
+            await connection.execute(SAVE_CHECKPOINT, source, worker, self.workers, position, len(rows),
+                                     datetime.utcnow())
+
+    async def run(self, path, source, restart=False):
+        positions = await self.checkpoints(source, restart)
+        stats = {"source": source, "rows": 0, "rejected": 0, "unknown_device": 0}
+        started = time.perf_counter()
+
+        rows = read_rows(path, min(positions))
+        chunk = await asyncio.to_thread(read_chunk, rows, self.batch_size * self.workers)
+        while chunk:
+            batches = [[] for _ in range(self.workers)]
+            for offset, row in chunk:
+                if row is None:
+                    stats["rejected"] += 1
+                elif row[0] not in self.devices:
+                    stats["unknown_device"] += 1
+                elif offset > positions[row[0] % self.workers]:
+                    batches[row[0] % self.workers].append(row)
+
+            # Parse the next chunk while this one is copied
+            position = chunk[-1][0]
+            _, chunk = await asyncio.gather(
+                asyncio.gather(*(self.copy(worker, source, batch, position) for worker, batch in enumerate(batches))),
+                asyncio.to_thread(read_chunk, rows, self.batch_size * self.workers)
+            )
+            positions = [position] * self.workers
+            stats["rows"] += sum(len(batch) for batch in batches)
+            elapsed = time.perf_counter() - started
+            logger.info("%s: copied %s rows (%.0f rows/s)", source, stats["rows"], stats["rows"] / elapsed)
+
+        stats["seconds"] = round(time.perf_counter() - started, 3)
+        stats["rows_per_second"] = round(stats["rows"] / stats["seconds"]) if stats["seconds"] else 0
+        return stats
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Bulk-load archived sensor readings (NDJSON or CSV) with COPY")
+    parser.add_argument("paths", nargs="+", help="Dump files (.ndjson, .jsonl or .csv, optionally .gz)")
+    parser.add_argument("--workers", type=int, default=settings.backfill_workers,
+                        help="Parallel COPY connections, devices are split between them")
+    parser.add_argument("--batch-size", type=int, default=settings.backfill_batch_size,
+                        help="Rows per COPY and worker")
+    parser.add_argument("--restart", action="store_true", help="Ignore existing checkpoints")
+    args = parser.parse_args()
+
+    backfill = Backfill(get_database_url().replace("postgresql+asyncpg://", "postgresql://"),
+                        args.workers, args.batch_size)
+    await backfill.connect()
+    try:
+        results = [await backfill.run(path, os.path.abspath(path), args.restart) for path in args.paths]
+    finally:
+        await backfill.close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
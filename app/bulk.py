@@ -0,0 +1,62 @@
+import logging
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+from fastapi import HTTPException
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def reject_batch(results, message):
+    for result in results:
+        if result["status"] != "failed":
+            result.update(status="not_created", id=None)
+    raise HTTPException(status_code=400, detail={"message": message, "results": results})
+
+
+async def insert_one_by_one(db, statement, rows, results, indexes):
+    for index in indexes:
+        try:
+            async with db.begin_nested():
+                result = await db.execute(statement, [rows[index]])
+            results[index].update(status="created", id=result.scalar_one())
+        except SQLAlchemyError:
+            results[index].update(status="failed", error="Database error while inserting")
+
+
+async def bulk_insert(db, model, rows, results, atomic):
+    """
+    Insert validated rows with one INSERT ... RETURNING per chunk.
+
+    `rows` maps the item index in the request to its column values and `results`
+    is the per-item result list, updated in place. In atomic mode any failure
+    rejects the whole batch; otherwise each chunk runs in its own savepoint and a
+    failing chunk is retried one item per savepoint, so only the bad items fail.
+    """
+    indexes = list(rows)
+    statement = insert(model).returning(model.id, sort_by_parameter_order=True)
+
+    for start in range(0, len(indexes), settings.bulk_chunk_size):
+        chunk = indexes[start:start + settings.bulk_chunk_size]
+        try:
+            if atomic:
+                result = await db.execute(statement, [rows[index] for index in chunk])
+            else:
+                async with db.begin_nested():
+                    result = await db.execute(statement, [rows[index] for index in chunk])
+            ids = result.scalars().all()
+        except SQLAlchemyError as e:
+            logger.error("Bulk insert into %s failed: %s", model.__tablename__, e)
+            if atomic:
+                await db.rollback()
+                reject_batch(results, "Batch rejected, nothing was created")
+            await insert_one_by_one(db, statement, rows, results, chunk)
+            continue
+
+        for index, new_id in zip(chunk, ids):
+            results[index].update(status="created", id=new_id)
+
+    await db.commit()
+    created = sum(1 for result in results if result["status"] == "created")
+    return {"created": created, "failed": len(results) - created, "results": results}
@@ -0,0 +1,163 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict, deque
+import logging
+
+from app.config import settings
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Pseudo event of any message carrying water or beans levels
+SENSOR_READING = "sensor_reading"
+
+# Status/action reported by the ESP32 once it has executed a command. Other actions
+# have nothing to be acknowledged by and aren't tracked.
+ACK_EVENTS = {
+    "single_brew": "single_brew_completed",
+    "double_brew": "double_brew_completed",
+    "cleaning": "cleaning_completed",
+    "power_toggle": "power_toggle",
+    "read_sensors": SENSOR_READING,
+}
+
+commands_sent = metrics.counter("commands_sent_total", "Commands published to devices")
+commands_finished = metrics.counter("commands_finished_total", "Tracked commands by final status")
+commands_in_flight = metrics.gauge("commands_in_flight", "Commands waiting for an acknowledgement")
+ack_latency = metrics.histogram("command_ack_latency_seconds", "Round-trip time from publish to device acknowledgement")
+
+
+class TrackedCommand:
+    __slots__ = ("correlation_id", "action", "device_id", "sent_at", "started", "status", "latency", "future",
+                 "timer")
+
+    def __init__(self, correlation_id, action, device_id):
+        self.correlation_id = correlation_id
+        self.action = action
+        self.device_id = device_id
+        self.sent_at = time.time()
+        # Latency is measured on the monotonic clock, sent_at is only reported
+        self.started = time.monotonic()
+        self.status = "pending"
+        self.latency = None
+        self.future = None
+        self.timer = None
+
+    def to_dict(self):
+        return {
+            "correlation_id": self.correlation_id,
+            "action": self.action,
+            "device_id": self.device_id,
+            "status": self.status,
+            "sent_at": self.sent_at,
+            "latency": self.latency,
+        }
+
+
+class CommandTracker:
+    def __init__(self, timeout, wait_timeout, max_finished=1000):
+        self.timeout = timeout
+        self.wait_timeout = wait_timeout
+        self.max_finished = max_finished
+        self.pending = {}
+        self.finished = OrderedDict()
+        # (device_id, ack event) -> correlation ids in publish order, for acks that don't echo the id
+        self.awaiting_event = {}
+
+    def register(self, command, device_id):
+        """Track a command about to be published; returns its correlation id, None if it can't be acked."""
+        event = ACK_EVENTS.get(command.get("action"))
+        if event is None:
+            return None
+        correlation_id = command.get("correlation_id") or uuid.uuid4().hex
+        command["correlation_id"] = correlation_id
+
+        entry = TrackedCommand(correlation_id, command.get("action"), device_id)
+        loop = asyncio.get_running_loop()
+        entry.future = loop.create_future()
+        entry.timer = loop.call_later(self.timeout, self._expire, correlation_id)
+        self.pending[correlation_id] = entry
+        self.awaiting_event.setdefault((device_id, event), deque()).append(correlation_id)
+
+        commands_sent.inc(action=entry.action)
+        commands_in_flight.set(len(self.pending))
+        return correlation_id
+
+    def acknowledge(self, device_id, event=None, correlation_id=None):
+        if correlation_id is None:
+            queue = self.awaiting_event.get((device_id, event))
+            if not queue:
+                return None
+            correlation_id = queue[0]
+
+        entry = self.pending.get(correlation_id)
+        # Another device can't acknowledge the command, even with its correlation id
+        if entry is None or entry.device_id != device_id:
+            return None
+
+        entry.latency = time.monotonic() - entry.started
+        ack_latency.observe(entry.latency, action=entry.action)
+        self._finish(entry, "acknowledged")
+        return entry
+
+    def acknowledge_message(self, device_id, record):
+        """Acknowledge from a normalized ingest record (see app.ingest.normalize)."""
+        if record["correlation_id"]:
+            return self.acknowledge(device_id, correlation_id=record["correlation_id"])
+        acknowledged = None
+        if record["event"]:
+            acknowledged = self.acknowledge(device_id, event=record["event"])
+        if record["water_level"] is not None or record["beans_level"] is not None:
+            acknowledged = self.acknowledge(device_id, event=SENSOR_READING) or acknowledged
+        return acknowledged
+
+    def fail(self, correlation_id):
+        entry = self.pending.get(correlation_id)
+        if entry is not None:
+            self._finish(entry, "failed")
+
+    def status(self, correlation_id):
+        entry = self.pending.get(correlation_id) or self.finished.get(correlation_id)
+        return entry.to_dict() if entry else None
+
+    async def wait(self, correlation_id, timeout=None):
+        """Wait up to `timeout` (default `wait_timeout`) seconds for the ack; returns the status."""
+        timeout = self.wait_timeout if timeout is None else timeout
+        entry = self.pending.get(correlation_id)
+        if entry is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(entry.future), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.status(correlation_id)
+
+    def _expire(self, correlation_id):
+        entry = self.pending.get(correlation_id)
+        if entry is not None:
+            logger.warning("Command %s (%s) to device %s was not acknowledged", entry.action, correlation_id, entry.device_id)
+            self._finish(entry, "timeout")
+
+    def _finish(self, entry, status):
+        del self.pending[entry.correlation_id]
+        entry.status = status
+        entry.timer.cancel()
+        if not entry.future.done():
+            entry.future.set_result(status)
+
+        event = ACK_EVENTS.get(entry.action)
+        queue = self.awaiting_event.get((entry.device_id, event))
+        if queue is not None:
+            queue.remove(entry.correlation_id)
+            if not queue:
+                del self.awaiting_event[(entry.device_id, event)]
+
+        self.finished[entry.correlation_id] = entry
+        while len(self.finished) > self.max_finished:
+            self.finished.popitem(last=False)
+
+        commands_finished.inc(action=entry.action, status=status)
+        commands_in_flight.set(len(self.pending))
+
+
+command_tracker = CommandTracker(timeout=settings.command_ack_timeout, wait_timeout=settings.command_wait_timeout)
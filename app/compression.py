@@ -0,0 +1,146 @@
+import math
+
+import numpy as np
+
+from app.config import settings
+from app.metrics import metrics
+
+readings_offered = metrics.counter("sensor_readings_compression_total", "Sensor readings by compression outcome")
+
+COMPRESSION_MODES = ("off", "deadband", "swinging_door")
+
+
+class DeviceSeries:
+    __slots__ = ("time", "values", "upper", "lower", "pending")
+
+    def __init__(self, time, values):
+        self.time = time
+        self.values = values
+        self.upper = [math.inf, math.inf]
+        self.lower = [-math.inf, -math.inf]
+        self.pending = None
+
+
+class SensorCompressor:
+    """
+    Decides which (water, beans) readings are stored, keeping the last stored point per device.
+
+    "deadband" stores a reading when either level moves more than its tolerance away from
+    the last stored one; reads reconstruct the series by carrying the last value forward.
+    "swinging_door" stores the previous reading once the straight line from the last stored
+    point to the new one would pass further than tolerance from a reading in between, so
+    linear interpolation between stored points stays within tolerance. The newest reading
+    is also stored once it is more than tolerance away from the last stored point, so the
+    latest stored level (what the statistics and predictions read) never lags further.
+    In both modes a reading is stored once `heartbeat` seconds pass without a stored point.
+    """
+
+    def __init__(self, mode, water_tolerance, beans_tolerance, heartbeat):
+        if mode not in COMPRESSION_MODES:
+            raise ValueError(f"Unknown sensor compression mode: {mode}")
+        self.mode = mode
+        self.tolerance = (water_tolerance, beans_tolerance)
+        self.heartbeat = heartbeat
+        self.series = {}
+
+    def offer(self, device_id, timestamp, water_level, beans_level):
+        """Return the (timestamp, water, beans) points to store for this reading, possibly none."""
+        reading = (timestamp, water_level, beans_level)
+        if self.mode == "off" or water_level is None or beans_level is None:
+            return [reading]
+
+        values = (water_level, beans_level)
+        series = self.series.get(device_id)
+        if series is None:
+            self.series[device_id] = DeviceSeries(timestamp, values)
+            return self._stored([reading])
+
+        elapsed = (timestamp - series.time).total_seconds()
+        if elapsed <= 0:
+            readings_offered.inc(outcome="suppressed")
+            return []
+
+        if self.mode == "deadband":
+            points = []
+            if self._moved(series, values) or elapsed >= self.heartbeat:
+                series.time, series.values = timestamp, values
+                points.append(reading)
+            return self._stored(points)
+
+        points = []
+        if self._door_closed(series, elapsed, values):
+            # Store the previous reading and swing the doors again from it
+            points.append(series.pending)
+            series.time, series.values = series.pending[0], series.pending[1:]
+            series.upper = [math.inf, math.inf]
+            series.lower = [-math.inf, -math.inf]
+            series.pending = None
+            elapsed = (timestamp - series.time).total_seconds()
+            if elapsed <= 0:
+                # Same timestamp as the reading just stored
+                return self._stored(points)
+            self._door_closed(series, elapsed, values)
+
+        if self._moved(series, values) or elapsed >= self.heartbeat:
+            points.append(reading)
+            self.series[device_id] = DeviceSeries(timestamp, values)
+        else:
+            series.pending = reading
+        return self._stored(points)
+
+    def drain(self):
+        """Take the (device_id, reading) pairs offered but not stored yet, e.g. on shutdown."""
+        pending = [(device_id, series.pending) for device_id, series in self.series.items() if series.pending]
+        for device_id, reading in pending:
+            series = self.series[device_id]
+            series.time, series.values, series.pending = reading[0], reading[1:], None
+            series.upper = [math.inf, math.inf]
+            series.lower = [-math.inf, -math.inf]
+        return pending
+
+    def _moved(self, series, values):
+        return any(abs(value - stored) > tolerance
+                   for value, stored, tolerance in zip(values, series.values, self.tolerance))
+
+    def _door_closed(self, series, elapsed, values):
+        # The line to this reading must stay within tolerance of every reading since the stored point
+        slopes = [(value - stored) / elapsed for value, stored in zip(values, series.values)]
+        if any(slope > upper or slope < lower for slope, upper, lower in zip(slopes, series.upper, series.lower)):
+            return True
+
+        for index, (value, stored, tolerance) in enumerate(zip(values, series.values, self.tolerance)):
+            series.upper[index] = min(series.upper[index], (value + tolerance - stored) / elapsed)
+            series.lower[index] = max(series.lower[index], (value - tolerance - stored) / elapsed)
+        return False
+
+    def _stored(self, points):
+        readings_offered.inc(outcome="stored" if points else "suppressed")
+        return points
+
+
+def reconstruct(times, levels, grid, method):
+    """
+    Resample stored readings onto `grid` (all epoch seconds, `times` ascending).
+
+    "previous" carries the last stored value forward (deadband), "linear" interpolates
+    between stored points (swinging door). Grid points before the first reading are NaN.
+    """
+    valid = ~np.isnan(levels)
+    times, levels = times[valid], levels[valid]
+    if len(times) == 0:
+        return np.full(len(grid), np.nan)
+
+    if method == "linear":
+        values = np.interp(grid, times, levels)
+    else:
+        values = levels[np.clip(np.searchsorted(times, grid, side="right") - 1, 0, None)]
+    values[grid < times[0]] = np.nan
+    return values
+
+
+sensor_compressor = SensorCompressor(
+    settings.sensor_compression,
+    settings.compression_water_tolerance,
+    settings.compression_beans_tolerance,
+    settings.compression_heartbeat
+)
@@ -3,9 +3,130 @@ from typing import Optional
 import os
 
 class Settings(BaseModel):
+    # Database Settings
+    db_pool_size: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    db_max_overflow: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    db_pool_prewarm: int = int(os.getenv("DB_POOL_PREWARM", "5"))
+
     # MQTT Settings
     mqtt_broker_host: str = os.getenv("MQTT_BROKER_HOST", "mqtt")
     mqtt_broker_port: int = int(os.getenv("MQTT_BROKER_PORT", "1883"))
     mqtt_topic: str = os.getenv("MQTT_TOPIC", "coffee_machine/#")
+    # Topic of every command sent to a device, single or bulk
+    mqtt_device_command_topic: str = os.getenv("MQTT_DEVICE_COMMAND_TOPIC", "coffee_machine/{device_id}/commands")
+    mqtt_publish_window: int = int(os.getenv("MQTT_PUBLISH_WINDOW", "100"))
+    bulk_command_max_devices: int = int(os.getenv("BULK_COMMAND_MAX_DEVICES", "10000"))
+    command_ack_timeout: float = float(os.getenv("COMMAND_ACK_TIMEOUT", "120"))
+    # How long wait_for_ack / ?wait=true hold the request without an explicit timeout
+    command_wait_timeout: float = float(os.getenv("COMMAND_WAIT_TIMEOUT", "10"))
+
+    # Ingest decoding: 0 workers decodes on the event loop, otherwise in a process pool
+    ingest_decode_workers: int = int(os.getenv("INGEST_DECODE_WORKERS", "0"))
+    ingest_batch_size: int = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+    ingest_linger: float = float(os.getenv("INGEST_LINGER", "0.05"))
+    ingest_max_pending_batches: int = int(os.getenv("INGEST_MAX_PENDING_BATCHES", "8"))
+
+    # Command admission control (token buckets per client and per device)
+    rate_limit_enabled: bool = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+    rate_limit_client_rate: float = float(os.getenv("RATE_LIMIT_CLIENT_RATE", "5"))
+    rate_limit_client_burst: float = float(os.getenv("RATE_LIMIT_CLIENT_BURST", "20"))
+    rate_limit_device_rate: float = float(os.getenv("RATE_LIMIT_DEVICE_RATE", "0.5"))
+    rate_limit_device_burst: float = float(os.getenv("RATE_LIMIT_DEVICE_BURST", "5"))
+    rate_limit_max_keys: int = int(os.getenv("RATE_LIMIT_MAX_KEYS", "200000"))
+    rate_limit_max_in_flight: int = int(os.getenv("RATE_LIMIT_MAX_IN_FLIGHT", "200"))
+
+    # Bulk provisioning
+    bulk_chunk_size: int = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+    bulk_max_devices: int = int(os.getenv("BULK_MAX_DEVICES", "10000"))
+    # Every user costs a scrypt hash (~50 ms on one AUTH_HASH_WORKERS thread)
+    bulk_max_users: int = int(os.getenv("BULK_MAX_USERS", "100"))
+
+    # Ingest compression of stored readings: "off", "deadband" or "swinging_door"
+    sensor_compression: str = os.getenv("SENSOR_COMPRESSION", "off")
+    compression_water_tolerance: float = float(os.getenv("COMPRESSION_WATER_TOLERANCE", "1"))
+    compression_beans_tolerance: float = float(os.getenv("COMPRESSION_BEANS_TOLERANCE", "1"))
+    compression_heartbeat: float = float(os.getenv("COMPRESSION_HEARTBEAT", "900"))
+
+    # Device event log: buffered events are flushed with the daily usage rollup
+    usage_flush_interval: float = float(os.getenv("USAGE_FLUSH_INTERVAL", "1"))
+    usage_flush_batch: int = int(os.getenv("USAGE_FLUSH_BATCH", "1000"))
+    usage_max_buffered: int = int(os.getenv("USAGE_MAX_BUFFERED", "100000"))
+
+    # Outbound stream of readings and device events: "off", "kafka", "file" (NDJSON) or "memory"
+    stream_sink: str = os.getenv("STREAM_SINK", "off")
+    stream_kafka_bootstrap_servers: str = os.getenv("STREAM_KAFKA_BOOTSTRAP_SERVERS", "kafka:9092")
+    stream_topic_prefix: str = os.getenv("STREAM_TOPIC_PREFIX", "coffee_machine")
+    stream_file_path: str = os.getenv("STREAM_FILE_PATH", "stream.ndjson")
+    stream_batch_size: int = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+    stream_linger: float = float(os.getenv("STREAM_LINGER", "0.1"))
+    stream_queue_size: int = int(os.getenv("STREAM_QUEUE_SIZE", "10000"))
+    # Sends of a failing batch before it is dropped, 0 retries until it goes through
+    stream_max_attempts: int = int(os.getenv("STREAM_MAX_ATTEMPTS", "0"))
+
+    # Alert rules as a JSON list (empty uses app.alerts.DEFAULT_ALERT_RULES), delivered to comma-separated webhooks
+    alert_rules: str = os.getenv("ALERT_RULES", "")
+    alert_webhook_urls: str = os.getenv("ALERT_WEBHOOK_URLS", "")
+    alert_webhook_timeout: float = float(os.getenv("ALERT_WEBHOOK_TIMEOUT", "5"))
+    alert_batch_size: int = int(os.getenv("ALERT_BATCH_SIZE", "100"))
+    alert_linger: float = float(os.getenv("ALERT_LINGER", "1"))
+    alert_queue_size: int = int(os.getenv("ALERT_QUEUE_SIZE", "1000"))
+    alert_max_attempts: int = int(os.getenv("ALERT_MAX_ATTEMPTS", "5"))
+
+    # Authentication: scrypt password hashes and HMAC-signed bearer tokens for the command routes
+    auth_required: bool = os.getenv("AUTH_REQUIRED", "true").lower() == "true"
+    auth_secret: str = os.getenv("AUTH_SECRET", "")
+    auth_admin_users: str = os.getenv("AUTH_ADMIN_USERS", "")
+    auth_token_ttl: int = int(os.getenv("AUTH_TOKEN_TTL", "43200"))
+    auth_hash_workers: int = int(os.getenv("AUTH_HASH_WORKERS", "2"))
+    auth_scrypt_n: int = int(os.getenv("AUTH_SCRYPT_N", "16384"))
+    auth_scrypt_r: int = int(os.getenv("AUTH_SCRYPT_R", "8"))
+    auth_scrypt_p: int = int(os.getenv("AUTH_SCRYPT_P", "1"))
+
+    # Logging: "json" or "text" lines written off the event loop; LOG_SAMPLING keeps 1 in N per category
+    log_level: str = os.getenv("LOG_LEVEL", "INFO")
+    log_format: str = os.getenv("LOG_FORMAT", "json")
+    log_sampling: str = os.getenv("LOG_SAMPLING", "ingest.payload=100,ingest.saved=100,ingest.other=100")
+    db_echo: bool = os.getenv("DB_ECHO", "false").lower() == "true"
+
+    # Device presence: offline after this many seconds without a message or on the MQTT Last Will
+    presence_timeout: int = int(os.getenv("PRESENCE_TIMEOUT", "120"))
+    presence_flush_interval: float = float(os.getenv("PRESENCE_FLUSH_INTERVAL", "5"))
+
+    # Per-device sensor query result cache (0 disables it)
+    query_cache_size: int = int(os.getenv("QUERY_CACHE_SIZE", "10000"))
+
+    # Sensor history archive
+    archive_enabled: bool = os.getenv("ARCHIVE_ENABLED", "false").lower() == "true"
+    archive_dir: str = os.getenv("ARCHIVE_DIR", "archive")
+    archive_after_days: int = int(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+    archive_chunk_size: int = int(os.getenv("ARCHIVE_CHUNK_SIZE", "50000"))
+    archive_compression: str = os.getenv("ARCHIVE_COMPRESSION", "zstd")
+    archive_prune: bool = os.getenv("ARCHIVE_PRUNE", "false").lower() == "true"
+    archive_job_timeout: float = float(os.getenv("ARCHIVE_JOB_TIMEOUT", "3600"))
+
+    # Backfill CLI (python -m app.backfill)
+    backfill_workers: int = int(os.getenv("BACKFILL_WORKERS", "2"))
+    backfill_batch_size: int = int(os.getenv("BACKFILL_BATCH_SIZE", "50000"))
+
+    # Scheduled jobs (one instance runs each slot, see app.scheduler)
+    scheduler_jitter: float = float(os.getenv("SCHEDULER_JITTER", "30"))
+    scheduler_retry_delay: float = float(os.getenv("SCHEDULER_RETRY_DELAY", "60"))
+
+    # Consumption forecast
+    forecast_window_hours: int = int(os.getenv("FORECAST_WINDOW_HOURS", "24"))
+    forecast_refill_threshold: float = float(os.getenv("FORECAST_REFILL_THRESHOLD", "10"))
+    forecast_min_samples: int = int(os.getenv("FORECAST_MIN_SAMPLES", "3"))
+
+    # Ingest anomaly detection: "off", "flag" (store with anomaly_flags) or "quarantine" (don't store)
+    anomaly_detection: str = os.getenv("ANOMALY_DETECTION", "off")
+    anomaly_ewma_alpha: float = float(os.getenv("ANOMALY_EWMA_ALPHA", "0.1"))
+    anomaly_spike_sigma: float = float(os.getenv("ANOMALY_SPIKE_SIGMA", "4"))
+    anomaly_min_std: float = float(os.getenv("ANOMALY_MIN_STD", "2"))
+    anomaly_max_drop: float = float(os.getenv("ANOMALY_MAX_DROP", "30"))
+    anomaly_refill_level: float = float(os.getenv("ANOMALY_REFILL_LEVEL", "90"))
+    anomaly_stuck_brews: int = int(os.getenv("ANOMALY_STUCK_BREWS", "3"))
+    anomaly_warmup: int = int(os.getenv("ANOMALY_WARMUP", "10"))
+    anomaly_max_devices: int = int(os.getenv("ANOMALY_MAX_DEVICES", "1000000"))
+    anomaly_quarantine_size: int = int(os.getenv("ANOMALY_QUARANTINE_SIZE", "1000"))
 
 settings = Settings()
\ No newline at end of file
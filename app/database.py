@@ -1,28 +1,35 @@
+import asyncio
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 import os
 from dotenv import load_dotenv
 
+from app.config import settings
+
 # Load environment variables
 load_dotenv()
 
-# Get the database URL from environment variables
-DATABASE_URL = os.getenv("DATABASE_URL")
-if not DATABASE_URL:
-    raise ValueError("No DATABASE_URL environment variable found. Please set it in your .env file.")
 
-# Convert to async URL if it's not already
-if DATABASE_URL.startswith("postgresql://"):
-    DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://")
-elif not DATABASE_URL.startswith("postgresql+asyncpg://"):
-    DATABASE_URL = f"postgresql+asyncpg://{DATABASE_URL}"
+def get_database_url():
+    # Get the database URL from environment variables
+    DATABASE_URL = os.getenv("DATABASE_URL")
+    if not DATABASE_URL:
+        raise ValueError("No DATABASE_URL environment variable found. Please set it in your .env file.")
+
+    # Convert to async URL if it's not already
+    if DATABASE_URL.startswith("postgresql://"):
+        DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://")
+    elif not DATABASE_URL.startswith("postgresql+asyncpg://"):
+        DATABASE_URL = f"postgresql+asyncpg://{DATABASE_URL}"
+    return DATABASE_URL
+
 
-# Create async SQLAlchemy engine
-engine = create_async_engine(DATABASE_URL, echo=True)
+# Async SQLAlchemy engine, created by init_engine() on startup
+engine = None
 
-# Create async session factory
+# Async session factory, bound to the engine by init_engine()
 AsyncSessionLocal = async_sessionmaker(
-    engine,
     class_=AsyncSession,
     expire_on_commit=False
 )
@@ -30,6 +37,43 @@ AsyncSessionLocal = async_sessionmaker(
 # Base class for models
 Base = declarative_base()
 
+
+def init_engine(url=None):
+    global engine
+    if engine is None:
+        engine = create_async_engine(
+            url or get_database_url(),
+            echo=settings.db_echo,
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_pre_ping=True
+        )
+        AsyncSessionLocal.configure(bind=engine)
+    return engine
+
+
+async def prewarm_pool(count):
+    """
+    Open `count` pooled connections up front so the first requests after a
+    deploy don't pay for connection setup.
+    """
+    count = min(count, settings.db_pool_size)
+    connections = await asyncio.gather(*(engine.connect() for _ in range(count)))
+    try:
+        await asyncio.gather(*(connection.execute(text("SELECT 1")) for connection in connections))
+    finally:
+        for connection in connections:
+            await connection.close()
+    return count
+
+
+async def dispose_engine():
+    global engine
+    if engine is not None:
+        await engine.dispose()
+        engine = None
+
+
 async def get_db():
     """
     Dependency function to get an async DB session
@@ -38,4 +82,4 @@ async def get_db():
         try:
             yield session
         finally:
-            await session.close()
\ No newline at end of file
+            await session.close()
@@ -0,0 +1,48 @@
+import logging
+from collections import namedtuple
+from sqlalchemy import select
+
+from app.database import AsyncSessionLocal
+from app.models import Device
+
+logger = logging.getLogger(__name__)
+
+CachedDevice = namedtuple("CachedDevice", ["id", "user_id", "device_name"])
+
+
+class DeviceCache:
+    """
+    In-memory copy of the devices table, loaded on startup.
+
+    It only answers "is this a known device" for the hot paths; anything not in
+    the cache (e.g. created by another worker) is looked up in the database and
+    added, so a miss never rejects a valid device.
+    """
+
+    def __init__(self):
+        self.devices = {}
+        self.loaded = False
+
+    async def load(self):
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(Device.id, Device.user_id, Device.device_name)
+            )
+            self.devices = {row.id: CachedDevice(*row) for row in result.all()}
+        self.loaded = True
+        logger.info("Loaded %s devices into the device cache", len(self.devices))
+
+    def __contains__(self, device_id):
+        return device_id in self.devices
+
+    def get(self, device_id):
+        return self.devices.get(device_id)
+
+    def add(self, device):
+        self.devices[device.id] = CachedDevice(device.id, device.user_id, device.device_name)
+
+    def remove(self, device_id):
+        self.devices.pop(device_id, None)
+
+
+device_cache = DeviceCache()
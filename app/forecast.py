@@ -0,0 +1,81 @@
+from datetime import timezone
+
+import numpy as np
+
+
+def fit_consumption(device_ids, times, levels, refill_threshold, min_samples=3):
+    """
+    Fit a linear consumption rate for every device at once.
+
+    Inputs are parallel arrays sorted by (device_id, time), with times in epoch
+    seconds. A rise of more than `refill_threshold` between consecutive readings
+    starts a new segment, and only each device's latest segment (since its last
+    refill) is used for the fit. Returns arrays with one entry per device.
+    """
+    valid = ~np.isnan(levels)
+    device_ids, times, levels = device_ids[valid], times[valid], levels[valid]
+    count = len(device_ids)
+    if count == 0:
+        empty = np.empty(0)
+        return {"device_id": empty.astype(np.int64), "level": empty, "last_time": empty,
+                "rate": empty, "hours_to_empty": empty, "samples": empty.astype(np.int64)}
+
+    new_device = np.ones(count, dtype=bool)
+    new_device[1:] = device_ids[1:] != device_ids[:-1]
+    refill = np.zeros(count, dtype=bool)
+    refill[1:] = (levels[1:] - levels[:-1]) > refill_threshold
+
+    device_index = np.cumsum(new_device) - 1
+    segment = np.cumsum(new_device | refill) - 1
+    last_row = np.append(np.flatnonzero(new_device)[1:] - 1, count - 1)
+    current = segment == segment[last_row][device_index]
+
+    # Least squares per device from grouped sums; x is hours relative to the device's latest reading
+    group = device_index[current]
+    x = (times[current] - times[last_row][group]) / 3600.0
+    y = levels[current]
+    devices = len(last_row)
+    n = np.bincount(group, minlength=devices).astype(float)
+    sx = np.bincount(group, weights=x, minlength=devices)
+    sy = np.bincount(group, weights=y, minlength=devices)
+    sxx = np.bincount(group, weights=x * x, minlength=devices)
+    sxy = np.bincount(group, weights=x * y, minlength=devices)
+
+    denominator = n * sxx - sx * sx
+    fitted = (n >= min_samples) & (denominator > 0)
+    slope = np.full(devices, np.nan)
+    np.divide(n * sxy - sx * sy, denominator, out=slope, where=fitted)
+
+    rate = 0.0 - slope
+    level = levels[last_row]
+    hours_to_empty = np.full(devices, np.nan)
+    np.divide(level, rate, out=hours_to_empty, where=fitted & (rate > 0))
+
+    return {
+        "device_id": device_ids[last_row],
+        "level": level,
+        "last_time": times[last_row],
+        "rate": rate,
+        "hours_to_empty": hours_to_empty,
+        "samples": n.astype(np.int64),
+    }
+
+
+def series_to_arrays(rows):
+    """Transpose (device_id, timestamp, water_level, beans_level) rows into NumPy columns."""
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0), np.empty(0)
+
+    device_ids, timestamps, water, beans = zip(*rows)
+    # sensors_data.timestamp is timestamptz; NumPy wants naive UTC
+    timestamps = [
+        timestamp.astimezone(timezone.utc).replace(tzinfo=None) if timestamp.tzinfo else timestamp
+        for timestamp in timestamps
+    ]
+    times = np.array(timestamps, dtype="datetime64[us]").astype(np.int64) / 1e6
+    return (
+        np.array(device_ids, dtype=np.int64),
+        times,
+        np.array(water, dtype=float),
+        np.array(beans, dtype=float),
+    )
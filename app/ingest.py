@@ -0,0 +1,179 @@
+import asyncio
+import json
+import logging
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SENSOR_TOPIC = "coffee_machine/sensor_data"
+
+# Completion events reported by the ESP32 in `status` or `action`, checked in this order
+COMPLETION_EVENTS = ("single_brew_completed", "double_brew_completed", "cleaning_completed", "power_toggle")
+
+ingest_messages = metrics.counter("ingest_messages_total", "MQTT messages through the decode stage by outcome")
+ingest_batches = metrics.histogram("ingest_decode_batch_seconds", "Time to decode one batch in the process pool")
+ingest_pending = metrics.gauge("ingest_decode_batches_pending", "Decoded batches waiting for the writer")
+
+
+def _level(value):
+    # The ESP32 reports levels either as a number or as {"percentage": ...}
+    if isinstance(value, dict):
+        value = value.get("percentage", 0)
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        return None
+    try:
+        value = float(value)
+    except ValueError:
+        return None
+    return None if math.isnan(value) else value
+
+
+def _text(value):
+    return value if isinstance(value, str) and value else None
+
+
+def normalize(payload_data):
+    """
+    Validate a decoded sensor payload and reduce it to the fields the writer uses.
+
+    Returns None for payloads that can't be attributed to a device.
+    """
+    if not isinstance(payload_data, dict):
+        return None
+
+    device_id = payload_data.get("device_id", 1)
+    if isinstance(device_id, bool):
+        return None
+    try:
+        device_id = int(device_id)
+    except (TypeError, ValueError):
+        return None
+
+    action = _text(payload_data.get("action"))
+    status = _text(payload_data.get("status"))
+    power_state = payload_data.get("power_state")
+
+    event = None
+    for value in (status, action):
+        if value:
+            event = next((candidate for candidate in COMPLETION_EVENTS if candidate in value), None)
+            if event:
+                break
+
+    return {
+        "device_id": device_id,
+        "water_level": _level(payload_data.get("water_level")),
+        "beans_level": _level(payload_data.get("beans_level")),
+        "action": action,
+        "status": status,
+        "event": event,
+        "button": _text(payload_data.get("button")),
+        "power_state": power_state if isinstance(power_state, bool) else None,
+        "correlation_id": _text(payload_data.get("correlation_id")),
+    }
+
+
+def decode_message(topic, payload):
+    """Decode one raw MQTT message; returns the normalized record or None if it is rejected."""
+    if topic != SENSOR_TOPIC:
+        return None
+    try:
+        return normalize(json.loads(payload))
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def decode_batch(batch):
+    """
+    Decode a list of (topic, payload bytes) in a worker process.
+
+    Returns the (topic, record) pairs that passed validation, plus the count of rejected
+    sensor messages; messages on other topics come back with a None record.
+    """
+    records = []
+    rejected = 0
+    for topic, payload in batch:
+        record = decode_message(topic, payload)
+        if record is None and topic == SENSOR_TOPIC:
+            rejected += 1
+            continue
+        records.append((topic, record))
+    return records, rejected
+
+
+class DecodePool:
+    """
+    Batches raw messages and decodes them in a process pool, handing records back in arrival order.
+
+    A batch is submitted once it holds `batch_size` messages or its first message is `linger`
+    seconds old. At most `max_pending` batches are decoding at once; beyond that `submit`
+    waits, which pushes back on the MQTT reader.
+    """
+
+    def __init__(self, handler, workers, batch_size, linger, max_pending):
+        self.handler = handler
+        self.workers = workers
+        self.batch_size = batch_size
+        self.linger = linger
+        self.executor = None
+        self.buffer = []
+        self.buffer_started = 0.0
+        self.pending = asyncio.Queue(maxsize=max_pending)
+        self.tasks = []
+
+    def start(self):
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.tasks = [
+            asyncio.create_task(self._linger_loop()),
+            asyncio.create_task(self._write_loop()),
+        ]
+        logger.info("Started ingest decode pool with %s workers", self.workers)
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def submit(self, topic, payload):
+        if not self.buffer:
+            self.buffer_started = time.monotonic()
+        self.buffer.append((topic, payload))
+        if len(self.buffer) >= self.batch_size:
+            await self._flush()
+
+    async def _flush(self):
+        batch, self.buffer = self.buffer, []
+        future = asyncio.get_running_loop().run_in_executor(self.executor, decode_batch, batch)
+        await self.pending.put((future, len(batch), time.monotonic()))
+        ingest_pending.set(self.pending.qsize())
+
+    async def _linger_loop(self):
+        while True:
+            await asyncio.sleep(self.linger)
+            if self.buffer and time.monotonic() - self.buffer_started >= self.linger:
+                await self._flush()
+
+    async def _write_loop(self):
+        while True:
+            future, size, submitted = await self.pending.get()
+            ingest_pending.set(self.pending.qsize())
+            try:
+                records, rejected = await future
+            except Exception as e:
+                logger.error("Error decoding ingest batch of %s messages: %s", size, e, exc_info=True)
+                ingest_messages.inc(size, outcome="failed")
+                continue
+
+            ingest_batches.observe(time.monotonic() - submitted)
+            if rejected:
+                ingest_messages.inc(rejected, outcome="rejected")
+            for topic, record in records:
+                await self.handler(topic, record)
@@ -0,0 +1,164 @@
+import atexit
+import copy
+import logging
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+import orjson
+
+from app.config import settings
+from app.metrics import metrics
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+sampled_out = metrics.counter("log_records_sampled_out_total", "Log records dropped by sampling, by category")
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; the sampling category is included when set."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        category = getattr(record, "sample", None)
+        if category:
+            entry["category"] = category
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        elif record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return orjson.dumps(entry, default=str).decode()
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps 1 in N records of each sampling category (`extra={"sample": "<category>"}`).
+
+    A rate of 1 keeps everything and 0 drops the category; records without a category
+    or with a category that has no rate always pass. It runs before the record is
+    queued, so a dropped record is never formatted.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = dict(rates or {})
+        self.seen = {}
+
+    def filter(self, record):
+        category = getattr(record, "sample", None)
+        rate = self.rates.get(category) if category else None
+        if rate is None or rate == 1:
+            return True
+
+        seen = self.seen.get(category, 0)
+        self.seen[category] = seen + 1
+        if rate > 0 and seen % rate == 0:
+            return True
+        sampled_out.inc(category=category)
+        return False
+
+
+class LocalQueueHandler(QueueHandler):
+    """
+    Enqueues the record with its message merged but the traceback kept apart, for the JSON output.
+
+    The merge runs on the caller's thread, as in QueueHandler: the arguments (often dicts
+    of the ingest path) may change once the caller moves on.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def parse_rates(text):
+    """"ingest.payload=100,ingest.saved=10" -> {"ingest.payload": 100, "ingest.saved": 10}"""
+    rates = {}
+    for item in text.split(","):
+        category, _, rate = item.partition("=")
+        if category.strip():
+            rates[category.strip()] = int(rate)
+    return rates
+
+
+class LogSetup:
+    """
+    Root logging through a QueueHandler: callers filter, merge the message of the records
+    they keep and enqueue them, and a QueueListener thread formats the output lines (JSON
+    or text) and writes them. Sampled-out records cost only the filter.
+    """
+
+    def __init__(self):
+        self.sampling = SamplingFilter(parse_rates(settings.log_sampling))
+        self.listener = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.listener:
+                return self.listener
+
+            output = logging.StreamHandler(sys.stdout)
+            output.setFormatter(JsonFormatter() if settings.log_format == "json" else logging.Formatter(TEXT_FORMAT))
+
+            records = queue.SimpleQueue()
+            handler = LocalQueueHandler(records)
+            handler.addFilter(self.sampling)
+
+            root = logging.getLogger()
+            for existing in root.handlers[:]:
+                root.removeHandler(existing)
+            root.addHandler(handler)
+            root.setLevel(settings.log_level.upper())
+
+            self.listener = QueueListener(records, output, respect_handler_level=True)
+            self.listener.start()
+            atexit.register(self.stop)
+            return self.listener
+
+    def stop(self):
+        with self.lock:
+            if self.listener:
+                # Drains the queue before returning
+                self.listener.stop()
+                self.listener = None
+
+    def state(self):
+        loggers = {
+            name: logging.getLevelName(logger.level)
+            for name, logger in logging.root.manager.loggerDict.items()
+            if isinstance(logger, logging.Logger) and logger.level != logging.NOTSET
+        }
+        return {
+            "level": logging.getLevelName(logging.getLogger().level),
+            "loggers": loggers,
+            "sampling": dict(self.sampling.rates),
+        }
+
+    def configure(self, level=None, loggers=None, sampling=None):
+        """Change levels and sampling rates at runtime; a sampling rate of None removes it."""
+        if level:
+            logging.getLogger().setLevel(level.upper())
+        for name, logger_level in (loggers or {}).items():
+            logging.getLogger(name).setLevel(logger_level.upper() if logger_level else logging.NOTSET)
+        for category, rate in (sampling or {}).items():
+            if rate is None:
+                self.sampling.rates.pop(category, None)
+            else:
+                self.sampling.rates[category] = rate
+        return self.state()
+
+
+log_setup = LogSetup()
@@ -1,54 +1,118 @@
+import asyncio
 import logging
-from fastapi import FastAPI
+from contextlib import AsyncExitStack, asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 
+from app.config import settings
+from app.database import init_engine, prewarm_pool, dispose_engine, get_database_url
+from app.device_cache import device_cache
 from app.mqtt_client import mqtt_client
 from app.routes.user_routes import router as user_router
 from app.routes.device_routes import router as device_router
 from app.routes.sensors_routes import router as sensor_router
 from app.routes.command_routes import router as command_router
+from app.routes.admin_routes import router as admin_router
 from app.scheduler import start_scheduler
+from app.metrics import metrics
+from app.usage import usage_recorder
+from app.stream import event_stream
+from app.alerts import alert_engine, alert_notifier
+from app.auth import password_hasher, check_auth_config
+from app.presence import presence_tracker
+from app.logging_config import log_setup
+from app.query_cache import query_cache
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Coffee Machine Sensor Service")
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=False,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-app.include_router(user_router, prefix="/api")
-app.include_router(device_router, prefix="/api")
-app.include_router(sensor_router, prefix="/api")
-app.include_router(command_router, prefix="/api")
-
-@app.get("/")
-async def root():
-    return {"message": "Coffee Machine Sensor Service"}
-
-@app.get("/health")
-async def health_check():
-    mqtt_status = "connected" if mqtt_client.is_connected else "disconnected"
-    return {
-        "status": "healthy",
-        "mqtt": mqtt_status
-    }
-
-@app.on_event("startup")
-async def startup_event():
+
+async def stop_tasks(tasks):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log_setup.start()
+    check_auth_config()
     logger.info("Starting up Coffee Machine Sensor Service...")
-    await mqtt_client.connect()
-    start_scheduler()
-    logger.info("Daily coffee count reset scheduler started")
-
-@app.on_event("shutdown")
-async def shutdown_event():
-    logger.info("Shutting down Coffee Machine Sensor Service...")
-    await mqtt_client.disconnect()
\ No newline at end of file
+
+    # Everything started is registered for shutdown right away, so a failing
+    # startup step tears down what was already running (in reverse order)
+    async with AsyncExitStack() as stack:
+        init_engine()
+        stack.push_async_callback(dispose_engine)
+        stack.callback(password_hasher.shutdown)
+        warmed = await prewarm_pool(settings.db_pool_prewarm)
+        logger.info("Pre-warmed %s database connections", warmed)
+        await device_cache.load()
+        await alert_engine.load()
+        await presence_tracker.load()
+        query_cache.start(get_database_url().replace("postgresql+asyncpg://", "postgresql://"))
+        stack.push_async_callback(query_cache.stop)
+
+        if settings.stream_sink != "off":
+            await event_stream.start()
+            stack.push_async_callback(event_stream.stop)
+        if alert_notifier.sink:
+            await alert_notifier.start()
+            stack.push_async_callback(alert_notifier.stop)
+        usage_recorder.start()
+        stack.push_async_callback(usage_recorder.stop)
+        presence_tracker.start()
+        stack.push_async_callback(presence_tracker.stop)
+        stack.push_async_callback(mqtt_client.disconnect)
+        await mqtt_client.connect()
+        scheduler_tasks = start_scheduler()
+        stack.push_async_callback(stop_tasks, scheduler_tasks)
+        logger.info("Started %s scheduled jobs", len(scheduler_tasks))
+
+        app.state.ready = True
+        try:
+            yield
+        finally:
+            app.state.ready = False
+            logger.info("Shutting down Coffee Machine Sensor Service...")
+
+
+def create_app():
+    app = FastAPI(title="Coffee Machine Sensor Service", lifespan=lifespan)
+    app.state.ready = False
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=False,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.include_router(user_router, prefix="/api")
+    app.include_router(device_router, prefix="/api")
+    app.include_router(sensor_router, prefix="/api")
+    app.include_router(command_router, prefix="/api")
+    app.include_router(admin_router, prefix="/api")
+
+    @app.get("/")
+    async def root():
+        return {"message": "Coffee Machine Sensor Service"}
+
+    @app.get("/health")
+    async def health_check(request: Request):
+        mqtt_status = "connected" if mqtt_client.is_connected else "disconnected"
+        if not request.app.state.ready:
+            return JSONResponse(status_code=503, content={"status": "starting", "mqtt": mqtt_status})
+        return {
+            "status": "healthy",
+            "mqtt": mqtt_status
+        }
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def get_metrics():
+        return metrics.render()
+
+    return app
+
+
+app = create_app()
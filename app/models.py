@@ -1,11 +1,33 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Boolean
+from sqlalchemy import Column, Integer, BigInteger, SmallInteger, String, Float, ForeignKey, DateTime, Date, Boolean, \
+    Index, Identity, REAL
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
-from datetime import datetime
+from datetime import datetime, timezone
 
 from .database import Base
 
 
+class UTCDateTime(TypeDecorator):
+    """timestamptz column; naive datetimes (the app's utcnow() values) are sent as UTC."""
+    impl = DateTime(timezone=True)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is not None and value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value
+
+
+class Percentage(TypeDecorator):
+    """0-100 level stored as a 4-byte REAL, read back without single-precision noise (33.3, not 33.29999923)."""
+    impl = REAL
+    cache_ok = True
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else round(value, 4)
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -29,15 +51,19 @@ class Device(Base):
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     device_name = Column(String, nullable=False)
     total_active_time = Column(Float, default=0)
-    last_cleaning_time = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    last_cleaning_time = Column(DateTime, default=datetime.utcnow)
     numbers_of_coffee = Column(Integer, default=4)
     is_powered_on = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.utcnow)
-    last_active = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Maintained by the presence tracker (see app.presence)
+    last_active = Column(DateTime, default=datetime.utcnow)
+    is_online = Column(Boolean, nullable=False, default=False, server_default="false")
 
     # Relationships
     user = relationship("User", back_populates="devices")
     sensor_data = relationship("SensorData", back_populates="device", cascade="all, delete-orphan")
+    events = relationship("DeviceEvent", back_populates="device", cascade="all, delete-orphan")
+    daily_usage = relationship("DeviceDailyUsage", back_populates="device", cascade="all, delete-orphan")
 
     def __repr__(self):
         return f"Device(id={self.id}, name={self.device_name}, user_id={self.user_id})"
@@ -45,15 +71,84 @@ class Device(Base):
 
 class SensorData(Base):
     __tablename__ = "sensors_data"
+    __table_args__ = (
+        Index("ix_sensors_data_device_id_timestamp", "device_id", "timestamp"),
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
+    # Columns in the physical order of the table, widest first to avoid alignment padding
+    id = Column(BigInteger, Identity(), primary_key=True)
+    timestamp = Column(UTCDateTime, default=datetime.utcnow)
     device_id = Column(Integer, ForeignKey("devices.id", ondelete="CASCADE"), nullable=False)
-    water_level = Column(Float)
-    beans_level = Column(Float)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    water_level = Column(Percentage)
+    beans_level = Column(Percentage)
+    anomaly_flags = Column(SmallInteger, nullable=False, default=0, server_default="0")
 
     # Relationship
     device = relationship("Device", back_populates="sensor_data")
 
     def __repr__(self):
-        return f"SensorData(id={self.id}, device_id={self.device_id}, water_level={self.water_level}, beans_level={self.beans_level})"
\ No newline at end of file
+        return f"SensorData(id={self.id}, device_id={self.device_id}, water_level={self.water_level}, beans_level={self.beans_level})"
+
+class DeviceEvent(Base):
+    __tablename__ = "device_events"
+    __table_args__ = (
+        Index("ix_device_events_device_id_created_at", "device_id", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    device_id = Column(Integer, ForeignKey("devices.id", ondelete="CASCADE"), nullable=False)
+    event_type = Column(String, nullable=False)
+    source = Column(String, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    # Relationship
+    device = relationship("Device", back_populates="events")
+
+    def __repr__(self):
+        return f"DeviceEvent(id={self.id}, device_id={self.device_id}, event_type={self.event_type})"
+
+
+class DeviceDailyUsage(Base):
+    __tablename__ = "device_daily_usage"
+
+    device_id = Column(Integer, ForeignKey("devices.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    coffees = Column(Integer, nullable=False, default=0)
+    active_time = Column(Float, nullable=False, default=0)
+    cleanings = Column(Integer, nullable=False, default=0)
+    last_cleaning = Column(DateTime)
+
+    # Relationship
+    device = relationship("Device", back_populates="daily_usage")
+
+    def __repr__(self):
+        return f"DeviceDailyUsage(device_id={self.device_id}, day={self.day}, coffees={self.coffees})"
+
+
+class ScheduledJob(Base):
+    __tablename__ = "scheduled_jobs"
+
+    name = Column(String, primary_key=True)
+    last_scheduled_for = Column(DateTime)
+    last_started_at = Column(DateTime)
+    last_finished_at = Column(DateTime)
+    last_status = Column(String)
+    last_duration = Column(Float)
+
+    def __repr__(self):
+        return f"ScheduledJob(name={self.name}, last_scheduled_for={self.last_scheduled_for}, last_status={self.last_status})"
+
+
+class BackfillCheckpoint(Base):
+    __tablename__ = "backfill_checkpoints"
+
+    # One row per input and writer; `position` is the byte offset up to which the writer's rows are loaded
+    source = Column(String, primary_key=True)
+    worker = Column(Integer, primary_key=True)
+    workers = Column(Integer, nullable=False)
+    position = Column(BigInteger, nullable=False, default=0)
+    rows = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"BackfillCheckpoint(source={self.source}, worker={self.worker}, position={self.position})"
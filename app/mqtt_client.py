@@ -1,16 +1,41 @@
 import asyncio
 import json
+import re
 from datetime import datetime
 import logging
 from aiomqtt import Client, MqttError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, update, not_
 from app.config import settings
+from app.command_tracker import command_tracker
+from app.ingest import SENSOR_TOPIC, DecodePool, decode_message, ingest_messages
+from app.anomaly import anomaly_detector
+from app.compression import sensor_compressor
+from app.rate_limiter import command_admission
+from app.device_cache import device_cache
+from app.stream import event_stream
+from app.alerts import alert_engine
+from app.presence import presence_tracker, parse_presence
+from app.usage import usage_recorder, load_usage, remaining_coffees, NO_USAGE, BREW_ACTIVE_TIME, \
+    BREW_COMPLETED_COST
+from app.query_cache import query_cache
 from app.database import AsyncSessionLocal
 from app.models import SensorData, Device
 
 logger = logging.getLogger(__name__)
 
+# Coffees needed from the daily allowance per brew action
+BREW_COFFEE_COST = {"single_brew": 1, "double_brew": 2}
+POWERED_ACTIONS = ["single_brew", "double_brew", "cleaning"]
+
+# Commands go to one topic per device; the service sees them again through its coffee_machine/# subscription
+COMMAND_TOPIC = re.compile(
+    re.escape(settings.mqtt_device_command_topic).replace(re.escape("{device_id}"), r"\d+"))
+
+
+def command_topic(device_id):
+    return settings.mqtt_device_command_topic.format(device_id=device_id)
+
 
 class MQTTClient:
     def __init__(self):
@@ -20,6 +45,7 @@ class MQTTClient:
         self.latest_sensor_data = {}
         self.historical_data = []
         self.max_history_size = 100
+        self.decode_pool = None
 
     async def connect(self):
         try:
@@ -29,15 +55,25 @@ class MQTTClient:
             )
             await self.client.__aenter__()
             self.is_connected = True
-            logger.info(f"Connected to MQTT broker at {settings.mqtt_broker_host}:{settings.mqtt_broker_port}")
+            logger.info("Connected to MQTT broker at %s:%s", settings.mqtt_broker_host, settings.mqtt_broker_port)
 
             await self.client.subscribe("coffee_machine/#")
-            logger.info(f"Subscribed to topic: coffee_machine/#")
+            logger.info("Subscribed to topic: coffee_machine/#")
+
+            if settings.ingest_decode_workers > 0 and self.decode_pool is None:
+                self.decode_pool = DecodePool(
+                    self.handle_message,
+                    settings.ingest_decode_workers,
+                    settings.ingest_batch_size,
+                    settings.ingest_linger,
+                    settings.ingest_max_pending_batches
+                )
+                self.decode_pool.start()
 
             self.task = asyncio.create_task(self.listen_for_messages())
 
         except MqttError as e:
-            logger.error(f"Error connecting to MQTT broker: {e}")
+            logger.error("Error connecting to MQTT broker: %s", e)
             self.is_connected = False
 
     async def disconnect(self):
@@ -48,6 +84,12 @@ class MQTTClient:
             except asyncio.CancelledError:
                 pass
 
+        if self.decode_pool:
+            await self.decode_pool.stop()
+            self.decode_pool = None
+
+        await self.save_pending_readings()
+
         if self.is_connected and self.client:
             await self.client.__aexit__(None, None, None)
             self.is_connected = False
@@ -62,202 +104,328 @@ class MQTTClient:
             if command.get("action") in ["single_brew", "double_brew", "cleaning"]:
                 async with AsyncSessionLocal() as db:
                     result = await db.execute(
-                        select(Device).where(Device.id == 1)
+                        select(Device).where(Device.id == command.get("device_id", 1))
                     )
                     device = result.scalar_one_or_none()
 
                     if device:
                         if not device.is_powered_on:
-                            logger.warning(f"Device is powered off. Cannot execute {command.get('action')}")
+                            logger.warning("Device is powered off. Cannot execute %s", command.get("action"))
                             return {"error": "device_powered_off"}
 
                         # Check coffee limit for brew commands
-                        if command.get("action") in ["single_brew", "double_brew"]:
-                            required_coffee = 1 if command.get("action") == "single_brew" else 2
-                            if device.numbers_of_coffee < required_coffee:
+                        if command.get("action") in BREW_COFFEE_COST:
+                            required_coffee = BREW_COFFEE_COST[command.get("action")]
+                            available = await remaining_coffees(db, device.id, device.numbers_of_coffee)
+                            if available < required_coffee:
                                 logger.warning(
-                                    f"Coffee limit exceeded. Available: {device.numbers_of_coffee}, Required: {required_coffee}")
-                                return {"error": "daily_coffee_limit_exceeded", "available": device.numbers_of_coffee}
-
-                        # Update total_active_time for brew commands (API calls)
-                        if command.get("action") == "single_brew":
-                            device.total_active_time = (device.total_active_time or 0) + 0.5
-                            await db.commit()
-                            logger.info(
-                                f"Updated total_active_time (+0.5h): {device.total_active_time}h for single_brew API call")
-                        elif command.get("action") == "double_brew":
-                            device.total_active_time = (device.total_active_time or 0) + 0.75
-                            await db.commit()
-                            logger.info(
-                                f"Updated total_active_time (+0.75h): {device.total_active_time}h for double_brew API call")
+                                    "Coffee limit exceeded. Available: %s, Required: %s", available, required_coffee)
+                                return {"error": "daily_coffee_limit_exceeded", "available": available}
+
+                            # Active time for brew commands (API calls) goes to the event log
+                            usage_recorder.record(device.id, command.get("action"), "api")
 
             # Handle power toggle separately - update database
             if command.get("action") == "power_toggle":
                 async with AsyncSessionLocal() as db:
                     result = await db.execute(
-                        select(Device).where(Device.id == 1)
+                        select(Device).where(Device.id == command.get("device_id", 1))
                     )
                     device = result.scalar_one_or_none()
 
                     if device:
                         device.is_powered_on = not device.is_powered_on
                         await db.commit()
-                        logger.info(f"Device power toggled to: {'ON' if device.is_powered_on else 'OFF'}")
+                        logger.info("Device power toggled to: %s", "ON" if device.is_powered_on else "OFF")
 
+            device_id = command.get("device_id", 1)
+            correlation_id = command_tracker.register(command, device_id)
             command_json = json.dumps(command)
-            logger.info(f"Sending command: {command_json}")
+            logger.info("Sending command: %s", command_json)
 
-            await self.client.publish(
-                topic="coffee_machine/commands",
-                payload=command_json
-            )
+            try:
+                await self.client.publish(
+                    topic=command_topic(device_id),
+                    payload=command_json
+                )
+            except Exception:
+                command_tracker.fail(correlation_id)
+                raise
             return True
         except Exception as e:
-            logger.error(f"Error sending command: {e}", exc_info=True)
+            logger.error("Error sending command: %s", e, exc_info=True)
             return False
 
-    async def save_sensor_data_to_db(self, sensor_data):
-        try:
-            async with AsyncSessionLocal() as db:
-                device_id = sensor_data.get('device_id', 1)
-                water_level = sensor_data.get('water_level')
-                beans_level = sensor_data.get('beans_level')
-                action = sensor_data.get('action')
-                status = sensor_data.get('status')
-
-                if water_level is None and 'water_level' in sensor_data and isinstance(sensor_data['water_level'],
-                                                                                       dict):
-                    water_level = sensor_data['water_level'].get('percentage', 0)
-
-                result = await db.execute(
-                    select(Device).where(Device.id == device_id)
-                )
-                device = result.scalar_one_or_none()
+    async def send_bulk_command(self, command, device_ids=None, user_id=None):
+        if not self.is_connected:
+            raise ValueError("MQTT client is not connected")
 
-                if not device:
-                    logger.warning(f"Device with ID {device_id} not found")
-                    return
+        action = command.get("action")
+        results = {}
+        admitted = []
 
-                if action == "cleaning_completed":
-                    from datetime import datetime
-                    device.last_cleaning_time = datetime.utcnow()
-                    await db.commit()
-                    logger.info(f"Updated last cleaning time for device {device_id}")
+        try:
+            query = select(Device.id, Device.is_powered_on, Device.numbers_of_coffee)
+            if device_ids is not None:
+                query = query.where(Device.id.in_(device_ids))
+            if user_id is not None:
+                query = query.where(Device.user_id == user_id)
 
-                if status and "completed" in status:
-                    if "single_brew_completed" in status:
-                        device.numbers_of_coffee = max(0, device.numbers_of_coffee - 1)
-                        await db.commit()
-                        logger.info(f"Decremented coffee count for device {device_id}: {device.numbers_of_coffee}")
-                    elif "double_brew_completed" in status:
-                        device.numbers_of_coffee = max(0, device.numbers_of_coffee - 2)
-                        await db.commit()
-                        logger.info(f"Decremented coffee count for device {device_id}: {device.numbers_of_coffee}")
+            # Run the admission checks for every target in a single query
+            async with AsyncSessionLocal() as db:
+                rows = (await db.execute(query.order_by(Device.id))).all()
+                usage = {}
+                if action in BREW_COFFEE_COST:
+                    usage = await load_usage(db, [row.id for row in rows])
+
+                for device_id, is_powered_on, numbers_of_coffee in rows:
+                    numbers_of_coffee = max(0, (numbers_of_coffee or 0) - usage.get(device_id, NO_USAGE).coffees_today)
+                    if action in POWERED_ACTIONS and not is_powered_on:
+                        results[device_id] = {"device_id": device_id, "status": "skipped",
+                                              "reason": "device_powered_off"}
+                    elif action in BREW_COFFEE_COST and (numbers_of_coffee or 0) < BREW_COFFEE_COST[action]:
+                        results[device_id] = {"device_id": device_id, "status": "skipped",
+                                              "reason": "daily_coffee_limit_exceeded",
+                                              "available": numbers_of_coffee or 0}
+                    elif settings.rate_limit_enabled and not command_admission.admit_device(device_id):
+                        results[device_id] = {"device_id": device_id, "status": "skipped",
+                                              "reason": "rate_limited"}
+                    else:
+                        admitted.append(device_id)
+
+                if admitted and action in BREW_ACTIVE_TIME:
+                    for device_id in admitted:
+                        usage_recorder.record(device_id, action, "api")
+                elif admitted and action == "power_toggle":
+                    await db.execute(
+                        update(Device)
+                        .where(Device.id.in_(admitted))
+                        .values(is_powered_on=not_(Device.is_powered_on))
+                    )
+                    await db.commit()
+        except Exception as e:
+            logger.error("Error running admission checks for bulk command: %s", e, exc_info=True)
+            return None
+
+        if device_ids is not None:
+            for device_id in device_ids:
+                if device_id not in results and device_id not in admitted:
+                    results[device_id] = {"device_id": device_id, "status": "not_found"}
+
+        # Publish to the per-device topics with at most `mqtt_publish_window` publishes in flight
+        targets = iter(admitted)
+
+        async def publish_worker():
+            for device_id in targets:
+                # Every device gets its own correlation id
+                device_command = {**command, "device_id": device_id}
+                device_command.pop("correlation_id", None)
+                correlation_id = command_tracker.register(device_command, device_id)
+                try:
+                    await self.client.publish(
+                        topic=command_topic(device_id),
+                        payload=json.dumps(device_command)
+                    )
+                    results[device_id] = {"device_id": device_id, "status": "sent",
+                                          "correlation_id": correlation_id}
+                except Exception as e:
+                    logger.error("Error sending %s to device %s: %s", action, device_id, e)
+                    command_tracker.fail(correlation_id)
+                    results[device_id] = {"device_id": device_id, "status": "failed", "reason": str(e)}
+
+        window = min(settings.mqtt_publish_window, len(admitted))
+        await asyncio.gather(*(publish_worker() for _ in range(window)))
+        sent = sum(1 for result in results.values() if result["status"] == "sent")
+        logger.info("Bulk command %s: sent to %s of %s devices", action, sent, len(results))
+
+        return [results[device_id] for device_id in sorted(results)]
+
+    async def save_pending_readings(self):
+        """Store the latest readings that swinging-door compression was still holding back."""
+        pending = sensor_compressor.drain()
+        if not pending:
+            return
+        try:
+            async with AsyncSessionLocal() as db:
+                db.add_all([
+                    SensorData(device_id=device_id, timestamp=timestamp, water_level=water, beans_level=beans)
+                    for device_id, (timestamp, water, beans) in pending
+                ])
+                await db.commit()
+        except Exception as e:
+            logger.error("Error saving %s pending compressed readings: %s", len(pending), e, exc_info=True)
+            return
+        for device_id, _ in pending:
+            query_cache.bump(device_id)
+        logger.info("Saved %s pending compressed readings", len(pending))
 
-                if any([water_level is not None, beans_level is not None]):
-                    db_sensor_data = SensorData(
-                        device_id=device_id,
-                        water_level=float(water_level) if water_level is not None else None,
-                        beans_level=float(beans_level) if beans_level is not None else None
+    async def save_sensor_data_to_db(self, record):
+        try:
+            async with AsyncSessionLocal() as db:
+                device_id = record["device_id"]
+                water_level = record["water_level"]
+                beans_level = record["beans_level"]
+                cleaned = record["action"] == "cleaning_completed"
+                coffees = BREW_COMPLETED_COST.get(record["event"])
+
+                # Known devices don't need the device row at all, counters go to the event log
+                if device_id not in device_cache:
+                    result = await db.execute(
+                        select(Device).where(Device.id == device_id)
                     )
+                    device = result.scalar_one_or_none()
 
-                    db.add(db_sensor_data)
+                    if not device:
+                        logger.warning("Device with ID %s not found", device_id)
+                        return
+                    device_cache.add(device)
+
+                if cleaned:
+                    usage_recorder.record(device_id, "cleaning_completed", "device")
+                    logger.info("Recorded cleaning for device %s", device_id)
+
+                if coffees:
+                    if settings.anomaly_detection != "off":
+                        anomaly_detector.record_brew(device_id)
+
+                    usage_recorder.record(device_id, record["event"], "device")
+                    logger.info("Recorded %s coffee(s) made by device %s", coffees, device_id)
+
+                has_levels = water_level is not None or beans_level is not None
+                anomaly_flags = 0
+                if has_levels and settings.anomaly_detection != "off":
+                    anomaly_flags = anomaly_detector.check(device_id, water_level, beans_level)
+
+                # Alerts only see levels the detector accepted (events like cleaning still count)
+                alert_engine.evaluate(record if not anomaly_flags
+                                      else {**record, "water_level": None, "beans_level": None})
+
+                if has_levels:
+                    if anomaly_flags and settings.anomaly_detection == "quarantine":
+                        anomaly_detector.quarantine(device_id, water_level, beans_level, anomaly_flags)
+                        return
+
+                    points = [(datetime.utcnow(), water_level, beans_level)]
+                    if not anomaly_flags:
+                        points = sensor_compressor.offer(device_id, *points[0])
+                        if not points:
+                            return
+
+                    rows = [
+                        SensorData(
+                            device_id=device_id,
+                            timestamp=timestamp,
+                            water_level=water,
+                            beans_level=beans,
+                            anomaly_flags=anomaly_flags
+                        )
+                        for timestamp, water, beans in points
+                    ]
+                    db.add_all(rows)
                     await db.commit()
+                    query_cache.bump(device_id)
+                    db_sensor_data = rows[-1]
                     await db.refresh(db_sensor_data)
 
-                    logger.info(f"Saved sensor data to database: ID {db_sensor_data.id}")
+                    logger.info("Saved sensor data to database: ID %s", db_sensor_data.id, extra={"sample": "ingest.saved"})
                     return db_sensor_data
 
         except Exception as e:
-            logger.error(f"Error saving sensor data to database: {e}", exc_info=True)
+            logger.error("Error saving sensor data to database: %s", e, exc_info=True)
+
+    async def handle_message(self, topic, record):
+        """Apply one decoded message; `record` is the normalized payload or None for other topics."""
+        if record is None:
+            if not COMMAND_TOPIC.fullmatch(topic):
+                logger.info("Received message on topic %s", topic, extra={"sample": "ingest.other"})
+            return
+
+        ingest_messages.inc(outcome="accepted")
+        try:
+            device_id = record["device_id"]
+            command_tracker.acknowledge_message(device_id, record)
+            if device_id in device_cache:
+                presence_tracker.seen(device_id)
+
+            timestamp = datetime.now()
+            self.latest_sensor_data = {
+                "timestamp": timestamp,
+                "data": record
+            }
+
+            self.historical_data.append({
+                "timestamp": timestamp,
+                "data": record
+            })
+
+            if len(self.historical_data) > self.max_history_size:
+                self.historical_data.pop(0)
+
+            event_stream.publish("sensor_readings", device_id, {**record, "received_at": datetime.utcnow()})
+
+            # Handle power toggle messages received from ESP32
+            if record["action"] == "power_toggle" and record["power_state"] is not None:
+                async with AsyncSessionLocal() as db:
+                    result = await db.execute(
+                        select(Device).where(Device.id == device_id)
+                    )
+                    device = result.scalar_one_or_none()
+
+                    if device:
+                        # Use the power_state from the ESP32 message
+                        device.is_powered_on = record["power_state"]
+                        await db.commit()
+                        logger.info("Device power updated from ESP32 to: %s", "ON" if device.is_powered_on else "OFF")
+
+            # Handle button press messages for brew commands
+            if record["action"] == "button_pressed" and record["button"] in BREW_ACTIVE_TIME:
+                button_type = record["button"]
+                if device_id in device_cache:
+                    # Active time for button presses goes to the event log
+                    usage_recorder.record(device_id, button_type, "button")
+                    logger.info("Recorded %s button press (+%sh)", button_type, BREW_ACTIVE_TIME[button_type])
+
+            await self.save_sensor_data_to_db(record)
+            logger.info("Received message on topic %s: %s", topic, record, extra={"sample": "ingest.payload"})
+
+        except Exception as e:
+            logger.error("Error processing MQTT message: %s", e, exc_info=True)
 
     async def listen_for_messages(self):
         try:
             async for message in self.client.messages:
-                try:
-                    topic = message.topic.value
-                    if isinstance(topic, bytes):
-                        topic = topic.decode()
-                    elif not isinstance(topic, str):
-                        topic = str(topic)
-
-                    payload = message.payload
-                    if isinstance(payload, bytes):
-                        payload_str = payload.decode()
-                    else:
-                        payload_str = str(payload)
-
-                    payload_data = json.loads(payload_str)
-                    timestamp = datetime.now()
-
-                    if topic == "coffee_machine/sensor_data":
-                        self.latest_sensor_data = {
-                            "timestamp": timestamp,
-                            "data": payload_data
-                        }
-
-                        self.historical_data.append({
-                            "timestamp": timestamp,
-                            "data": payload_data
-                        })
-
-                        if len(self.historical_data) > self.max_history_size:
-                            self.historical_data.pop(0)
-
-                        # Handle power toggle messages received from ESP32
-                        if payload_data.get("action") == "power_toggle":
-                            async with AsyncSessionLocal() as db:
-                                result = await db.execute(
-                                    select(Device).where(Device.id == 1)
-                                )
-                                device = result.scalar_one_or_none()
-
-                                if device:
-                                    # Use the power_state from the ESP32 message
-                                    power_state = payload_data.get("power_state")
-                                    if power_state is not None:
-                                        device.is_powered_on = power_state
-                                        await db.commit()
-                                        logger.info(
-                                            f"Device power updated from ESP32 to: {'ON' if device.is_powered_on else 'OFF'}")
-
-                        # Handle button press messages for brew commands
-                        if payload_data.get("action") == "button_pressed":
-                            button_type = payload_data.get("button")
-                            if button_type in ["single_brew", "double_brew"]:
-                                async with AsyncSessionLocal() as db:
-                                    result = await db.execute(
-                                        select(Device).where(Device.id == 1)
-                                    )
-                                    device = result.scalar_one_or_none()
-
-                                    if device:
-                                        # Update total_active_time for button presses
-                                        if button_type == "single_brew":
-                                            device.total_active_time = (device.total_active_time or 0) + 0.5
-                                            await db.commit()
-                                            logger.info(
-                                                f"Updated total_active_time (+0.5h): {device.total_active_time}h for single_brew button press")
-                                        elif button_type == "double_brew":
-                                            device.total_active_time = (device.total_active_time or 0) + 0.75
-                                            await db.commit()
-                                            logger.info(
-                                                f"Updated total_active_time (+0.75h): {device.total_active_time}h for double_brew button press")
-
-                        await self.save_sensor_data_to_db(payload_data)
-
-                    logger.info(f"Received message on topic {topic}: {payload_str}")
-
-                except json.JSONDecodeError:
-                    logger.error(f"Failed to parse message payload as JSON: {message.payload}")
-                except Exception as e:
-                    logger.error(f"Error processing MQTT message: {e}", exc_info=True)
+                topic = message.topic.value
+                if isinstance(topic, bytes):
+                    topic = topic.decode()
+                elif not isinstance(topic, str):
+                    topic = str(topic)
+
+                payload = message.payload
+                if not isinstance(payload, (bytes, bytearray)):
+                    payload = str(payload).encode()
+
+                presence = parse_presence(topic, payload)
+                if presence:
+                    if presence[0] in device_cache:
+                        presence_tracker.status(*presence)
+                    continue
+
+                if self.decode_pool:
+                    await self.decode_pool.submit(topic, bytes(payload))
+                    continue
+
+                record = decode_message(topic, payload)
+                if record is None and topic == SENSOR_TOPIC:
+                    ingest_messages.inc(outcome="rejected")
+                    logger.error("Rejected sensor message payload: %r", payload, extra={"sample": "ingest.rejected"})
+                    continue
+                await self.handle_message(topic, record)
 
         except MqttError as e:
-            logger.error(f"MQTT connection error: {e}")
+            logger.error("MQTT connection error: %s", e)
             await asyncio.sleep(5)
             await self.connect()
         except Exception as e:
-            logger.error(f"Unexpected error in MQTT listener: {e}", exc_info=True)
+            logger.error("Unexpected error in MQTT listener: %s", e, exc_info=True)
 
 mqtt_client = MQTTClient()
\ No newline at end of file
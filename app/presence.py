@@ -0,0 +1,239 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import select, update
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.metrics import metrics
+from app.models import Device
+
+logger = logging.getLogger(__name__)
+
+# Devices publish "online" here on connect and set "offline" as their MQTT Last Will
+PRESENCE_TOPIC_PREFIX = "coffee_machine/"
+PRESENCE_TOPIC_SUFFIX = "/status"
+
+presence_transitions = metrics.counter("presence_transitions_total", "Device online/offline transitions by reason")
+devices_online = metrics.gauge("presence_devices_online", "Devices currently online")
+presence_flush_seconds = metrics.histogram("presence_flush_seconds", "Time to write a batch of presence changes")
+
+
+def parse_presence(topic, payload):
+    """`coffee_machine/{id}/status` with "online"/"offline" -> (device_id, online), else None."""
+    if not (topic.startswith(PRESENCE_TOPIC_PREFIX) and topic.endswith(PRESENCE_TOPIC_SUFFIX)):
+        return None
+    try:
+        device_id = int(topic[len(PRESENCE_TOPIC_PREFIX):-len(PRESENCE_TOPIC_SUFFIX)])
+    except ValueError:
+        return None
+    state = bytes(payload).strip().lower()
+    if state not in (b"online", b"offline"):
+        return None
+    return device_id, state == b"online"
+
+
+class TimerWheel:
+    """
+    Hierarchical timing wheel of integer ticks: `levels` wheels of `size` slots each,
+    level n slots spanning size**n ticks. Scheduling is O(1); slots of the outer
+    levels are cascaded inward as the inner wheel wraps around.
+
+    A key holds one live entry. Moving its deadline later only updates `deadlines`;
+    when the entry comes due it is re-filed at the new deadline, so frequent heartbeats
+    never touch the wheel. Entries are tagged with a generation, and one whose key was
+    cancelled or re-filed since is dropped when its slot comes round.
+    """
+
+    def __init__(self, now, size=64, levels=4):
+        self.size = size
+        self.levels = levels
+        self.wheels = [[[] for _ in range(size)] for _ in range(levels)]
+        self.current = now
+        # key -> (deadline, generation of its live entry)
+        self.deadlines = {}
+        self.generation = 0
+
+    def _file(self, key, deadline, generation):
+        deadline = max(deadline, self.current + 1)
+        delta = deadline - self.current
+        level, span = 0, self.size
+        while delta >= span and level < self.levels - 1:
+            level += 1
+            span *= self.size
+        deadline = min(deadline, self.current + span - 1)
+        self.wheels[level][(deadline // (span // self.size)) % self.size].append((key, generation))
+
+    def schedule(self, key, deadline):
+        current = self.deadlines.get(key)
+        if current is not None and deadline >= current[0]:
+            # Later deadlines wait for the existing entry
+            self.deadlines[key] = (deadline, current[1])
+            return
+        self.generation += 1
+        self.deadlines[key] = (deadline, self.generation)
+        self._file(key, deadline, self.generation)
+
+    def cancel(self, key):
+        self.deadlines.pop(key, None)
+
+    def advance(self, now):
+        """Move to tick `now` and return the keys whose deadline has passed."""
+        expired = []
+        while self.current < now:
+            self.current += 1
+            # Cascade outer slots that start at this tick
+            span = 1
+            for level in range(1, self.levels):
+                span *= self.size
+                if self.current % span:
+                    break
+                slot = self.wheels[level][(self.current // span) % self.size]
+                self.wheels[level][(self.current // span) % self.size] = []
+                for key, generation in slot:
+                    self._refile(key, generation, expired)
+
+            slot = self.wheels[0][self.current % self.size]
+            self.wheels[0][self.current % self.size] = []
+            for key, generation in slot:
+                self._refile(key, generation, expired)
+        return expired
+
+    def _refile(self, key, generation, expired):
+        current = self.deadlines.get(key)
+        if current is None or current[1] != generation:
+            return
+        deadline = current[0]
+        if deadline <= self.current:
+            del self.deadlines[key]
+            expired.append(key)
+        else:
+            self._file(key, deadline, generation)
+
+    def __len__(self):
+        return len(self.deadlines)
+
+
+class PresenceTracker:
+    """
+    Online/offline state of every device, kept in memory.
+
+    Any message from a device (sensor data or an "online" status) counts as a heartbeat
+    and pushes its deadline `timeout` seconds out; the Last Will "offline" or a missed
+    deadline takes it offline. Transitions are coalesced per device and written in
+    batches by `flush`.
+    """
+
+    def __init__(self, timeout, flush_interval):
+        self.timeout = timeout
+        self.flush_interval = flush_interval
+        self.wheel = TimerWheel(int(time.time()))
+        self.online = set()
+        self.last_seen = {}
+        # device_id -> (is_online, last_active) not written yet
+        self.changes = {}
+        self.task = None
+
+    async def load(self):
+        """Give devices the database still has online one timeout to send a heartbeat."""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(Device.id, Device.last_active).where(Device.is_online.is_(True)))
+            rows = result.all()
+        deadline = int(time.time()) + self.timeout
+        for device_id, last_active in rows:
+            self.online.add(device_id)
+            self.last_seen[device_id] = last_active.replace(tzinfo=timezone.utc).timestamp() if last_active else time.time()
+            self.wheel.schedule(device_id, deadline)
+        devices_online.set(len(self.online))
+        logger.info("Loaded %s online devices into the presence tracker", len(rows))
+
+    def seen(self, device_id, now=None):
+        now = now or time.time()
+        self.last_seen[device_id] = now
+        self.wheel.schedule(device_id, int(now) + self.timeout)
+        if device_id not in self.online:
+            self._transition(device_id, True, now, "heartbeat")
+
+    def status(self, device_id, online, now=None):
+        """Apply a status message (`online`, or the `offline` Last Will)."""
+        now = now or time.time()
+        if online:
+            self.seen(device_id, now)
+        else:
+            self.wheel.cancel(device_id)
+            if device_id in self.online:
+                self._transition(device_id, False, now, "last_will")
+
+    def forget(self, device_id):
+        self.wheel.cancel(device_id)
+        self.online.discard(device_id)
+        self.last_seen.pop(device_id, None)
+        self.changes.pop(device_id, None)
+
+    def is_online(self, device_id):
+        return device_id in self.online
+
+    def expire(self, now=None):
+        now = now or time.time()
+        expired = self.wheel.advance(int(now))
+        for device_id in expired:
+            if device_id in self.online:
+                self._transition(device_id, False, now, "timeout")
+        return expired
+
+    def _transition(self, device_id, online, now, reason):
+        if online:
+            self.online.add(device_id)
+        else:
+            self.online.discard(device_id)
+        self.changes[device_id] = (online, datetime.utcfromtimestamp(self.last_seen.get(device_id, now)))
+        presence_transitions.inc(state="online" if online else "offline", reason=reason)
+        devices_online.set(len(self.online))
+
+    async def flush(self):
+        if not self.changes:
+            return 0
+
+        changes, self.changes = self.changes, {}
+        started = time.perf_counter()
+        rows = [
+            {"id": device_id, "is_online": online, "last_active": last_active}
+            for device_id, (online, last_active) in sorted(changes.items())
+        ]
+        try:
+            async with AsyncSessionLocal() as db:
+                for start in range(0, len(rows), settings.bulk_chunk_size):
+                    await db.execute(update(Device), rows[start:start + settings.bulk_chunk_size])
+                await db.commit()
+        except Exception as e:
+            logger.error("Error writing %s presence changes, will retry: %s", len(rows), e, exc_info=True)
+            # Newer transitions recorded in the meantime win
+            self.changes = {**changes, **self.changes}
+            return 0
+
+        presence_flush_seconds.observe(time.perf_counter() - started)
+        return len(rows)
+
+    async def run(self):
+        last_flush = time.monotonic()
+        while True:
+            await asyncio.sleep(1)
+            self.expire()
+            if time.monotonic() - last_flush >= self.flush_interval:
+                await self.flush()
+                last_flush = time.monotonic()
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        await self.flush()
+
+
+presence_tracker = PresenceTracker(settings.presence_timeout, settings.presence_flush_interval)
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import uuid
+from collections import OrderedDict
+
+import asyncpg
+
+from app.config import settings
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Postgres NOTIFY channel; payloads are "<origin>:<device id>,<device id>,..." with "*" for everything
+CACHE_CHANNEL = "query_cache"
+MAX_PAYLOAD = 7000
+
+cache_requests = metrics.counter("query_cache_requests_total", "Sensor query cache lookups by result")
+cache_entries = metrics.gauge("query_cache_entries", "Sensor query results currently cached")
+cache_notifications = metrics.counter("query_cache_notifications_total", "Invalidations exchanged with other workers")
+
+
+class QueryCache:
+    """
+    LRU cache of per-device query results, invalidated by version instead of deletes.
+
+    Every write for a device bumps its version once committed; entries stored under an
+    older version are treated as misses and age out through LRU eviction. Readers take
+    the version *before* querying, so a result that raced with a write is never served
+    as current.
+
+    Versions live in each process. With `start`, bumps are also sent to the other
+    workers with Postgres NOTIFY and theirs are applied here, so they stop serving the
+    old results within a NOTIFY round trip. While that connection is down the cache
+    serves nothing, and everything cached is dropped when it comes back.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        # (device_id, key) -> (version, result)
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.generation = 0
+        self.origin = uuid.uuid4().hex
+        self.synced = True
+        self.outgoing = set()
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def version(self, device_id):
+        return self.generation, self.versions.get(device_id, 0)
+
+    def bump(self, device_id):
+        self.versions[device_id] = self.versions.get(device_id, 0) + 1
+        self._publish(device_id)
+
+    def invalidate_all(self):
+        self.generation += 1
+        self._publish("*")
+
+    def _publish(self, item):
+        if self.task is not None:
+            self.outgoing.add(item)
+            self.wakeup.set()
+
+    def lookup(self, device_id, key):
+        if not self.max_entries or not self.synced:
+            return None
+
+        entry = self.entries.get((device_id, key))
+        if entry is None or entry[0] != self.version(device_id):
+            cache_requests.inc(result="miss")
+            return None
+
+        self.entries.move_to_end((device_id, key))
+        cache_requests.inc(result="hit")
+        return entry[1]
+
+    def store(self, device_id, key, version, result):
+        if not self.max_entries or not self.synced or version != self.version(device_id):
+            return
+
+        self.entries[(device_id, key)] = (version, result)
+        self.entries.move_to_end((device_id, key))
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        cache_entries.set(len(self.entries))
+
+    def on_notify(self, connection, pid, channel, payload):
+        origin, _, items = payload.partition(":")
+        if origin == self.origin:
+            return
+        cache_notifications.inc(direction="received")
+        for item in items.split(","):
+            if item == "*":
+                self.generation += 1
+            elif item:
+                device_id = int(item)
+                self.versions[device_id] = self.versions.get(device_id, 0) + 1
+
+    def payloads(self, items):
+        payload = ""
+        for item in items:
+            if payload and len(payload) + len(str(item)) >= MAX_PAYLOAD:
+                yield f"{self.origin}:{payload}"
+                payload = ""
+            payload = f"{payload},{item}" if payload else str(item)
+        if payload:
+            yield f"{self.origin}:{payload}"
+
+    async def run(self, dsn):
+        while True:
+            try:
+                connection = await asyncpg.connect(dsn)
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.error("Query cache can't connect for invalidations, retrying: %s", e)
+                await asyncio.sleep(5)
+                continue
+
+            try:
+                connection.add_termination_listener(lambda _: self.wakeup.set())
+                await connection.add_listener(CACHE_CHANNEL, self.on_notify)
+                # Anything could have changed while nothing was received
+                self.generation += 1
+                self.synced = True
+                while not connection.is_closed():
+                    await self.wakeup.wait()
+                    self.wakeup.clear()
+                    items, self.outgoing = self.outgoing, set()
+                    try:
+                        for payload in self.payloads(items):
+                            await connection.execute("SELECT pg_notify($1, $2)", CACHE_CHANNEL, payload)
+                            cache_notifications.inc(direction="sent")
+                    except Exception:
+                        self.outgoing |= items
+                        raise
+                logger.error("Query cache invalidation connection closed, reconnecting")
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                logger.error("Query cache invalidation connection failed, reconnecting: %s", e)
+            finally:
+                self.synced = False
+                if not connection.is_closed():
+                    connection.terminate()
+            await asyncio.sleep(1)
+
+    def start(self, dsn):
+        """Share invalidations with the other workers; the cache serves nothing until connected."""
+        if self.max_entries and self.task is None:
+            self.synced = False
+            self.task = asyncio.create_task(self.run(dsn))
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+
+query_cache = QueryCache(settings.query_cache_size)
@@ -0,0 +1,133 @@
+import math
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException, Request
+
+from app.config import settings
+from app.metrics import metrics
+
+limiter_decisions = metrics.counter("rate_limit_decisions_total", "Command admission decisions by scope")
+limiter_buckets = metrics.gauge("rate_limit_buckets", "Token buckets currently tracked by scope")
+admitted_in_flight = metrics.gauge("rate_limit_commands_in_flight", "Command requests currently being processed")
+
+
+class TokenBucketLimiter:
+    """
+    Token buckets keyed by client or device, refilled lazily on access.
+
+    Each check is O(1); at most `max_keys` buckets are kept, least recently used
+    first out (an evicted key simply starts again with a full bucket).
+    """
+
+    def __init__(self, scope, rate, burst, max_keys):
+        self.scope = scope
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        # key -> [tokens, last refill time]
+        self.buckets = OrderedDict()
+
+    def _refill(self, key, now):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_keys:
+                self.buckets.popitem(last=False)
+            bucket = self.buckets[key] = [self.burst, now]
+            limiter_buckets.set(len(self.buckets), scope=self.scope)
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self.buckets.move_to_end(key)
+        return bucket
+
+    def retry_after(self, key, cost=1.0, now=None):
+        bucket = self._refill(key, now or time.monotonic())
+        if bucket[0] >= cost:
+            return 0.0
+        return (cost - bucket[0]) / self.rate
+
+    def consume(self, key, cost=1.0):
+        self.buckets[key][0] -= cost
+
+
+class CommandAdmission:
+    def __init__(self):
+        self.clients = TokenBucketLimiter(
+            "client", settings.rate_limit_client_rate, settings.rate_limit_client_burst, settings.rate_limit_max_keys)
+        self.devices = TokenBucketLimiter(
+            "device", settings.rate_limit_device_rate, settings.rate_limit_device_burst, settings.rate_limit_max_keys)
+        self.max_in_flight = settings.rate_limit_max_in_flight
+        self.in_flight = 0
+
+    def admit(self, client, device_id=None):
+        """Return 0 when the request is admitted (tokens taken), else the seconds to wait."""
+        if self.in_flight >= self.max_in_flight:
+            limiter_decisions.inc(scope="in_flight", decision="rejected")
+            return 1.0
+
+        now = time.monotonic()
+        retry_after = self.clients.retry_after(client, now=now)
+        if retry_after:
+            limiter_decisions.inc(scope="client", decision="rejected")
+            return retry_after
+
+        if device_id is not None:
+            retry_after = self.devices.retry_after(device_id, now=now)
+            if retry_after:
+                limiter_decisions.inc(scope="device", decision="rejected")
+                return retry_after
+            self.devices.consume(device_id)
+
+        self.clients.consume(client)
+        limiter_decisions.inc(scope="client", decision="admitted")
+        return 0.0
+
+    def admit_device(self, device_id):
+        if self.devices.retry_after(device_id):
+            limiter_decisions.inc(scope="device", decision="rejected")
+            return False
+        self.devices.consume(device_id)
+        return True
+
+    @asynccontextmanager
+    async def track(self, request, device_id=None):
+        if not settings.rate_limit_enabled:
+            yield
+            return
+
+        # The bearer token's user (see app.auth.require_user), else the peer address; never a client-chosen header
+        user_id = getattr(request.state, "user_id", None)
+        if user_id is not None:
+            client = f"user:{user_id}"
+        else:
+            client = request.client.host if request.client else "unknown"
+        retry_after = self.admit(client, device_id)
+        if retry_after:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many command requests",
+                headers={"Retry-After": str(math.ceil(retry_after))}
+            )
+
+        self.in_flight += 1
+        admitted_in_flight.set(self.in_flight)
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            admitted_in_flight.set(self.in_flight)
+
+
+command_admission = CommandAdmission()
+
+
+async def limit_device_command(request: Request, device_id: int = 1):
+    async with command_admission.track(request, device_id):
+        yield
+
+
+async def limit_client_command(request: Request):
+    async with command_admission.track(request):
+        yield
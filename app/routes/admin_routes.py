@@ -0,0 +1,28 @@
+import logging
+from fastapi import APIRouter, Depends, HTTPException
+
+from app.auth import require_admin
+from app.logging_config import log_setup
+from app.schemas.admin_schemas import LoggingConfig, LoggingUpdate
+
+router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(require_admin)])
+
+
+def valid_level(level):
+    return level is None or isinstance(logging.getLevelName(level.upper()), int)
+
+
+@router.get("/logging", response_model=LoggingConfig)
+async def get_logging():
+    return log_setup.state()
+
+
+@router.put("/logging", response_model=LoggingConfig)
+async def update_logging(update: LoggingUpdate):
+    levels = [update.level, *(update.loggers or {}).values()]
+    if not all(valid_level(level) for level in levels):
+        raise HTTPException(status_code=400, detail="Unknown log level")
+    if any(rate is not None and rate < 0 for rate in (update.sampling or {}).values()):
+        raise HTTPException(status_code=400, detail="Sampling rates must be 0 or more")
+
+    return log_setup.configure(update.level, update.loggers, update.sampling)
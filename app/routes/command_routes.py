@@ -1,9 +1,14 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, HTTPException, Request
+from pydantic import BaseModel, Field
 from typing import Dict, List, Optional, Any
+from app.auth import require_user, require_admin, require_device_owner, check_device_owner
+from app.config import settings
 from app.mqtt_client import mqtt_client
+from app.command_tracker import command_tracker
+from app.rate_limiter import limit_device_command, limit_client_command
+from app.serialization import COLUMNAR_MEDIA_TYPE, encode_columnar, wants_columnar, compressed_response
 
-router = APIRouter(prefix="/commands", tags=["commands"])
+router = APIRouter(prefix="/commands", tags=["commands"], dependencies=[Depends(require_user)])
 
 
 class CommandRequest(BaseModel):
@@ -11,6 +16,38 @@ class CommandRequest(BaseModel):
     parameters: Optional[Dict[str, Any]] = None
 
 
+class BulkCommandRequest(BaseModel):
+    action: str
+    parameters: Optional[Dict[str, Any]] = None
+    device_ids: Optional[List[int]] = Field(None, max_length=settings.bulk_command_max_devices)
+    user_id: Optional[int] = None
+
+
+# Set by the service for every published command, never taken from the caller's parameters
+RESERVED_PARAMETERS = ("device_id", "correlation_id")
+
+
+def command_parameters(command):
+    reserved = [name for name in RESERVED_PARAMETERS if name in (command.parameters or {})]
+    if reserved:
+        raise HTTPException(status_code=400, detail=f"Reserved command parameters: {', '.join(reserved)}")
+    return command.parameters or {}
+
+
+def level_value(level):
+    # The ESP32 reports water_level either as a number or as {"percentage": ...}
+    if isinstance(level, dict):
+        return level.get("percentage")
+    return level
+
+
+async def command_response(command, message, wait_for_ack, timeout):
+    response = {"status": "success", "message": message, "correlation_id": command.get("correlation_id")}
+    if wait_for_ack and command.get("correlation_id"):
+        response["ack"] = await command_tracker.wait(command["correlation_id"], timeout)
+    return response
+
+
 @router.get("/sensors/latest")
 async def get_latest_sensor_data():
     if not mqtt_client.latest_sensor_data:
@@ -19,95 +56,155 @@ async def get_latest_sensor_data():
 
 
 @router.get("/sensors/history")
-async def get_sensor_history(limit: int = 10):
+async def get_sensor_history(request: Request, limit: int = 10, format: Optional[str] = None):
     if not mqtt_client.historical_data:
         raise HTTPException(status_code=404, detail="No historical data available")
     limit = min(limit, len(mqtt_client.historical_data))
-    return mqtt_client.historical_data[-limit:]
+    history = mqtt_client.historical_data[-limit:]
+
+    if wants_columnar(request, format):
+        content = encode_columnar(
+            [entry["timestamp"] for entry in history],
+            [level_value(entry["data"].get("water_level")) for entry in history],
+            [level_value(entry["data"].get("beans_level")) for entry in history]
+        )
+        return compressed_response(request, content, COLUMNAR_MEDIA_TYPE)
+    return history
 
 
-@router.post("/coffee/single_brew")
-async def single_brew():
+@router.post("/coffee/single_brew", dependencies=[Depends(require_device_owner), Depends(limit_device_command)])
+async def single_brew(device_id: int = 1, wait_for_ack: bool = False, timeout: Optional[float] = None):
     if not mqtt_client.is_connected:
         raise HTTPException(status_code=503, detail="MQTT client is not connected")
 
-    result = await mqtt_client.send_command({"action": "single_brew"})
+    command = {"action": "single_brew", "device_id": device_id}
+    result = await mqtt_client.send_command(command)
     if result is True:
-        return {"status": "success", "message": "Single brew command sent"}
+        return await command_response(command, "Single brew command sent", wait_for_ack, timeout)
     elif isinstance(result, dict) and "error" in result:
         raise HTTPException(status_code=400, detail=f"Coffee limit exceeded. Available: {result['available']} coffees")
     else:
         raise HTTPException(status_code=500, detail="Failed to send single brew command")
 
 
-@router.post("/coffee/double_brew")
-async def double_brew():
+@router.post("/coffee/double_brew", dependencies=[Depends(require_device_owner), Depends(limit_device_command)])
+async def double_brew(device_id: int = 1, wait_for_ack: bool = False, timeout: Optional[float] = None):
     if not mqtt_client.is_connected:
         raise HTTPException(status_code=503, detail="MQTT client is not connected")
 
-    result = await mqtt_client.send_command({"action": "double_brew"})
+    command = {"action": "double_brew", "device_id": device_id}
+    result = await mqtt_client.send_command(command)
     if result is True:
-        return {"status": "success", "message": "Double brew command sent"}
+        return await command_response(command, "Double brew command sent", wait_for_ack, timeout)
     elif isinstance(result, dict) and "error" in result:
         raise HTTPException(status_code=400, detail=f"Coffee limit exceeded. Available: {result['available']} coffees")
     else:
         raise HTTPException(status_code=500, detail="Failed to send double brew command")
 
 
-@router.post("/coffee/power_toggle")
-async def power_toggle():
+@router.post("/coffee/power_toggle", dependencies=[Depends(require_device_owner), Depends(limit_device_command)])
+async def power_toggle(device_id: int = 1, wait_for_ack: bool = False, timeout: Optional[float] = None):
     if not mqtt_client.is_connected:
         raise HTTPException(status_code=503, detail="MQTT client is not connected")
 
     # Don't update database here, let ESP32 report the state change
-    success = await mqtt_client.send_command({"action": "power_toggle"})
+    command = {"action": "power_toggle", "device_id": device_id}
+    success = await mqtt_client.send_command(command)
     if success:
-        return {"status": "success", "message": "Power toggle command sent"}
+        return await command_response(command, "Power toggle command sent", wait_for_ack, timeout)
     else:
         raise HTTPException(status_code=500, detail="Failed to send power toggle command")
 
 
-@router.post("/coffee/cleaning")
-async def start_cleaning():
+@router.post("/coffee/cleaning", dependencies=[Depends(require_device_owner), Depends(limit_device_command)])
+async def start_cleaning(device_id: int = 1, wait_for_ack: bool = False, timeout: Optional[float] = None):
     if not mqtt_client.is_connected:
         raise HTTPException(status_code=503, detail="MQTT client is not connected")
 
-    success = await mqtt_client.send_command({"action": "cleaning"})
+    command = {"action": "cleaning", "device_id": device_id}
+    success = await mqtt_client.send_command(command)
     if success:
-        return {"status": "success", "message": "Cleaning command sent"}
+        return await command_response(command, "Cleaning command sent", wait_for_ack, timeout)
     else:
         raise HTTPException(status_code=500, detail="Failed to send cleaning command")
 
 
-@router.post("/coffee/read_sensors")
-async def request_sensor_reading():
+@router.post("/coffee/read_sensors", dependencies=[Depends(require_device_owner), Depends(limit_device_command)])
+async def request_sensor_reading(device_id: int = 1, wait_for_ack: bool = False, timeout: Optional[float] = None):
     if not mqtt_client.is_connected:
         raise HTTPException(status_code=503, detail="MQTT client is not connected")
 
-    success = await mqtt_client.send_command({"action": "read_sensors"})
+    command = {"action": "read_sensors", "device_id": device_id}
+    success = await mqtt_client.send_command(command)
     if success:
-        return {"status": "success", "message": "Sensor reading requested"}
+        return await command_response(command, "Sensor reading requested", wait_for_ack, timeout)
     else:
         raise HTTPException(status_code=500, detail="Failed to request sensor reading")
 
 
-@router.post("/send")
-async def send_command(command: CommandRequest):
+@router.post("/send", dependencies=[Depends(require_device_owner), Depends(limit_device_command)])
+async def send_command(command: CommandRequest, device_id: int = 1, wait_for_ack: bool = False,
+                       timeout: Optional[float] = None):
     if not mqtt_client.is_connected:
         raise HTTPException(status_code=503, detail="MQTT client is not connected")
 
-    command_data = {"action": command.action}
-    if command.parameters:
-        command_data.update(command.parameters)
+    # device_id is the one the per-device limiter admitted, parameters can't change it
+    command_data = {"action": command.action, **command_parameters(command), "device_id": device_id}
 
     success = await mqtt_client.send_command(command_data)
     if success:
-        return {"status": "success", "message": f"Command '{command.action}' sent"}
+        return await command_response(command_data, f"Command '{command.action}' sent", wait_for_ack, timeout)
     else:
         raise HTTPException(status_code=500, detail=f"Failed to send command '{command.action}'")
 
 
-@router.get("/debug")
+@router.post("/bulk", dependencies=[Depends(limit_client_command)])
+async def send_bulk_command(command: BulkCommandRequest, user_id: Optional[int] = Depends(require_user)):
+    if not mqtt_client.is_connected:
+        raise HTTPException(status_code=503, detail="MQTT client is not connected")
+
+    if command.device_ids is None and command.user_id is None:
+        raise HTTPException(status_code=400, detail="Either device_ids or user_id must be provided")
+    if user_id is not None and command.user_id not in (None, user_id):
+        raise HTTPException(status_code=403, detail="Not allowed for another user's fleet")
+
+    command_data = {"action": command.action, **command_parameters(command)}
+
+    results = await mqtt_client.send_bulk_command(
+        command_data,
+        device_ids=command.device_ids,
+        # Devices of other users are reported as not_found
+        user_id=command.user_id if user_id is None else user_id
+    )
+    if results is None:
+        raise HTTPException(status_code=500, detail=f"Failed to send bulk command '{command.action}'")
+
+    summary = {"sent": 0, "skipped": 0, "failed": 0, "not_found": 0}
+    for result in results:
+        summary[result["status"]] += 1
+
+    return {
+        "status": "success",
+        "message": f"Command '{command.action}' sent to {summary['sent']} of {len(results)} devices",
+        "summary": summary,
+        "results": results
+    }
+
+
+@router.get("/status/{correlation_id}")
+async def get_command_status(correlation_id: str, wait: bool = False, timeout: Optional[float] = None,
+                             user_id: Optional[int] = Depends(require_user)):
+    status = command_tracker.status(correlation_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Command not found")
+    await check_device_owner(user_id, status["device_id"])
+
+    if wait:
+        status = await command_tracker.wait(correlation_id, timeout) or status
+    return status
+
+
+@router.get("/debug", dependencies=[Depends(require_admin)])
 async def debug_info():
     return {
         "mqtt_connected": mqtt_client.is_connected,
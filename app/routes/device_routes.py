@@ -1,17 +1,29 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from typing import List
+from typing import List, Optional
+from datetime import date, datetime, timedelta
 
+from app.auth import require_user, require_admin, require_device_owner, check_assignee
+from app.bulk import bulk_insert, reject_batch
 from app.database import get_db
+from app.alerts import alert_engine
+from app.presence import presence_tracker
+from app.device_cache import device_cache, CachedDevice
 from app.models import Device, User
-from app.schemas.device_schemas import DeviceCreate, Device as DeviceSchema
+from app.schemas.bulk_schemas import BulkCreateResult
+from app.serialization import DEVICE_COLUMNS, dumps, json_response
+from app.schemas.device_schemas import DeviceCreate, DeviceBulkCreate, DailyUsage, PresenceList, \
+    Device as DeviceSchema
+from app.usage import load_usage, apply_usage, usage_by_day, usage_recorder, NO_USAGE
 
 router = APIRouter(prefix="/devices", tags=["devices"])
 
 
 @router.post("/", response_model=DeviceSchema)
-async def create_device(device: DeviceCreate, db: AsyncSession = Depends(get_db)):
+async def create_device(device: DeviceCreate, db: AsyncSession = Depends(get_db),
+                        user_id: Optional[int] = Depends(require_user)):
+    check_assignee(user_id, device.user_id)
     result = await db.execute(
         select(User).where(User.id == device.user_id)
     )
@@ -28,16 +40,91 @@ async def create_device(device: DeviceCreate, db: AsyncSession = Depends(get_db)
     db.add(db_device)
     await db.commit()
     await db.refresh(db_device)
+    device_cache.add(db_device)
     return db_device
 
 
+@router.post("/bulk", response_model=BulkCreateResult, dependencies=[Depends(require_admin)])
+async def create_devices_bulk(batch: DeviceBulkCreate, db: AsyncSession = Depends(get_db)):
+    user_ids = {device.user_id for device in batch.devices}
+    result = await db.execute(
+        select(User.id).where(User.id.in_(user_ids))
+    )
+    existing_users = set(result.scalars().all())
+
+    results = []
+    rows = {}
+    for index, device in enumerate(batch.devices):
+        results.append({"index": index, "status": "pending"})
+        if device.user_id not in existing_users:
+            results[index].update(status="failed", error="User not found")
+            continue
+        rows[index] = {
+            "device_name": device.device_name,
+            "user_id": device.user_id,
+            "total_active_time": device.total_active_time
+        }
+
+    if batch.atomic and len(rows) < len(batch.devices):
+        reject_batch(results, "Batch rejected, some devices are invalid")
+
+    outcome = await bulk_insert(db, Device, rows, results, batch.atomic)
+    for result in outcome["results"]:
+        if result["status"] == "created":
+            row = rows[result["index"]]
+            device_cache.add(CachedDevice(result["id"], row["user_id"], row["device_name"]))
+    return outcome
+
+
 @router.get("/", response_model=List[DeviceSchema])
-async def get_devices(db: AsyncSession = Depends(get_db), skip: int = 0, limit: int = 100):
+async def get_devices(db: AsyncSession = Depends(get_db), skip: int = 0, limit: int = 100,
+                      user_id: Optional[int] = None, fast: bool = False):
+    query = select(*DEVICE_COLUMNS) if fast else select(Device)
+    if user_id is not None:
+        query = query.where(Device.user_id == user_id)
     result = await db.execute(
-        select(Device).offset(skip).limit(limit)
+        query.order_by(Device.id).offset(skip).limit(limit)
     )
+    if fast:
+        rows = result.all()
+        usage = await load_usage(db, [row.id for row in rows])
+        return json_response(dumps([
+            apply_usage(row._asdict(), usage.get(row.id, NO_USAGE)) for row in rows
+        ]))
+
     devices = result.scalars().all()
-    return devices
+    usage = await load_usage(db, [device.id for device in devices])
+    return [
+        apply_usage(DeviceSchema.model_validate(device).model_dump(), usage.get(device.id, NO_USAGE))
+        for device in devices
+    ]
+
+
+@router.get("/presence", response_model=PresenceList)
+async def get_presence(online: Optional[bool] = None, skip: int = 0, limit: int = 1000):
+    # Served from the presence tracker, for every device in the device cache
+    online_count = sum(1 for device_id in presence_tracker.online if device_id in device_cache)
+    if online is True:
+        device_ids = [device_id for device_id in presence_tracker.online if device_id in device_cache]
+    elif online is False:
+        device_ids = [device_id for device_id in device_cache.devices if device_id not in presence_tracker.online]
+    else:
+        device_ids = list(device_cache.devices)
+    device_ids.sort()
+
+    last_seen = presence_tracker.last_seen
+    return json_response(dumps({
+        "online": online_count,
+        "offline": len(device_cache.devices) - online_count,
+        "devices": [
+            {
+                "device_id": device_id,
+                "online": device_id in presence_tracker.online,
+                "last_seen": datetime.utcfromtimestamp(last_seen[device_id]) if device_id in last_seen else None
+            }
+            for device_id in device_ids[skip:skip + limit]
+        ]
+    }))
 
 
 @router.get("/{id}", response_model=DeviceSchema)
@@ -49,11 +136,29 @@ async def get_device(id: int, db: AsyncSession = Depends(get_db)):
 
     if db_device is None:
         raise HTTPException(status_code=404, detail="Device not found")
-    return db_device
+
+    usage = await load_usage(db, [id])
+    return apply_usage(DeviceSchema.model_validate(db_device).model_dump(), usage.get(id, NO_USAGE))
+
+
+@router.get("/{id}/usage", response_model=List[DailyUsage])
+async def get_device_usage(id: int, start: Optional[date] = None, end: Optional[date] = None,
+                           db: AsyncSession = Depends(get_db)):
+    result = await db.execute(
+        select(Device.id).where(Device.id == id)
+    )
+    if result.scalar_one_or_none() is None:
+        raise HTTPException(status_code=404, detail="Device not found")
+
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=29)
+    return await usage_by_day(db, [id], start, end)
 
 
 @router.put("/{id}", response_model=DeviceSchema)
-async def update_device(device_id: int, device: DeviceCreate, db: AsyncSession = Depends(get_db)):
+async def update_device(device_id: int, device: DeviceCreate, db: AsyncSession = Depends(get_db),
+                        user_id: Optional[int] = Depends(require_device_owner)):
+    check_assignee(user_id, device.user_id)
     result = await db.execute(
         select(Device).where(Device.id == device_id)
     )
@@ -76,10 +181,12 @@ async def update_device(device_id: int, device: DeviceCreate, db: AsyncSession =
 
     await db.commit()
     await db.refresh(db_device)
-    return db_device
+    device_cache.add(db_device)
+    usage = await load_usage(db, [device_id])
+    return apply_usage(DeviceSchema.model_validate(db_device).model_dump(), usage.get(device_id, NO_USAGE))
 
 
-@router.delete("/{id}")
+@router.delete("/{id}", dependencies=[Depends(require_device_owner)])
 async def delete_device(device_id: int, db: AsyncSession = Depends(get_db)):
     result = await db.execute(
         select(Device).where(Device.id == device_id)
@@ -91,4 +198,8 @@ async def delete_device(device_id: int, db: AsyncSession = Depends(get_db)):
 
     await db.delete(db_device)
     await db.commit()
+    device_cache.remove(device_id)
+    alert_engine.forget(device_id)
+    presence_tracker.forget(device_id)
+    usage_recorder.forget(device_id)
     return {"message": f"Device with id: {device_id}, deleted"}
\ No newline at end of file
@@ -1,15 +1,31 @@
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+import math
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
-from typing import List
-from datetime import datetime, timedelta
+from sqlalchemy import select, func, true
+from typing import List, Optional
+from datetime import datetime, timedelta, timezone
 
 from app.database import get_db
+from app.anomaly import anomaly_detector
+from app.archive import read_archive
+from app.config import settings
+from app.compression import reconstruct
+from app.forecast import fit_consumption, series_to_arrays
 from app.models import SensorData, Device
-from app.schemas.sensors_schemas import SensorDataCreate, SensorData as SensorDataSchema, DeviceStatistics
+from app.query_cache import query_cache
+from app.usage import load_usage, apply_usage, NO_USAGE
+from app.schemas.device_schemas import Device as DeviceSchema
+from app.serialization import SENSOR_DATA_COLUMNS, COLUMNAR_MEDIA_TYPE, encode_sensor_rows, json_response, \
+    encode_sensor_columns, encode_columnar, wants_columnar, compressed_response
+from app.schemas.sensors_schemas import SensorDataCreate, SensorData as SensorDataSchema, DeviceStatistics, \
+    DevicePrediction, QuarantinedReading
 
 router = APIRouter(prefix="/sensors", tags=["sensors"])
 
+SERIES_MAX_POINTS = 10000
+
 
 def get_water_status(level: float) -> str:
     if level >= 80:
@@ -23,7 +39,6 @@ def get_water_status(level: float) -> str:
 
 
 def get_beans_status(level: float) -> str:
-    print(level)
     if level >= 80:
         return "perfect"
     elif level >= 50:
@@ -60,6 +75,66 @@ def get_cleaning_status(last_cleaning: datetime) -> str:
         return "critical"
 
 
+def get_device_statuses(device, latest_sensor_data):
+    # `device` is a dict with the usage counters applied (see app.usage.apply_usage)
+    if not latest_sensor_data:
+        return {
+            "water": {"status": "perfect", "value": 100},
+            "beans": {"status": "perfect", "value": 100},
+            "cleaning": {"status": "perfect", "value": 0},
+            "cups": {"status": "perfect", "value": device["numbers_of_coffee"] or 0}
+        }
+
+    water_level = latest_sensor_data.water_level or 100
+    beans_level = latest_sensor_data.beans_level
+    coffee_count = device["numbers_of_coffee"] or 0
+    days_since_cleaning = (datetime.utcnow() - device["last_cleaning_time"]).days
+
+    water_status = get_water_status(water_level)
+    beans_status = get_beans_status(beans_level)
+    cups_status = get_cups_status(coffee_count)
+    cleaning_status = get_cleaning_status(device["last_cleaning_time"])
+
+    return {
+        "water": {"status": water_status, "value": water_level},
+        "beans": {"status": beans_status, "value": beans_level},
+        "cleaning": {"status": cleaning_status, "value": days_since_cleaning},
+        "cups": {"status": cups_status, "value": coffee_count}
+    }
+
+
+async def get_latest_readings(db, device_ids):
+    # One LATERAL lookup per device on the (device_id, timestamp) index, all in a single query
+    latest = (
+        select(SensorData.water_level, SensorData.beans_level, SensorData.timestamp)
+        .where(SensorData.device_id == Device.id, SensorData.anomaly_flags == 0)
+        .order_by(SensorData.timestamp.desc())
+        .limit(1)
+        .lateral()
+    )
+    result = await db.execute(
+        select(Device.id, latest.c.water_level, latest.c.beans_level, latest.c.timestamp)
+        .join(latest, true())
+        .where(Device.id.in_(device_ids))
+    )
+    return {row.id: row for row in result.all()}
+
+
+def forecast_by_device(fit):
+    forecasts = {}
+    for device_id, level, last_time, rate, hours, samples in zip(
+            fit["device_id"].tolist(), fit["level"].tolist(), fit["last_time"].tolist(),
+            fit["rate"].tolist(), fit["hours_to_empty"].tolist(), fit["samples"].tolist()):
+        forecasts[device_id] = {
+            "level": level,
+            "rate_per_hour": None if math.isnan(rate) else rate,
+            "hours_to_empty": None if math.isnan(hours) else hours,
+            "empty_at": None if math.isnan(hours) else datetime.utcfromtimestamp(last_time + hours * 3600),
+            "samples": samples
+        }
+    return forecasts
+
+
 @router.post("/", response_model=SensorDataSchema)
 async def create_sensor_data(sensor_data: SensorDataCreate, db: AsyncSession = Depends(get_db)):
     result = await db.execute(
@@ -78,19 +153,66 @@ async def create_sensor_data(sensor_data: SensorDataCreate, db: AsyncSession = D
     )
     db.add(db_sensor_data)
     await db.commit()
+    query_cache.bump(sensor_data.device_id)
     await db.refresh(db_sensor_data)
     return db_sensor_data
 
 
 @router.get("/", response_model=List[SensorDataSchema])
-async def get_sensor_data(db: AsyncSession = Depends(get_db), skip: int = 0, limit: int = 100):
+async def get_sensor_data(db: AsyncSession = Depends(get_db), skip: int = 0, limit: int = 100,
+                          exclude_anomalies: bool = False, fast: bool = False):
+    query = select(*SENSOR_DATA_COLUMNS) if fast else select(SensorData)
+    if exclude_anomalies:
+        query = query.where(SensorData.anomaly_flags == 0)
     result = await db.execute(
-        select(SensorData).offset(skip).limit(limit).order_by(SensorData.timestamp.desc())
+        query.offset(skip).limit(limit).order_by(SensorData.timestamp.desc())
     )
+    if fast:
+        return json_response(encode_sensor_rows(result.all()))
+
     sensor_data = result.scalars().all()
     return sensor_data
 
 
+@router.get("/predictions", response_model=List[DevicePrediction])
+async def get_consumption_predictions(device_id: Optional[int] = None, window_hours: Optional[int] = None,
+                                      db: AsyncSession = Depends(get_db)):
+    since = datetime.utcnow() - timedelta(hours=window_hours or settings.forecast_window_hours)
+    query = (
+        select(SensorData.device_id, SensorData.timestamp, SensorData.water_level, SensorData.beans_level)
+        .where(SensorData.timestamp >= since, SensorData.anomaly_flags == 0)
+        .order_by(SensorData.device_id, SensorData.timestamp)
+    )
+    if device_id is not None:
+        query = query.where(SensorData.device_id == device_id)
+
+    result = await db.execute(query)
+    device_ids, times, water, beans = series_to_arrays(result.all())
+
+    water_forecast = forecast_by_device(fit_consumption(
+        device_ids, times, water, settings.forecast_refill_threshold, settings.forecast_min_samples))
+    beans_forecast = forecast_by_device(fit_consumption(
+        device_ids, times, beans, settings.forecast_refill_threshold, settings.forecast_min_samples))
+
+    return [
+        {
+            "device_id": device,
+            "water": water_forecast.get(device, {}),
+            "beans": beans_forecast.get(device, {})
+        }
+        for device in sorted(water_forecast.keys() | beans_forecast.keys())
+    ]
+
+
+@router.get("/quarantine", response_model=List[QuarantinedReading])
+async def get_quarantined_readings(device_id: Optional[int] = None, limit: int = 100):
+    readings = [
+        reading for reading in reversed(anomaly_detector.quarantined)
+        if device_id is None or reading["device_id"] == device_id
+    ]
+    return readings[:limit]
+
+
 @router.get("/{id}", response_model=SensorDataSchema)
 async def get_sensor_data_by_id(id: int, db: AsyncSession = Depends(get_db)):
     result = await db.execute(
@@ -104,15 +226,80 @@ async def get_sensor_data_by_id(id: int, db: AsyncSession = Depends(get_db)):
 
 
 @router.get("/device/{device_id}", response_model=List[SensorDataSchema])
-async def get_sensor_data_by_device(device_id: int, db: AsyncSession = Depends(get_db), limit: int = 100):
-    result = await db.execute(
-        select(SensorData)
-        .where(SensorData.device_id == device_id)
-        .order_by(SensorData.timestamp.desc())
-        .limit(limit)
+async def get_sensor_data_by_device(request: Request, device_id: int, db: AsyncSession = Depends(get_db),
+                                    limit: int = 100, exclude_anomalies: bool = False, fast: bool = False,
+                                    format: Optional[str] = None):
+    columnar = wants_columnar(request, format)
+    key = ("device", limit, exclude_anomalies)
+    rows = query_cache.lookup(device_id, key)
+    if rows is None:
+        version = query_cache.version(device_id)
+        query = select(*SENSOR_DATA_COLUMNS).where(SensorData.device_id == device_id)
+        if exclude_anomalies:
+            query = query.where(SensorData.anomaly_flags == 0)
+        result = await db.execute(
+            query
+            .order_by(SensorData.timestamp.desc())
+            .limit(limit)
+        )
+        rows = result.all()
+        query_cache.store(device_id, key, version, rows)
+
+    if columnar:
+        content = encode_sensor_columns(rows, device_id=device_id)
+        return compressed_response(request, content, COLUMNAR_MEDIA_TYPE)
+    if fast:
+        return json_response(encode_sensor_rows(rows))
+
+    return rows
+
+
+@router.get("/device/{device_id}/series")
+async def get_reconstructed_series(request: Request, device_id: int, start: Optional[datetime] = None,
+                                   end: Optional[datetime] = None, step: int = 60, method: Optional[str] = None,
+                                   db: AsyncSession = Depends(get_db)):
+    # Readings may be stored compressed (see app.compression), so resample them onto a regular grid
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(hours=settings.forecast_window_hours)
+    start, end = [
+        value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value for value in (start, end)
+    ]
+    method = method or ("linear" if settings.sensor_compression == "swinging_door" else "previous")
+
+    if method not in ("previous", "linear"):
+        raise HTTPException(status_code=400, detail="method must be 'previous' or 'linear'")
+    if step <= 0 or start > end or (end - start).total_seconds() / step >= SERIES_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"Invalid range, at most {SERIES_MAX_POINTS} points per request")
+
+    columns = (SensorData.device_id, SensorData.timestamp, SensorData.water_level, SensorData.beans_level)
+    stored = SensorData.device_id == device_id, SensorData.anomaly_flags == 0
+    # The last reading before the window seeds the first grid points
+    before = await db.execute(
+        select(*columns).where(*stored, SensorData.timestamp < start).order_by(SensorData.timestamp.desc()).limit(1)
     )
-    sensor_data = result.scalars().all()
-    return sensor_data
+    within = await db.execute(
+        select(*columns).where(*stored, SensorData.timestamp >= start, SensorData.timestamp <= end)
+        .order_by(SensorData.timestamp)
+    )
+    _, times, water, beans = series_to_arrays(before.all() + within.all())
+
+    points = int((end - start).total_seconds() // step) + 1
+    grid = np.datetime64(start, "us").astype(np.int64) / 1e6 + np.arange(points) * step
+    content = encode_columnar(
+        [start + timedelta(seconds=step * index) for index in range(points)],
+        reconstruct(times, water, grid, method).tolist(),
+        reconstruct(times, beans, grid, method).tolist(),
+        device_id=device_id,
+        method=method,
+        step=step
+    )
+    return compressed_response(request, content, COLUMNAR_MEDIA_TYPE)
+
+
+@router.get("/archive/{device_id}", response_model=List[SensorDataSchema])
+async def get_archived_sensor_data(device_id: int, start: Optional[datetime] = None,
+                                   end: Optional[datetime] = None, limit: int = 100):
+    return await asyncio.to_thread(read_archive, device_id, start, end, limit)
 
 
 @router.get("/statistics/{device_id}", response_model=DeviceStatistics)
@@ -125,44 +312,25 @@ async def get_device_statistics(device_id: int = 1, db: AsyncSession = Depends(g
     if not device:
         raise HTTPException(status_code=404, detail="Device not found")
 
-    sensor_result = await db.execute(
-        select(SensorData)
-        .where(SensorData.device_id == device_id)
-        .order_by(SensorData.timestamp.desc())
-        .limit(1)
-    )
-    latest_sensor_data = sensor_result.scalar_one_or_none()
-    print(latest_sensor_data, "SENORDATA")
-
-    if not latest_sensor_data:
-        return {
-            "name": device.device_name or "Magnifica-S",
-            "statuses": {
-                "water": {"status": "perfect", "value": 100},
-                "beans": {"status": "perfect", "value": 100},
-                "cleaning": {"status": "perfect", "value": 0},
-                "cups": {"status": "perfect", "value": device.numbers_of_coffee or 0}
-            }
-        }
-
-    water_level = latest_sensor_data.water_level or 100
-    beans_level = latest_sensor_data.beans_level
-    coffee_count = device.numbers_of_coffee or 0
-    days_since_cleaning = (datetime.utcnow() - device.last_cleaning_time).days
-
-    water_status = get_water_status(water_level)
-    beans_status = get_beans_status(beans_level)
-    cups_status = get_cups_status(coffee_count)
-    cleaning_status = get_cleaning_status(device.last_cleaning_time)
+    latest = query_cache.lookup(device_id, ("latest",))
+    if latest is None:
+        version = query_cache.version(device_id)
+        sensor_result = await db.execute(
+            select(*SENSOR_DATA_COLUMNS)
+            .where(SensorData.device_id == device_id, SensorData.anomaly_flags == 0)
+            .order_by(SensorData.timestamp.desc())
+            .limit(1)
+        )
+        latest = sensor_result.all()
+        query_cache.store(device_id, ("latest",), version, latest)
+    latest_sensor_data = latest[0] if latest else None
+
+    usage = await load_usage(db, [device_id])
+    counters = apply_usage(DeviceSchema.model_validate(device).model_dump(), usage.get(device_id, NO_USAGE))
 
     return {
         "name": device.device_name or "Magnifica-S",
-        "statuses": {
-            "water": {"status": water_status, "value": water_level},
-            "beans": {"status": beans_status, "value": beans_level},
-            "cleaning": {"status": cleaning_status, "value": days_since_cleaning},
-            "cups": {"status": cups_status, "value": coffee_count}
-        }
+        "statuses": get_device_statuses(counters, latest_sensor_data)
     }
 
 
@@ -178,4 +346,5 @@ async def delete_sensor_data(sensor_id: int, db: AsyncSession = Depends(get_db))
 
     await db.delete(db_sensor_data)
     await db.commit()
+    query_cache.bump(db_sensor_data.device_id)
     return {"message": f"Sensor data with id: {sensor_id}, deleted"}
\ No newline at end of file
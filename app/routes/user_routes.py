@@ -1,11 +1,22 @@
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from typing import List
+from sqlalchemy.orm import selectinload
+from typing import List, Optional
+from datetime import date, datetime, timedelta
 
+from app.auth import password_hasher, token_signer, require_self
+from app.bulk import bulk_insert, reject_batch
 from app.database import get_db
-from app.models import User
-from app.schemas.user_schemas import UserCreate, User as UserSchema
+from app.models import User, Device
+from app.schemas.bulk_schemas import BulkCreateResult
+from app.schemas.device_schemas import Device as DeviceSchema, DailyUsage
+from app.serialization import USER_COLUMNS, encode_rows, json_response
+from app.schemas.user_schemas import UserCreate, UserBulkCreate, User as UserSchema, UserOverview, LoginRequest, \
+    Token
+from app.routes.sensors_routes import get_device_statuses, get_latest_readings
+from app.usage import load_usage, apply_usage, usage_by_day, NO_USAGE
 
 router = APIRouter(prefix="/users", tags=["users"])
 
@@ -23,18 +34,78 @@ async def create_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
         name=user.name,
         surname=user.surname,
         email=user.email,
-        password=user.password
+        password=await password_hasher.hash(user.password)
     )
     db.add(db_user)
     await db.commit()
     await db.refresh(db_user)
     return db_user
 
+@router.post("/bulk", response_model=BulkCreateResult)
+async def create_users_bulk(batch: UserBulkCreate, db: AsyncSession = Depends(get_db)):
+    emails = {user.email for user in batch.users}
+    result = await db.execute(
+        select(User.email).where(User.email.in_(emails))
+    )
+    registered = set(result.scalars().all())
+
+    results = []
+    rows = {}
+    seen = set()
+    for index, user in enumerate(batch.users):
+        results.append({"index": index, "status": "pending"})
+        if user.email in registered:
+            results[index].update(status="failed", error="Email already registered")
+            continue
+        if user.email in seen:
+            results[index].update(status="failed", error="Duplicate email in batch")
+            continue
+        seen.add(user.email)
+        rows[index] = {
+            "name": user.name,
+            "surname": user.surname,
+            "email": user.email,
+            "password": user.password
+        }
+
+    if batch.atomic and len(rows) < len(batch.users):
+        reject_batch(results, "Batch rejected, some users are invalid")
+    else:
+        hashes = await asyncio.gather(*(password_hasher.hash(row["password"]) for row in rows.values()))
+        for row, password in zip(rows.values(), hashes):
+            row["password"] = password
+
+    return await bulk_insert(db, User, rows, results, batch.atomic)
+
+@router.post("/login", response_model=Token)
+async def login(credentials: LoginRequest, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(
+        select(User).where(User.email == credentials.email)
+    )
+    db_user = result.scalar_one_or_none()
+
+    stored = db_user.password if db_user else password_hasher.dummy_hash
+    matches, needs_rehash = await password_hasher.verify(credentials.password, stored)
+    if db_user is None or not matches:
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+
+    if needs_rehash:
+        # Legacy plain text password (or old scrypt parameters)
+        db_user.password = await password_hasher.hash(credentials.password)
+        await db.commit()
+
+    token, expires_at = token_signer.issue(db_user.id)
+    return {"access_token": token, "expires_at": expires_at}
+
 @router.get("/", response_model=List[UserSchema])
-async def get_users(db: AsyncSession = Depends(get_db), skip: int = 0, limit: int = 100):
+async def get_users(db: AsyncSession = Depends(get_db), skip: int = 0, limit: int = 100, fast: bool = False):
+    query = select(*USER_COLUMNS) if fast else select(User)
     result = await db.execute(
-        select(User).offset(skip).limit(limit)
+        query.offset(skip).limit(limit)
     )
+    if fast:
+        return json_response(encode_rows(USER_COLUMNS, result.all()))
+
     users = result.scalars().all()
     return users
 
@@ -49,10 +120,58 @@ async def get_user(id: int, db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
 
-@router.put("/{id}", response_model=UserSchema)
-async def update_user(user_id: int, user: UserCreate, db: AsyncSession = Depends(get_db)):
+@router.get("/{id}/overview", response_model=UserOverview)
+async def get_user_overview(id: int, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(
+        select(User).options(selectinload(User.devices)).where(User.id == id)
+    )
+    db_user = result.scalar_one_or_none()
+
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    latest_readings = {}
+    usage = {}
+    if db_user.devices:
+        device_ids = [device.id for device in db_user.devices]
+        latest_readings = await get_latest_readings(db, device_ids)
+        usage = await load_usage(db, device_ids)
+
+    devices = [
+        apply_usage(DeviceSchema.model_validate(device).model_dump(), usage.get(device.id, NO_USAGE))
+        for device in db_user.devices
+    ]
+    return {
+        "id": db_user.id,
+        "name": db_user.name,
+        "surname": db_user.surname,
+        "email": db_user.email,
+        "devices": [
+            {**device, "statuses": get_device_statuses(device, latest_readings.get(device["id"]))}
+            for device in devices
+        ]
+    }
+
+@router.get("/{id}/usage", response_model=List[DailyUsage])
+async def get_user_usage(id: int, start: Optional[date] = None, end: Optional[date] = None,
+                         db: AsyncSession = Depends(get_db)):
+    result = await db.execute(
+        select(User.id).where(User.id == id)
+    )
+    if result.scalar_one_or_none() is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=29)
+    result = await db.execute(
+        select(Device.id).where(Device.user_id == id)
+    )
+    return await usage_by_day(db, result.scalars().all(), start, end)
+
+@router.put("/{id}", response_model=UserSchema, dependencies=[Depends(require_self)])
+async def update_user(id: int, user: UserCreate, db: AsyncSession = Depends(get_db)):
     result = await db.execute(
-        select(User).where(User.id == user_id)
+        select(User).where(User.id == id)
     )
     db_user = result.scalar_one_or_none()
 
@@ -62,16 +181,16 @@ async def update_user(user_id: int, user: UserCreate, db: AsyncSession = Depends
     db_user.name = user.name
     db_user.surname = user.surname
     db_user.email = user.email
-    db_user.password = user.password
+    db_user.password = await password_hasher.hash(user.password)
 
     await db.commit()
     await db.refresh(db_user)
     return db_user
 
-@router.delete("/{id}")
-async def delete_user(user_id: int, db: AsyncSession = Depends(get_db)):
+@router.delete("/{id}", dependencies=[Depends(require_self)])
+async def delete_user(id: int, db: AsyncSession = Depends(get_db)):
     result = await db.execute(
-        select(User).where(User.id == user_id)
+        select(User).where(User.id == id)
     )
     db_user = result.scalar_one_or_none()
 
@@ -80,4 +199,4 @@ async def delete_user(user_id: int, db: AsyncSession = Depends(get_db)):
 
     await db.delete(db_user)
     await db.commit()
-    return {"message": f"User with id: {user_id}, deleted"}
+    return {"message": f"User with id: {id}, deleted"}
@@ -1,45 +1,172 @@
 import asyncio
-from datetime import datetime, time as dt_time
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import update
+import hashlib
+import math
+import random
+import time
+from datetime import datetime
+from sqlalchemy import select, update, func
+from app import database
+from app.config import settings
 from app.database import AsyncSessionLocal
-from app.models import Device
+from app.archive import run_archive
+from app.metrics import metrics
+from app.models import Device, ScheduledJob
 import logging
 
 logger = logging.getLogger(__name__)
 
+DAY = 86400
+
+job_runs = metrics.counter("job_runs_total", "Scheduled job runs by outcome")
+job_duration = metrics.histogram("job_duration_seconds", "Duration of scheduled job runs",
+                                 buckets=(0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600))
+job_last_success = metrics.gauge("job_last_success_timestamp_seconds", "Slot time of the last successful job run")
+
 
 async def reset_daily_coffee_count():
-    try:
+    # Daily use is counted per UTC day in the rollup; only allowances set before the
+    # event log (or left NULL) still need resetting, so most days this writes nothing
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            update(Device).where(Device.numbers_of_coffee.is_distinct_from(4)).values(numbers_of_coffee=4)
+        )
+        await db.commit()
+        logger.info("Reset coffee count for all devices to 4. Affected rows: %s", result.rowcount)
+
+
+class Job:
+    """
+    A periodic job run at UTC times `offset + k * interval` (so `interval=DAY` runs at midnight).
+    """
+
+    def __init__(self, name, func, interval, offset=0, timeout=None, jitter=0, catch_up=True):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.offset = offset
+        self.timeout = timeout
+        self.jitter = jitter
+        self.catch_up = catch_up
+        # Stable 64-bit advisory lock key shared by every instance
+        self.lock_key = int.from_bytes(hashlib.blake2b(name.encode(), digest_size=8).digest(), "big", signed=True)
+
+    def slot(self, now):
+        """Latest scheduled time (epoch seconds) at or before `now`."""
+        return math.floor((now - self.offset) / self.interval) * self.interval + self.offset
+
+
+class JobRunner:
+    """
+    Runs registered jobs in every process while making sure each slot executes once.
+
+    A run holds a session-level advisory lock on the job, on a connection of its own,
+    and records the slot in `scheduled_jobs`; other instances either fail to take the
+    lock or find the slot already done. The job itself runs outside any transaction of
+    the runner, so a long archive run doesn't keep one open. After a restart the latest
+    missed slot is run straight away (catch-up).
+    """
+
+    def __init__(self):
+        self.jobs = {}
+
+    def register(self, name, func, interval, **options):
+        self.jobs[name] = Job(name, func, interval, **options)
+        return self.jobs[name]
+
+    async def execute(self, job, slot, startup=False):
+        """Run the job for `slot` unless another instance has; returns True once the slot is done."""
+        async with database.engine.connect() as lock:
+            locked = (await lock.execute(select(func.pg_try_advisory_lock(job.lock_key)))).scalar()
+            # The lock outlives the transaction, which isn't left open for the run
+            await lock.commit()
+            if not locked:
+                job_runs.inc(job=job.name, status="locked")
+                return False
+            try:
+                return await self.run_slot(job, slot, startup)
+            finally:
+                await lock.execute(select(func.pg_advisory_unlock(job.lock_key)))
+                await lock.commit()
+
+    async def run_slot(self, job, slot, startup):
+        scheduled_for = datetime.utcfromtimestamp(slot)
         async with AsyncSessionLocal() as db:
-            result = await db.execute(
-                update(Device).values(numbers_of_coffee=4)
-            )
+            state = await db.get(ScheduledJob, job.name)
+            if state is None:
+                state = ScheduledJob(name=job.name)
+                db.add(state)
+                if startup:
+                    # First deployment: start from the current slot rather than running at startup
+                    state.last_scheduled_for = scheduled_for
+                    state.last_status = "initialized"
+                    await db.commit()
+                    return True
+            elif state.last_scheduled_for is not None and state.last_scheduled_for >= scheduled_for:
+                return True
+            state.last_started_at = datetime.utcnow()
             await db.commit()
-            logger.info(f"Reset coffee count for all devices to 4. Affected rows: {result.rowcount}")
-    except Exception as e:
-        logger.error(f"Error resetting daily coffee count: {e}")
 
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(job.func(), job.timeout)
+            status = "succeeded"
+        except asyncio.TimeoutError:
+            status = "timeout"
+            logger.error("Job %s timed out after %ss", job.name, job.timeout)
+        except Exception as e:
+            status = "failed"
+            logger.error("Job %s failed: %s", job.name, e, exc_info=True)
+        duration = time.perf_counter() - started
+
+        async with AsyncSessionLocal() as db:
+            state = await db.get(ScheduledJob, job.name)
+            state.last_finished_at = datetime.utcnow()
+            state.last_status = status
+            state.last_duration = duration
+            if status == "succeeded":
+                state.last_scheduled_for = scheduled_for
+                job_last_success.set(slot, job=job.name)
+            await db.commit()
+
+        job_runs.inc(job=job.name, status=status)
+        job_duration.observe(duration, job=job.name)
+        logger.info("Job %s for %s %s in %.1fs", job.name, scheduled_for, status, duration)
+        return status == "succeeded"
+
+    async def run_job(self, job):
+        logger.info("Starting scheduler for job %s (every %ss)", job.name, job.interval)
+        done = None if job.catch_up else job.slot(time.time())
+        startup = True
+
+        while True:
+            slot = job.slot(time.time())
+            if done is None or slot > done:
+                try:
+                    finished = await self.execute(job, slot, startup)
+                except Exception as e:
+                    logger.error("Error running job %s: %s", job.name, e, exc_info=True)
+                    finished = False
 
-async def calculate_seconds_until_midnight():
-    now = datetime.now()
-    midnight = datetime.combine(now.date().replace(day=now.day + 1), dt_time(0, 0, 0))
-    return (midnight - now).total_seconds()
+                if not finished:
+                    # Locked by another instance, or failed: check the slot again later
+                    await asyncio.sleep(settings.scheduler_retry_delay)
+                    continue
+                done = slot
+                startup = False
 
+            await asyncio.sleep(max(0.0, slot + job.interval - time.time()) + random.uniform(0, job.jitter))
 
-async def daily_scheduler():
-    logger.info("Starting daily scheduler for coffee count reset")
+    def start(self):
+        return [asyncio.create_task(self.run_job(job)) for job in self.jobs.values()]
 
-    # Wait until midnight for first reset
-    seconds_until_midnight = await calculate_seconds_until_midnight()
-    logger.info(f"Waiting {seconds_until_midnight:.0f} seconds until midnight for first reset")
-    await asyncio.sleep(seconds_until_midnight)
 
-    while True:
-        await reset_daily_coffee_count()
-        # Wait 24 hours (86400 seconds) until next reset
-        await asyncio.sleep(86400)
+job_runner = JobRunner()
+job_runner.register("reset_daily_coffee_count", reset_daily_coffee_count, DAY,
+                    timeout=300, jitter=settings.scheduler_jitter)
+if settings.archive_enabled:
+    job_runner.register("archive_sensor_history", run_archive, DAY, offset=3600,
+                        timeout=settings.archive_job_timeout, jitter=settings.scheduler_jitter)
 
 
 def start_scheduler():
-    asyncio.create_task(daily_scheduler())
\ No newline at end of file
+    return job_runner.start()
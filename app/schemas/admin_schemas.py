@@ -0,0 +1,14 @@
+from pydantic import BaseModel
+from typing import Dict, Optional
+
+class LoggingConfig(BaseModel):
+    level: str
+    loggers: Dict[str, str]
+    sampling: Dict[str, int]
+
+class LoggingUpdate(BaseModel):
+    level: Optional[str] = None
+    # Logger name -> level (null resets it to the root level)
+    loggers: Optional[Dict[str, Optional[str]]] = None
+    # Category -> keep 1 in N records (0 drops them, null removes the rate)
+    sampling: Optional[Dict[str, Optional[int]]] = None
@@ -1,6 +1,8 @@
-from pydantic import BaseModel
-from datetime import datetime
-from typing import Optional
+from pydantic import BaseModel, Field
+from datetime import date, datetime
+from typing import List, Optional
+
+from app.config import settings
 
 class DeviceBase(BaseModel):
     device_name: str
@@ -10,6 +12,10 @@ class DeviceBase(BaseModel):
 class DeviceCreate(DeviceBase):
     pass
 
+class DeviceBulkCreate(BaseModel):
+    devices: List[DeviceCreate] = Field(max_length=settings.bulk_max_devices)
+    atomic: bool = True
+
 class DeviceUpdate(BaseModel):
     device_name: Optional[str] = None
     total_active_time: Optional[float] = None
@@ -22,6 +28,24 @@ class Device(DeviceBase):
     last_cleaning_time: datetime
     created_at: datetime
     last_active: datetime
+    is_online: bool = False
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class DevicePresence(BaseModel):
+    device_id: int
+    online: bool
+    last_seen: Optional[datetime] = None
+
+class PresenceList(BaseModel):
+    online: int
+    offline: int
+    devices: List[DevicePresence]
+
+class DailyUsage(BaseModel):
+    day: date
+    coffees: int
+    active_time: float
+    cleanings: int
+    last_cleaning: Optional[datetime] = None
@@ -1,6 +1,8 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, computed_field
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
+
+from app.anomaly import describe_flags
 
 class SensorDataBase(BaseModel):
     device_id: int
@@ -14,6 +16,12 @@ class SensorDataCreate(SensorDataBase):
 class SensorData(SensorDataBase):
     id: int
     timestamp: datetime
+    anomaly_flags: int = 0
+
+    @computed_field
+    @property
+    def anomalies(self) -> List[str]:
+        return describe_flags(self.anomaly_flags)
 
     class Config:
         from_attributes = True
@@ -23,4 +31,24 @@ class DeviceStatus(BaseModel):
 
 class DeviceStatistics(BaseModel):
     name: str
-    statuses: dict
\ No newline at end of file
+    statuses: dict
+
+class ConsumptionForecast(BaseModel):
+    level: Optional[float] = None
+    rate_per_hour: Optional[float] = None
+    hours_to_empty: Optional[float] = None
+    empty_at: Optional[datetime] = None
+    samples: int = 0
+
+class DevicePrediction(BaseModel):
+    device_id: int
+    water: ConsumptionForecast
+    beans: ConsumptionForecast
+
+class QuarantinedReading(BaseModel):
+    device_id: int
+    water_level: Optional[float] = None
+    beans_level: Optional[float] = None
+    anomaly_flags: int
+    anomalies: List[str]
+    timestamp: datetime
@@ -1,4 +1,8 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
+from typing import List
+
+from app.config import settings
+from app.schemas.device_schemas import Device
 
 class UserBase(BaseModel):
     name: str
@@ -8,8 +12,27 @@ class UserBase(BaseModel):
 class UserCreate(UserBase):
     password: str
 
+class UserBulkCreate(BaseModel):
+    users: List[UserCreate] = Field(max_length=settings.bulk_max_users)
+    atomic: bool = True
+
+class LoginRequest(BaseModel):
+    email: EmailStr
+    password: str
+
+class Token(BaseModel):
+    access_token: str
+    token_type: str = "bearer"
+    expires_at: int
+
 class User(UserBase):
     id: int
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class DeviceOverview(Device):
+    statuses: dict
+
+class UserOverview(User):
+    devices: List[DeviceOverview]
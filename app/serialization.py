@@ -0,0 +1,129 @@
+import gzip
+from datetime import datetime, timedelta, timezone
+
+import orjson
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from app.anomaly import describe_flags
+from app.models import SensorData, Device, User
+
+COLUMNAR_MEDIA_TYPE = "application/vnd.coffee.columnar+json"
+COMPRESS_MIN_SIZE = 512
+
+EPOCH = datetime(1970, 1, 1)
+EPOCH_UTC = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Column tuples selected for the fast path, in the order of the response schema fields
+SENSOR_DATA_COLUMNS = (
+    SensorData.id,
+    SensorData.device_id,
+    SensorData.water_level,
+    SensorData.beans_level,
+    SensorData.timestamp,
+    SensorData.anomaly_flags,
+)
+
+DEVICE_COLUMNS = (
+    Device.device_name,
+    Device.user_id,
+    Device.total_active_time,
+    Device.id,
+    Device.numbers_of_coffee,
+    Device.is_powered_on,
+    Device.last_cleaning_time,
+    Device.created_at,
+    Device.last_active,
+    Device.is_online,
+)
+
+USER_COLUMNS = (
+    User.name,
+    User.surname,
+    User.email,
+    User.id,
+)
+
+
+def dumps(content):
+    # UTC timestamps as "...Z", like the pydantic response_model path
+    return orjson.dumps(content, option=orjson.OPT_UTC_Z)
+
+
+def encode_sensor_rows(rows):
+    return dumps([
+        {
+            "device_id": device_id,
+            "water_level": water_level,
+            "beans_level": beans_level,
+            "numbers_of_coffee": 0,
+            "id": id,
+            "timestamp": timestamp,
+            "anomaly_flags": anomaly_flags,
+            "anomalies": describe_flags(anomaly_flags) if anomaly_flags else [],
+        }
+        for id, device_id, water_level, beans_level, timestamp, anomaly_flags in rows
+    ])
+
+
+def encode_rows(columns, rows):
+    fields = [column.key for column in columns]
+    return dumps([dict(zip(fields, row)) for row in rows])
+
+
+def json_response(content):
+    return Response(content=content, media_type="application/json")
+
+
+def wants_columnar(request, format=None):
+    return format == "columnar" or COLUMNAR_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def to_epoch_ms(timestamp):
+    return (timestamp - (EPOCH_UTC if timestamp.tzinfo else EPOCH)) // timedelta(milliseconds=1)
+
+
+def encode_columnar(timestamps, water_levels, beans_levels, anomaly_flags=None, **fields):
+    """
+    Parallel-array payload: timestamps are sent as `t0` (epoch milliseconds) plus
+    `dt`, the integer millisecond difference of each row to the previous one.
+    """
+    epoch_ms = [to_epoch_ms(timestamp) for timestamp in timestamps]
+    content = {
+        "format": "columnar",
+        **fields,
+        "count": len(epoch_ms),
+        "t0": epoch_ms[0] if epoch_ms else None,
+        "dt": [current - previous for previous, current in zip(epoch_ms, epoch_ms[1:])],
+        "water_level": list(water_levels),
+        "beans_level": list(beans_levels),
+    }
+    if anomaly_flags is not None:
+        content["anomaly_flags"] = list(anomaly_flags)
+    return dumps(content)
+
+
+def encode_sensor_columns(rows, **fields):
+    """Columnar payload from SENSOR_DATA_COLUMNS row tuples."""
+    columns = list(zip(*rows)) or [()] * len(SENSOR_DATA_COLUMNS)
+    _, _, water_levels, beans_levels, timestamps, anomaly_flags = columns
+    return encode_columnar(timestamps, water_levels, beans_levels, anomaly_flags, **fields)
+
+
+def compressed_response(request, content, media_type):
+    headers = {"Vary": "Accept-Encoding"}
+    accepted = {encoding.split(";")[0].strip() for encoding in request.headers.get("accept-encoding", "").split(",")}
+
+    if len(content) >= COMPRESS_MIN_SIZE:
+        if brotli is not None and "br" in accepted:
+            content = brotli.compress(content, quality=5)
+            headers["Content-Encoding"] = "br"
+        elif "gzip" in accepted:
+            content = gzip.compress(content, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+
+    return Response(content=content, media_type=media_type, headers=headers)
@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import time
+
+import orjson
+
+from app.config import settings
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+stream_records = metrics.counter("stream_records_total", "Outbound stream records by outcome")
+stream_queued = metrics.gauge("stream_records_queued", "Outbound stream records waiting to be sent")
+stream_batch_seconds = metrics.histogram("stream_batch_send_seconds", "Time to send one batch to the stream sink")
+
+
+class PermanentSendError(Exception):
+    """Raised by a sink when sending the batch again can't succeed (e.g. the receiver rejected it)."""
+
+
+class KafkaSink:
+    """Publishes to Kafka topics with aiokafka; records are keyed by device to keep per-device order."""
+
+    def __init__(self, bootstrap_servers):
+        self.bootstrap_servers = bootstrap_servers
+        self.producer = None
+
+    async def start(self):
+        from aiokafka import AIOKafkaProducer
+
+        self.producer = AIOKafkaProducer(
+            bootstrap_servers=self.bootstrap_servers,
+            acks="all",
+            enable_idempotence=True
+        )
+        try:
+            await self.producer.start()
+        except Exception:
+            await self.producer.stop()
+            self.producer = None
+            raise
+
+    async def send_batch(self, batch):
+        futures = [await self.producer.send(topic, value=value, key=key) for topic, key, value in batch]
+        await asyncio.gather(*futures)
+
+    async def stop(self):
+        if self.producer:
+            await self.producer.stop()
+            self.producer = None
+
+
+class FileSink:
+    """Appends records as NDJSON lines ({"topic", "key", "value"}) to a local file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    async def start(self):
+        pass
+
+    def _write(self, batch):
+        with open(self.path, "ab") as output:
+            output.write(b"".join(
+                b'{"topic":"%s","key":"%s","value":%s}\n' % (topic.encode(), key, value)
+                for topic, key, value in batch
+            ))
+
+    async def send_batch(self, batch):
+        await asyncio.to_thread(self._write, batch)
+
+    async def stop(self):
+        pass
+
+
+class MemorySink:
+    """Keeps sent records in memory, for tests and local development."""
+
+    def __init__(self):
+        self.records = []
+
+    async def start(self):
+        pass
+
+    async def send_batch(self, batch):
+        self.records.extend(batch)
+
+    async def stop(self):
+        pass
+
+
+def create_sink(kind):
+    if kind == "kafka":
+        return KafkaSink(settings.stream_kafka_bootstrap_servers)
+    if kind == "file":
+        return FileSink(settings.stream_file_path)
+    if kind == "memory":
+        return MemorySink()
+    raise ValueError(f"Unknown stream sink: {kind}")
+
+
+class EventStream:
+    """
+    Bounded buffer between the ingest path and a sink, drained in batches by one sender task.
+
+    `publish` never waits: when the buffer is full (sink down or too slow) the record is
+    dropped and counted. The sender sends a batch once it holds `batch_size` records or
+    its first record is `linger` seconds old, and retries a failed batch with backoff,
+    so records of a device keep their order. A batch is dropped and counted as
+    dead-lettered after `max_attempts` sends (0 retries it until it goes through), or
+    at once when the sink raises PermanentSendError.
+    """
+
+    def __init__(self, sink, topic_prefix, batch_size, linger, max_queued, max_attempts=0):
+        self.sink = sink
+        self.topic_prefix = topic_prefix
+        self.batch_size = batch_size
+        self.linger = linger
+        self.max_attempts = max_attempts
+        self.queue = asyncio.Queue(maxsize=max_queued)
+        self.task = None
+
+    def publish(self, kind, device_id, payload):
+        if self.task is None:
+            return
+        try:
+            self.queue.put_nowait((f"{self.topic_prefix}.{kind}", str(device_id).encode(), orjson.dumps(payload)))
+            stream_records.inc(kind=kind, outcome="queued")
+        except asyncio.QueueFull:
+            stream_records.inc(kind=kind, outcome="dropped")
+
+    async def start(self):
+        await self.sink.start()
+        self.task = asyncio.create_task(self.run())
+        logger.info("Started outbound stream to %s", type(self.sink).__name__)
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+
+        # Best effort for what is still buffered
+        batch = []
+        while not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        if batch:
+            try:
+                await self.sink.send_batch(batch)
+            except Exception as e:
+                logger.error("Dropped %s stream records on shutdown: %s", len(batch), e)
+        await self.sink.stop()
+
+    async def next_batch(self):
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def send(self, batch):
+        """Send one batch with retries; returns whether it went through."""
+        delay = 0.5
+        attempts = 0
+        while True:
+            attempts += 1
+            started = time.perf_counter()
+            try:
+                await self.sink.send_batch(batch)
+                stream_batch_seconds.observe(time.perf_counter() - started)
+                return True
+            except PermanentSendError as e:
+                logger.error("Dropped %s stream records, the sink rejected them: %s", len(batch), e)
+                return False
+            except Exception as e:
+                if self.max_attempts and attempts >= self.max_attempts:
+                    logger.error("Dropped %s stream records after %s attempts: %s", len(batch), attempts, e)
+                    return False
+                logger.error("Error sending %s stream records, retrying in %ss: %s", len(batch), delay, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    async def run(self):
+        while True:
+            batch = await self.next_batch()
+            stream_queued.set(self.queue.qsize())
+            if await self.send(batch):
+                stream_records.inc(len(batch), outcome="sent")
+            else:
+                stream_records.inc(len(batch), outcome="dead_lettered")
+
+
+event_stream = EventStream(
+    None if settings.stream_sink == "off" else create_sink(settings.stream_sink),
+    settings.stream_topic_prefix,
+    settings.stream_batch_size,
+    settings.stream_linger,
+    settings.stream_queue_size,
+    settings.stream_max_attempts
+)
@@ -0,0 +1,270 @@
+import asyncio
+import logging
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import select, insert, func, case
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.metrics import metrics
+from app.models import Device, DeviceEvent, DeviceDailyUsage
+from app.stream import event_stream
+
+logger = logging.getLogger(__name__)
+
+# Hours of active time added when a brew is started (button or API)
+BREW_ACTIVE_TIME = {"single_brew": 0.5, "double_brew": 0.75}
+# Coffees consumed when the device reports a finished brew
+BREW_COMPLETED_COST = {"single_brew_completed": 1, "double_brew_completed": 2}
+
+DeviceUsage = namedtuple("DeviceUsage", ["coffees_today", "active_time", "last_cleaning"])
+NO_USAGE = DeviceUsage(0, 0.0, None)
+
+events_recorded = metrics.counter("device_events_recorded_total", "Device events appended to the event log")
+events_buffered = metrics.gauge("device_events_buffered", "Device events waiting to be flushed")
+events_dropped = metrics.counter("device_events_dropped_total", "Device events dropped because the buffer was full")
+events_discarded = metrics.counter("device_events_discarded_total", "Device events discarded because the device is gone")
+flush_duration = metrics.histogram("device_events_flush_seconds", "Time to flush buffered device events")
+
+
+def event_usage(event_type, timestamp):
+    """[coffees, active time, cleanings, last cleaning] an event adds to its day."""
+    if event_type == "cleaning_completed":
+        return [0, 0.0, 1, timestamp]
+    return [BREW_COMPLETED_COST.get(event_type, 0), BREW_ACTIVE_TIME.get(event_type, 0.0), 0, None]
+
+
+def merge_usage(total, delta):
+    total[0] += delta[0]
+    total[1] += delta[1]
+    total[2] += delta[2]
+    if delta[3] is not None and (total[3] is None or delta[3] > total[3]):
+        total[3] = delta[3]
+
+
+def rollup_upsert(rows):
+    rollup = pg_insert(DeviceDailyUsage).values(rows)
+    return rollup.on_conflict_do_update(
+        index_elements=[DeviceDailyUsage.device_id, DeviceDailyUsage.day],
+        set_={
+            "coffees": DeviceDailyUsage.coffees + rollup.excluded.coffees,
+            "active_time": DeviceDailyUsage.active_time + rollup.excluded.active_time,
+            "cleanings": DeviceDailyUsage.cleanings + rollup.excluded.cleanings,
+            "last_cleaning": func.greatest(DeviceDailyUsage.last_cleaning, rollup.excluded.last_cleaning),
+        }
+    )
+
+
+class UsageRecorder:
+    """
+    Buffers device events and flushes them in batches with the matching daily rollup.
+
+    Every flush appends the events to `device_events` and adds their totals to
+    `device_daily_usage` in the same transaction (one upsert row per device and day).
+    Deltas that aren't committed yet stay visible to readers through `pending`.
+    Events of devices that no longer exist are discarded at the next flush instead of
+    failing it. At most `max_buffered` events wait for a flush; more are dropped and
+    counted while the database is down.
+    """
+
+    def __init__(self, flush_interval, batch_size, max_buffered):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_buffered = max_buffered
+        self.events = []
+        # (device_id, day) -> [coffees, active_time, cleanings, last_cleaning]
+        self.deltas = {}
+        self.flushing = {}
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def record(self, device_id, event_type, source):
+        if len(self.events) >= self.max_buffered:
+            events_dropped.inc(event_type=event_type)
+            return
+
+        now = datetime.utcnow()
+        event = {"device_id": device_id, "event_type": event_type, "source": source, "created_at": now}
+        self.events.append(event)
+        event_stream.publish("device_events", device_id, event)
+        merge_usage(self.deltas.setdefault((device_id, now.date()), [0, 0.0, 0, None]), event_usage(event_type, now))
+
+        events_recorded.inc(event_type=event_type)
+        events_buffered.set(len(self.events))
+        if len(self.events) >= self.batch_size:
+            self.wakeup.set()
+
+    def forget(self, device_id):
+        """Drop the buffered events and usage of a deleted device."""
+        self.events = [event for event in self.events if event["device_id"] != device_id]
+        self.deltas = {key: delta for key, delta in self.deltas.items() if key[0] != device_id}
+        events_buffered.set(len(self.events))
+
+    def pending(self, device_id, day):
+        """Usage recorded for the device and day that isn't in the rollup table yet."""
+        total = [0, 0.0, 0, None]
+        for deltas in (self.flushing, self.deltas):
+            delta = deltas.get((device_id, day))
+            if delta:
+                merge_usage(total, delta)
+        return total
+
+    async def flush(self):
+        if not self.events:
+            return 0
+
+        events, self.events = self.events, []
+        self.flushing, self.deltas = self.deltas, {}
+        started = datetime.utcnow()
+        committed = False
+        try:
+            async with AsyncSessionLocal() as db:
+                # A deleted device (or one another worker still caches) would fail the
+                # whole batch on its foreign key, and every retry after it
+                device_ids = {event["device_id"] for event in events}
+                result = await db.execute(select(Device.id).where(Device.id.in_(device_ids)))
+                gone = device_ids - set(result.scalars().all())
+                if gone:
+                    events, discarded = [e for e in events if e["device_id"] not in gone], events
+                    for event in discarded:
+                        if event["device_id"] in gone:
+                            events_discarded.inc(event_type=event["event_type"])
+                    self.flushing = {key: delta for key, delta in self.flushing.items() if key[0] not in gone}
+                    logger.warning("Discarded %s device events of deleted devices %s",
+                                   len(discarded) - len(events), sorted(gone))
+
+                rows = [
+                    {"device_id": device_id, "day": day, "coffees": coffees, "active_time": active_time,
+                     "cleanings": cleanings, "last_cleaning": last_cleaning}
+                    for (device_id, day), (coffees, active_time, cleanings, last_cleaning) in sorted(self.flushing.items())
+                ]
+                if events:
+                    await db.execute(insert(DeviceEvent), events)
+                for start in range(0, len(rows), settings.bulk_chunk_size):
+                    await db.execute(rollup_upsert(rows[start:start + settings.bulk_chunk_size]))
+                await db.commit()
+                committed = True
+        except BaseException as e:
+            # Also on cancellation (shutdown during a flush), unless the commit went through
+            if not committed:
+                self.events = events + self.events
+                for key, delta in self.flushing.items():
+                    merge_usage(self.deltas.setdefault(key, [0, 0.0, 0, None]), delta)
+            if not isinstance(e, Exception):
+                raise
+            logger.error("Error flushing %s device events, will retry: %s", len(events), e, exc_info=True)
+            return 0
+        finally:
+            self.flushing = {}
+            events_buffered.set(len(self.events))
+
+        flush_duration.observe((datetime.utcnow() - started).total_seconds())
+        return len(events)
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        await self.flush()
+
+
+async def load_usage(db, device_ids):
+    """Rollup totals per device, including events that are still buffered."""
+    device_ids = list(device_ids)
+    today = datetime.utcnow().date()
+    usage = {}
+    if device_ids:
+        result = await db.execute(
+            select(
+                DeviceDailyUsage.device_id,
+                func.sum(case((DeviceDailyUsage.day == today, DeviceDailyUsage.coffees), else_=0)),
+                func.sum(DeviceDailyUsage.active_time),
+                func.max(DeviceDailyUsage.last_cleaning)
+            )
+            .where(DeviceDailyUsage.device_id.in_(device_ids))
+            .group_by(DeviceDailyUsage.device_id)
+        )
+        usage = {device_id: DeviceUsage(coffees or 0, active_time or 0.0, last_cleaning)
+                 for device_id, coffees, active_time, last_cleaning in result.all()}
+
+    wanted = set(device_ids)
+    for deltas in (usage_recorder.flushing, usage_recorder.deltas):
+        for (device_id, day), (coffees, active_time, _, last_cleaning) in deltas.items():
+            if device_id in wanted:
+                current = usage.get(device_id, NO_USAGE)
+                if current.last_cleaning is not None and (last_cleaning is None or current.last_cleaning > last_cleaning):
+                    last_cleaning = current.last_cleaning
+                usage[device_id] = DeviceUsage(
+                    current.coffees_today + (coffees if day == today else 0),
+                    current.active_time + active_time,
+                    last_cleaning
+                )
+    return usage
+
+
+def apply_usage(device, usage):
+    """
+    Overlay the rollup on a device dict: the `devices` columns hold the baseline
+    (daily allowance, active time and cleaning time before the event log).
+    """
+    device["numbers_of_coffee"] = max(0, (device["numbers_of_coffee"] or 0) - usage.coffees_today)
+    device["total_active_time"] = (device["total_active_time"] or 0) + usage.active_time
+    if usage.last_cleaning is not None and (device["last_cleaning_time"] is None
+                                            or usage.last_cleaning > device["last_cleaning_time"]):
+        device["last_cleaning_time"] = usage.last_cleaning
+    return device
+
+
+async def usage_by_day(db, device_ids, start, end):
+    """Daily totals over several devices for start..end (inclusive), including buffered events."""
+    device_ids = list(device_ids)
+    days = {}
+    if device_ids:
+        result = await db.execute(
+            select(
+                DeviceDailyUsage.day,
+                func.sum(DeviceDailyUsage.coffees),
+                func.sum(DeviceDailyUsage.active_time),
+                func.sum(DeviceDailyUsage.cleanings),
+                func.max(DeviceDailyUsage.last_cleaning)
+            )
+            .where(DeviceDailyUsage.device_id.in_(device_ids), DeviceDailyUsage.day.between(start, end))
+            .group_by(DeviceDailyUsage.day)
+        )
+        days = {day: [coffees, active_time, cleanings, last_cleaning]
+                for day, coffees, active_time, cleanings, last_cleaning in result.all()}
+
+    wanted = set(device_ids)
+    for deltas in (usage_recorder.flushing, usage_recorder.deltas):
+        for (device_id, day), delta in deltas.items():
+            if device_id in wanted and start <= day <= end:
+                merge_usage(days.setdefault(day, [0, 0.0, 0, None]), delta)
+
+    return [
+        {"day": day, "coffees": coffees, "active_time": active_time, "cleanings": cleanings,
+         "last_cleaning": last_cleaning}
+        for day, (coffees, active_time, cleanings, last_cleaning) in sorted(days.items())
+    ]
+
+
+async def remaining_coffees(db, device_id, allowance):
+    usage = (await load_usage(db, [device_id])).get(device_id, NO_USAGE)
+    return max(0, (allowance or 0) - usage.coffees_today)
+
+
+usage_recorder = UsageRecorder(settings.usage_flush_interval, settings.usage_flush_batch, settings.usage_max_buffered)
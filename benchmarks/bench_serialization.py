@@ -0,0 +1,84 @@
+"""
+Compare the default response_model serialization of list endpoints with the
+column-tuple + orjson fast path (`?fast=true`).
+
+Runs on synthetic rows, without a database:
+
+    python -m benchmarks.bench_serialization --sizes 100 1000 10000
+"""
+import argparse
+import json
+import os
+import timeit
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import List
+
+os.environ.setdefault("DATABASE_URL", "postgresql+asyncpg://bench@localhost/bench")
+
+from pydantic import TypeAdapter
+
+from app.schemas.sensors_schemas import SensorData as SensorDataSchema
+from app.schemas.device_schemas import Device as DeviceSchema
+from app.serialization import encode_sensor_rows, encode_rows, SENSOR_DATA_COLUMNS, DEVICE_COLUMNS
+
+
+def make_sensor_rows(count):
+    start = datetime(2025, 6, 1)
+    return [
+        (i, 1 + i % 50, 100 - i % 100 * 0.7, 50 + i % 37 * 1.3, start + timedelta(seconds=30 * i), 0)
+        for i in range(count)
+    ]
+
+
+def make_device_rows(count):
+    now = datetime(2025, 6, 1)
+    return [
+        (f"Magnifica-S {i}", 1 + i % 100, i * 0.25, i, 4, i % 2 == 0, now, now, now, i % 3 != 0)
+        for i in range(count)
+    ]
+
+
+def as_orm_objects(columns, rows):
+    fields = [column.key for column in columns]
+    return [SimpleNamespace(**dict(zip(fields, row))) for row in rows]
+
+
+def response_model_path(adapter, objects):
+    # What FastAPI does for response_model: validate each row from attributes, dump to JSON-able data, json.dumps
+    content = adapter.dump_python(adapter.validate_python(objects, from_attributes=True), mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+
+
+def best_of(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    sensor_adapter = TypeAdapter(List[SensorDataSchema])
+    device_adapter = TypeAdapter(List[DeviceSchema])
+
+    print(f"{'endpoint':<10} {'rows':>7} {'response_model ms':>18} {'fast ms':>9} {'speedup':>8} {'bytes':>9}")
+    for size in args.sizes:
+        cases = [
+            ("sensors", sensor_adapter, SENSOR_DATA_COLUMNS, make_sensor_rows(size), encode_sensor_rows),
+            ("devices", device_adapter, DEVICE_COLUMNS, make_device_rows(size),
+             lambda rows: encode_rows(DEVICE_COLUMNS, rows)),
+        ]
+        for name, adapter, columns, rows, fast in cases:
+            objects = as_orm_objects(columns, rows)
+            assert json.loads(response_model_path(adapter, objects)) == json.loads(fast(rows))
+
+            slow_time = best_of(lambda: response_model_path(adapter, objects), args.repeat)
+            fast_time = best_of(lambda: fast(rows), args.repeat)
+            print(f"{name:<10} {size:>7} {slow_time * 1000:>18.2f} {fast_time * 1000:>9.2f} "
+                  f"{slow_time / fast_time:>7.1f}x {len(fast(rows)):>9}")
+
+
+if __name__ == "__main__":
+    main()
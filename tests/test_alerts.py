@@ -0,0 +1,116 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+
+from app.alerts import AlertEngine, WebhookSink, compile_rules, DEFAULT_ALERT_RULES
+from app.stream import EventStream, MemorySink
+
+pytestmark = pytest.mark.anyio
+
+NOW = datetime(2026, 10, 19, 12, 0)
+
+
+def reading(device_id=1, water_level=None, beans_level=None, event=None):
+    return {"device_id": device_id, "water_level": water_level, "beans_level": beans_level, "event": event}
+
+
+def engine():
+    return AlertEngine(compile_rules(DEFAULT_ALERT_RULES), EventStream(None, "alerts", 10, 0, 10))
+
+
+def test_alert_fires_once_and_resolves_past_the_clear_level():
+    alerts = engine()
+
+    assert [a["state"] for a in alerts.evaluate(reading(water_level=15), NOW)] == ["triggered"]
+    assert alerts.evaluate(reading(water_level=10), NOW) == []
+    # Between the trigger (20) and clear (25) levels the rule keeps firing
+    assert alerts.evaluate(reading(water_level=22), NOW) == []
+    assert [a["state"] for a in alerts.evaluate(reading(water_level=30), NOW)] == ["resolved"]
+    assert alerts.active(1) == []
+
+
+def test_readings_without_the_field_keep_the_state():
+    alerts = engine()
+    alerts.evaluate(reading(beans_level=40), NOW)
+
+    assert alerts.evaluate(reading(water_level=80), NOW) == []
+    assert alerts.active(1) == ["beans_low"]
+
+
+def test_cleaning_resets_days_since_cleaning():
+    alerts = engine()
+    alerts.last_cleaning[1] = NOW - timedelta(days=31)
+
+    assert [a["rule"] for a in alerts.evaluate(reading(), NOW)] == ["cleaning_overdue"]
+    assert [a["state"] for a in alerts.evaluate(reading(event="cleaning_completed"), NOW)] == ["resolved"]
+
+
+def webhook(handler, urls=("http://hooks/a",)):
+    sink = WebhookSink(list(urls), timeout=1)
+    sink.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return sink
+
+
+async def test_client_errors_are_not_retried():
+    calls = []
+
+    def handler(request):
+        calls.append(str(request.url))
+        return httpx.Response(410)
+
+    stream = EventStream(webhook(handler), "alerts", 10, 0, 10, max_attempts=5)
+
+    assert await stream.send([("alerts.webhooks", b"1", b"{}")]) is False
+    assert calls == ["http://hooks/a"]
+
+
+async def test_failing_batch_is_dropped_after_max_attempts(monkeypatch):
+    async def no_backoff(delay):
+        pass
+
+    monkeypatch.setattr(asyncio, "sleep", no_backoff)
+    calls = []
+
+    def handler(request):
+        calls.append(str(request.url))
+        return httpx.Response(503)
+
+    stream = EventStream(webhook(handler), "alerts", 10, 0, 10, max_attempts=3)
+
+    assert await stream.send([("alerts.webhooks", b"1", b"{}")]) is False
+    assert len(calls) == 3
+
+
+async def test_retry_only_goes_to_the_failed_url():
+    failures = {"http://hooks/b": 1}
+    calls = []
+
+    def handler(request):
+        url = str(request.url)
+        calls.append(url)
+        if failures.get(url):
+            failures[url] -= 1
+            return httpx.Response(500)
+        return httpx.Response(200)
+
+    sink = webhook(handler, ["http://hooks/a", "http://hooks/b"])
+    batch = [("alerts.webhooks", b"1", b"{}")]
+
+    with pytest.raises(RuntimeError):
+        await sink.send_batch(batch)
+    await sink.send_batch(batch)
+
+    assert calls == ["http://hooks/a", "http://hooks/b", "http://hooks/b"]
+
+
+async def test_published_alerts_reach_the_sink():
+    sink = MemorySink()
+    stream = EventStream(sink, "alerts", 10, 0.01, 10)
+    await stream.start()
+    stream.publish("webhooks", 1, {"rule": "water_critical"})
+    await asyncio.sleep(0.05)
+    await stream.stop()
+
+    assert [(topic, key) for topic, key, _ in sink.records] == [("alerts.webhooks", b"1")]
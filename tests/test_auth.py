@@ -0,0 +1,65 @@
+import httpx
+import pytest
+from fastapi import FastAPI
+from sqlalchemy import update
+
+from app.auth import token_signer
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models import User, Device
+from app.routes import device_routes
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def client(database, monkeypatch):
+    monkeypatch.setattr(settings, "auth_required", True)
+    async with AsyncSessionLocal() as db:
+        for user_id in (1, 2):
+            db.add(User(id=user_id, name="User", surname=str(user_id), email=f"{user_id}@example.com",
+                        password="secret"))
+        db.add(Device(id=10, device_name="kitchen", user_id=1))
+        await db.commit()
+
+    app = FastAPI()
+    app.include_router(device_routes.router)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+
+def token(user_id):
+    return {"Authorization": f"Bearer {token_signer.issue(user_id)[0]}"}
+
+
+async def test_device_changes_need_a_token(client):
+    body = {"device_name": "office", "user_id": 1}
+    assert (await client.post("/devices/", json=body)).status_code == 401
+    assert (await client.put("/devices/10?device_id=10", json=body)).status_code == 401
+    assert (await client.delete("/devices/10?device_id=10")).status_code == 401
+
+
+async def test_devices_are_created_for_the_token_user_only(client):
+    assert (await client.post("/devices/", json={"device_name": "office", "user_id": 2},
+                              headers=token(1))).status_code == 403
+    response = await client.post("/devices/", json={"device_name": "office", "user_id": 1}, headers=token(1))
+    assert response.status_code == 200
+    assert response.json()["user_id"] == 1
+
+
+async def test_only_the_owner_updates_or_deletes(client):
+    body = {"device_name": "renamed", "user_id": 1}
+    assert (await client.put("/devices/10?device_id=10", json=body, headers=token(2))).status_code == 404
+    assert (await client.delete("/devices/10?device_id=10", headers=token(2))).status_code == 404
+    assert (await client.put("/devices/10?device_id=10", json=body, headers=token(1))).status_code == 200
+    assert (await client.delete("/devices/10?device_id=10", headers=token(1))).status_code == 200
+
+
+async def test_ownership_follows_the_database(client):
+    # An owner change made by another worker: no cache of this process knows about it
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(Device).where(Device.id == 10).values(user_id=2))
+        await db.commit()
+
+    assert (await client.delete("/devices/10?device_id=10", headers=token(1))).status_code == 404
+    assert (await client.delete("/devices/10?device_id=10", headers=token(2))).status_code == 200
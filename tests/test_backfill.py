@@ -0,0 +1,79 @@
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+import orjson
+import pytest
+
+from app.backfill import Backfill, read_rows, to_row
+from app.query_cache import CACHE_CHANNEL
+
+pytestmark = pytest.mark.anyio
+
+
+class RecordingConnection:
+    """Stands in for an asyncpg connection; records what a transaction would commit."""
+
+    def __init__(self):
+        self.copied = []
+        self.notifications = []
+        self.checkpoints = []
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+    async def copy_records_to_table(self, table, columns, records):
+        self.copied += records
+
+    async def execute(self, query, *args):
+        if "pg_notify" in query:
+            self.notifications.append(args)
+        else:
+            self.checkpoints.append(args)
+
+    async def fetch(self, query, *args):
+        return []
+
+
+def write_dump(path, readings):
+    path.write_bytes(b"".join(orjson.dumps(reading) + b"\n" for reading in readings))
+    return str(path)
+
+
+def test_to_row_rejects_readings_without_a_device():
+    assert to_row({"water_level": 50, "timestamp": "2026-10-19T08:00:00"}) is None
+    assert to_row({"device_id": "", "water_level": 50, "timestamp": "2026-10-19T08:00:00"}) is None
+    assert to_row({"device_id": 3, "water_level": 50, "timestamp": "2026-10-19T08:00:00"}) == (
+        3, 50, None, datetime(2026, 10, 19, 8, tzinfo=timezone.utc), 0)
+
+
+def test_read_rows_resumes_at_an_offset(tmp_path):
+    path = write_dump(tmp_path / "dump.ndjson", [
+        {"device_id": 1, "water_level": 10, "timestamp": 0},
+        {"device_id": 1, "water_level": 20, "timestamp": 60},
+    ])
+    rows = list(read_rows(path))
+
+    assert [row[1] for _, row in read_rows(path, rows[0][0])] == [20]
+
+
+async def test_run_copies_known_devices_and_notifies_the_query_cache(tmp_path):
+    path = write_dump(tmp_path / "dump.ndjson", [
+        {"device_id": 1, "water_level": 10, "timestamp": 0},
+        {"device_id": 2, "beans_level": 30, "timestamp": 0},
+        {"device_id": 9, "water_level": 10, "timestamp": 0},
+        {"water_level": 10, "timestamp": 0},
+    ])
+    backfill = Backfill("postgresql://unused", workers=2, batch_size=10)
+    backfill.connections = [RecordingConnection(), RecordingConnection()]
+    backfill.devices = {1, 2}
+
+    stats = await backfill.run(path, "dump")
+
+    assert (stats["rows"], stats["unknown_device"], stats["rejected"]) == (2, 1, 1)
+    odd, even = backfill.connections[1], backfill.connections[0]
+    assert [row[0] for row in odd.copied] == [1] and [row[0] for row in even.copied] == [2]
+    for connection, device_id in ((odd, 1), (even, 2)):
+        [(channel, payload)] = connection.notifications
+        assert channel == CACHE_CHANNEL and payload.endswith(f":{device_id}")
+        assert len(connection.checkpoints) == 1
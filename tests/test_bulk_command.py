@@ -0,0 +1,95 @@
+import json
+import logging
+
+import pytest
+
+from app.database import AsyncSessionLocal
+from app.models import User, Device
+from app.mqtt_client import MQTTClient, command_topic
+
+pytestmark = pytest.mark.anyio
+
+
+class RecordingClient:
+    def __init__(self, fail_for=()):
+        self.published = []
+        self.fail_for = set(fail_for)
+
+    async def publish(self, topic, payload):
+        if topic in self.fail_for:
+            raise ConnectionError("broker went away")
+        self.published.append((topic, json.loads(payload)))
+
+
+@pytest.fixture
+async def fleet(database):
+    async with AsyncSessionLocal() as db:
+        db.add_all([
+            User(id=1, name="Ana", surname="Pop", email="ana@example.com", password="secret"),
+            User(id=2, name="Ion", surname="Rus", email="ion@example.com", password="secret"),
+        ])
+        db.add_all([
+            Device(id=1, device_name="on", user_id=1, is_powered_on=True, numbers_of_coffee=4),
+            Device(id=2, device_name="off", user_id=1, is_powered_on=False, numbers_of_coffee=4),
+            Device(id=3, device_name="empty", user_id=1, is_powered_on=True, numbers_of_coffee=0),
+            Device(id=4, device_name="other user's", user_id=2, is_powered_on=True, numbers_of_coffee=4),
+        ])
+        await db.commit()
+
+
+def connected(client):
+    mqtt = MQTTClient()
+    mqtt.client = client
+    mqtt.is_connected = True
+    return mqtt
+
+
+async def test_bulk_command_reports_every_device(fleet):
+    client = RecordingClient()
+    results = await connected(client).send_bulk_command({"action": "single_brew"}, device_ids=[1, 2, 3, 4, 99],
+                                                        user_id=1)
+
+    statuses = {result["device_id"]: (result["status"], result.get("reason")) for result in results}
+    assert statuses == {
+        1: ("sent", None),
+        2: ("skipped", "device_powered_off"),
+        3: ("skipped", "daily_coffee_limit_exceeded"),
+        4: ("not_found", None),
+        99: ("not_found", None),
+    }
+    assert client.published == [(command_topic(1), {"action": "single_brew", "device_id": 1,
+                                                    "correlation_id": results[0]["correlation_id"]})]
+
+
+async def test_every_device_gets_its_own_correlation_id(fleet):
+    client = RecordingClient()
+    results = await connected(client).send_bulk_command({"action": "power_toggle", "correlation_id": "shared"},
+                                                        device_ids=[1, 2, 3])
+
+    correlation_ids = [payload["correlation_id"] for _, payload in client.published]
+    assert sorted(topic for topic, _ in client.published) == [command_topic(i) for i in (1, 2, 3)]
+    assert len(set(correlation_ids)) == 3 and "shared" not in correlation_ids
+    assert [result["status"] for result in results] == ["sent"] * 3
+
+
+async def test_failed_publish_is_reported_per_device(fleet):
+    client = RecordingClient(fail_for=[command_topic(3)])
+    results = await connected(client).send_bulk_command({"action": "power_toggle"}, device_ids=[1, 3])
+
+    assert [(result["device_id"], result["status"]) for result in results] == [(1, "sent"), (3, "failed")]
+
+
+async def test_single_command_uses_the_device_topic(fleet):
+    client = RecordingClient()
+
+    assert await connected(client).send_command({"action": "power_toggle", "device_id": 4}) is True
+    assert [topic for topic, _ in client.published] == [command_topic(4)]
+
+
+async def test_own_command_echoes_are_not_logged(caplog):
+    mqtt = connected(RecordingClient())
+    with caplog.at_level(logging.INFO, logger="app.mqtt_client"):
+        await mqtt.handle_message(command_topic(4), None)
+        await mqtt.handle_message("coffee_machine/4/firmware", None)
+
+    assert [record.args for record in caplog.records] == [("coffee_machine/4/firmware",)]
@@ -0,0 +1,63 @@
+import pytest
+
+from app.command_tracker import CommandTracker
+
+pytestmark = pytest.mark.anyio
+
+
+def record(device_id, event=None, correlation_id=None, water_level=None, beans_level=None):
+    return {"device_id": device_id, "event": event, "correlation_id": correlation_id,
+            "water_level": water_level, "beans_level": beans_level}
+
+
+async def test_completion_event_acknowledges_the_oldest_command():
+    tracker = CommandTracker(timeout=60, wait_timeout=1)
+    first = tracker.register({"action": "single_brew"}, 1)
+    second = tracker.register({"action": "single_brew"}, 1)
+
+    entry = tracker.acknowledge_message(1, record(1, event="single_brew_completed"))
+
+    assert entry.correlation_id == first
+    assert entry.latency >= 0
+    assert tracker.status(first)["status"] == "acknowledged"
+    assert tracker.status(second)["status"] == "pending"
+
+
+async def test_correlation_id_of_another_device_is_ignored():
+    tracker = CommandTracker(timeout=60, wait_timeout=1)
+    correlation_id = tracker.register({"action": "cleaning"}, 1)
+
+    assert tracker.acknowledge_message(2, record(2, correlation_id=correlation_id)) is None
+    assert tracker.acknowledge_message(1, record(1, correlation_id=correlation_id)) is not None
+
+
+async def test_read_sensors_is_acknowledged_by_the_next_reading():
+    tracker = CommandTracker(timeout=60, wait_timeout=1)
+    correlation_id = tracker.register({"action": "read_sensors"}, 1)
+
+    assert tracker.acknowledge_message(1, record(1)) is None
+    assert tracker.acknowledge_message(1, record(1, water_level=40)).correlation_id == correlation_id
+
+
+async def test_actions_without_an_ack_are_not_tracked():
+    tracker = CommandTracker(timeout=60, wait_timeout=1)
+    command = {"action": "set_temperature"}
+
+    assert tracker.register(command, 1) is None
+    assert "correlation_id" not in command
+    assert tracker.pending == {}
+
+
+async def test_wait_returns_after_the_default_wait_timeout():
+    tracker = CommandTracker(timeout=60, wait_timeout=0.01)
+    correlation_id = tracker.register({"action": "double_brew"}, 1)
+
+    assert (await tracker.wait(correlation_id))["status"] == "pending"
+
+
+async def test_unacknowledged_command_times_out():
+    tracker = CommandTracker(timeout=0.01, wait_timeout=1)
+    correlation_id = tracker.register({"action": "power_toggle"}, 1)
+
+    assert (await tracker.wait(correlation_id))["status"] == "timeout"
+    assert tracker.pending == {} and tracker.awaiting_event == {}
@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+
+from app.compression import SensorCompressor
+
+START = datetime(2026, 10, 19, 12, 0)
+
+
+def at(seconds):
+    return START + timedelta(seconds=seconds)
+
+
+def swinging_door(tolerance=1, heartbeat=900):
+    return SensorCompressor("swinging_door", tolerance, tolerance, heartbeat)
+
+
+def test_equal_timestamp_after_door_closes():
+    compressor = swinging_door()
+    assert compressor.offer(1, at(0), 50, 50) == [(at(0), 50, 50)]
+    assert compressor.offer(1, at(10), 50, 50) == []
+    # Breaks the line through the pending reading, at the pending reading's timestamp
+    assert compressor.offer(1, at(10), 80, 50) == [(at(10), 50, 50)]
+    # The compressor keeps working from the stored point
+    assert compressor.offer(1, at(20), 80, 50) == [(at(20), 80, 50)]
+
+
+def test_latest_stored_level_stays_within_tolerance_on_a_linear_drain():
+    compressor = swinging_door(tolerance=1)
+    stored = []
+    for step in range(81):
+        level = 100 - step * 0.6
+        stored += compressor.offer(1, at(step * 10), level, level)
+        assert abs(stored[-1][1] - level) <= 1
+
+    assert len(stored) < 81
+
+
+def test_heartbeat_stores_a_flat_series():
+    compressor = swinging_door(heartbeat=60)
+    stored = []
+    for step in range(13):
+        stored += compressor.offer(1, at(step * 10), 50, 50)
+
+    assert [point[0] for point in stored] == [at(0), at(60), at(120)]
+
+
+def test_drain_returns_the_held_back_reading():
+    compressor = swinging_door()
+    compressor.offer(1, at(0), 50, 50)
+    compressor.offer(1, at(10), 50.5, 50)
+
+    assert compressor.drain() == [(1, (at(10), 50.5, 50))]
+    assert compressor.drain() == []
@@ -0,0 +1,80 @@
+import pytest
+from sqlalchemy import select
+
+from app.database import AsyncSessionLocal
+from app.models import User, Device
+from app.presence import PresenceTracker, TimerWheel, parse_presence
+
+
+def run_until(wheel, end):
+    expired = []
+    for now in range(wheel.current + 1, end + 1):
+        expired += [(key, now) for key in wheel.advance(now)]
+    return expired
+
+
+def filed_entries(wheel):
+    return [entry for level in wheel.wheels for slot in level for entry in slot]
+
+
+def test_keys_expire_at_their_deadline_on_every_level():
+    wheel = TimerWheel(0, size=8, levels=3)
+    for key, deadline in (("a", 3), ("b", 20), ("c", 150)):
+        wheel.schedule(key, deadline)
+
+    assert run_until(wheel, 200) == [("a", 3), ("b", 20), ("c", 150)]
+    assert len(wheel) == 0
+
+
+def test_later_deadlines_reuse_the_entry_and_earlier_ones_replace_it():
+    wheel = TimerWheel(0, size=8, levels=3)
+    wheel.schedule("a", 10)
+    wheel.schedule("a", 40)
+    assert len(filed_entries(wheel)) == 1
+
+    wheel.schedule("a", 5)
+    assert run_until(wheel, 100) == [("a", 5)]
+
+
+def test_flapping_leaves_one_live_entry():
+    wheel = TimerWheel(0, size=8, levels=3)
+    for now in range(1, 50):
+        wheel.schedule("a", now + 100)
+        wheel.cancel("a")
+        wheel.schedule("a", now + 100)
+        wheel.advance(now)
+
+    live = [entry for entry in filed_entries(wheel) if entry == ("a", wheel.deadlines["a"][1])]
+    assert len(live) == 1
+    assert run_until(wheel, 300) == [("a", 149)]
+
+
+def test_parse_presence():
+    assert parse_presence("coffee_machine/7/status", b"offline") == (7, False)
+    assert parse_presence("coffee_machine/7/status", b" Online\n") == (7, True)
+    assert parse_presence("coffee_machine/x/status", b"online") is None
+    assert parse_presence("coffee_machine/7/status", b"sleeping") is None
+
+
+@pytest.mark.anyio
+async def test_tracker_goes_offline_on_timeout_and_last_will(database):
+    async with AsyncSessionLocal() as db:
+        db.add(User(id=1, name="Ana", surname="Pop", email="ana@example.com", password="secret"))
+        db.add_all([Device(id=device_id, device_name="machine", user_id=1) for device_id in (1, 2)])
+        await db.commit()
+
+    tracker = PresenceTracker(timeout=60, flush_interval=1)
+    tracker.wheel = TimerWheel(1000)
+    tracker.seen(1, now=1000)
+    tracker.status(2, True, now=1000)
+    tracker.status(2, False, now=1010)
+    assert tracker.online == {1}
+
+    assert tracker.expire(now=1059) == []
+    assert tracker.expire(now=1060) == [1]
+    assert tracker.online == set()
+
+    assert await tracker.flush() == 2
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(Device.id, Device.is_online).order_by(Device.id))
+        assert result.all() == [(1, False), (2, False)]
@@ -0,0 +1,75 @@
+import httpx
+import pytest
+from fastapi import Depends, FastAPI, Request
+
+from app.config import settings
+from app.rate_limiter import CommandAdmission, TokenBucketLimiter
+
+
+def test_bucket_allows_the_burst_then_refills_at_the_rate():
+    limiter = TokenBucketLimiter("test", rate=2, burst=3, max_keys=10)
+    for _ in range(3):
+        assert limiter.retry_after("a", now=100.0) == 0
+        limiter.consume("a")
+
+    assert limiter.retry_after("a", now=100.0) == pytest.approx(0.5)
+    assert limiter.retry_after("a", now=100.5) == 0
+
+
+def test_least_recently_used_bucket_is_evicted():
+    limiter = TokenBucketLimiter("test", rate=1, burst=1, max_keys=2)
+    for key in ("a", "b"):
+        limiter.retry_after(key, now=0.0)
+        limiter.consume(key)
+    limiter.retry_after("c", now=0.0)
+
+    assert list(limiter.buckets) == ["b", "c"]
+    # An evicted key starts again with a full bucket
+    assert limiter.retry_after("a", now=0.0) == 0
+
+
+def test_device_limit_doesnt_use_up_the_client_budget():
+    admission = CommandAdmission()
+    admission.clients = TokenBucketLimiter("client", rate=1, burst=10, max_keys=10)
+    admission.devices = TokenBucketLimiter("device", rate=1, burst=1, max_keys=10)
+
+    assert admission.admit("client", device_id=1) == 0
+    assert admission.admit("client", device_id=1) > 0
+    assert admission.clients.buckets["client"][0] == pytest.approx(9, abs=0.01)
+
+
+def test_requests_over_the_in_flight_limit_are_rejected():
+    admission = CommandAdmission()
+    admission.in_flight = admission.max_in_flight
+
+    assert admission.admit("client") == 1.0
+
+
+@pytest.mark.anyio
+async def test_clients_are_keyed_by_token_user_not_headers(monkeypatch):
+    monkeypatch.setattr(settings, "rate_limit_enabled", True)
+    admission = CommandAdmission()
+    admission.clients = TokenBucketLimiter("client", rate=0.001, burst=1, max_keys=10)
+
+    async def authenticated(request: Request):
+        request.state.user_id = int(request.headers["x-test-user"])
+
+    async def limited(request: Request, _=Depends(authenticated)):
+        async with admission.track(request):
+            yield
+
+    app = FastAPI()
+
+    @app.post("/command", dependencies=[Depends(limited)])
+    async def command():
+        return {}
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        def send(user, forwarded):
+            return client.post("/command", headers={"x-test-user": str(user), "x-forwarded-for": forwarded})
+
+        assert (await send(1, "10.0.0.1")).status_code == 200
+        # A different forwarded address doesn't buy the same user a new bucket
+        response = await send(1, "10.0.0.2")
+        assert response.status_code == 429 and "retry-after" in response.headers
+        assert (await send(2, "10.0.0.1")).status_code == 200
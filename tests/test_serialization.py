@@ -0,0 +1,37 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import List
+
+import orjson
+from pydantic import TypeAdapter
+
+from app.serialization import encode_sensor_rows
+from app.schemas.sensors_schemas import SensorData as SensorDataSchema
+
+
+def default_output(rows):
+    """What the response_model path returns for the same rows."""
+    objects = [
+        SensorDataSchema.model_validate(SimpleNamespace(id=id, device_id=device_id, water_level=water_level, beans_level=beans_level,
+                        numbers_of_coffee=0, timestamp=timestamp, anomaly_flags=anomaly_flags))
+        for id, device_id, water_level, beans_level, timestamp, anomaly_flags in rows
+    ]
+    return TypeAdapter(List[SensorDataSchema]).dump_python(objects, mode="json")
+
+
+def test_fast_path_matches_response_model_on_aware_rows():
+    rows = [
+        (1, 7, 33.3, None, datetime(2026, 10, 19, 12, 0, tzinfo=timezone.utc), 0),
+        (2, 7, 20.5, 80.25, datetime(2026, 10, 19, 12, 0, 1, 250000, tzinfo=timezone.utc), 3),
+    ]
+
+    fast = orjson.loads(encode_sensor_rows(rows))
+
+    assert fast == default_output(rows)
+    assert fast[0]["timestamp"] == "2026-10-19T12:00:00Z"
+
+
+def test_fast_path_matches_response_model_on_naive_rows():
+    rows = [(1, 7, 50.0, 60.0, datetime(2026, 10, 19, 12, 0, 0, 5), 0)]
+
+    assert orjson.loads(encode_sensor_rows(rows)) == default_output(rows)
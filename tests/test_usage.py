@@ -0,0 +1,111 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from sqlalchemy import delete, select
+
+from app.database import AsyncSessionLocal
+from app.models import User, Device, DeviceEvent, DeviceDailyUsage
+from app.usage import UsageRecorder, load_usage
+
+pytestmark = pytest.mark.anyio
+
+
+async def add_devices(*device_ids):
+    async with AsyncSessionLocal() as db:
+        db.add(User(id=1, name="Ana", surname="Pop", email="ana@example.com", password="secret"))
+        for device_id in device_ids:
+            db.add(Device(id=device_id, device_name=f"machine {device_id}", user_id=1, numbers_of_coffee=4))
+        await db.commit()
+
+
+async def stored_events():
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(DeviceEvent.device_id, DeviceEvent.event_type).order_by(DeviceEvent.id))
+        return result.all()
+
+
+async def test_flush_writes_events_and_daily_rollup(database):
+    await add_devices(1)
+    recorder = UsageRecorder(flush_interval=60, batch_size=100, max_buffered=100)
+    recorder.record(1, "double_brew", "api")
+    recorder.record(1, "double_brew_completed", "device")
+    recorder.record(1, "cleaning_completed", "device")
+
+    assert await recorder.flush() == 3
+    assert await recorder.flush() == 0
+
+    async with AsyncSessionLocal() as db:
+        rollup = (await db.execute(select(DeviceDailyUsage))).scalar_one()
+        device = (await db.execute(select(Device).where(Device.id == 1))).scalar_one()
+    assert (rollup.coffees, rollup.active_time, rollup.cleanings) == (2, 0.75, 1)
+    # Totals live in the rollup, the device row isn't written
+    assert device.total_active_time == 0
+
+
+async def test_events_of_a_deleted_device_dont_block_the_others(database):
+    await add_devices(1, 2)
+    recorder = UsageRecorder(flush_interval=60, batch_size=100, max_buffered=100)
+    recorder.record(1, "single_brew_completed", "device")
+    recorder.record(2, "single_brew_completed", "device")
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(Device).where(Device.id == 2))
+        await db.commit()
+
+    assert await recorder.flush() == 1
+    assert await stored_events() == [(1, "single_brew_completed")]
+    assert recorder.events == [] and recorder.pending(2, datetime.utcnow().date())[0] == 0
+
+    recorder.record(1, "double_brew_completed", "device")
+    assert await recorder.flush() == 1
+
+
+async def test_failed_flush_is_retried(database, monkeypatch):
+    await add_devices(1)
+    recorder = UsageRecorder(flush_interval=60, batch_size=100, max_buffered=100)
+    recorder.record(1, "single_brew_completed", "device")
+
+    def broken(rows):
+        raise RuntimeError("database is down")
+
+    import app.usage
+    with monkeypatch.context() as patch:
+        patch.setattr(app.usage, "rollup_upsert", broken)
+        assert await recorder.flush() == 0
+    assert len(recorder.events) == 1
+    assert recorder.pending(1, datetime.utcnow().date())[0] == 1
+
+    assert await recorder.flush() == 1
+    async with AsyncSessionLocal() as db:
+        assert (await load_usage(db, [1]))[1].coffees_today == 1
+
+
+async def test_forget_drops_buffered_usage(database):
+    recorder = UsageRecorder(flush_interval=60, batch_size=100, max_buffered=100)
+    recorder.record(1, "single_brew_completed", "device")
+    recorder.record(2, "single_brew_completed", "device")
+
+    recorder.forget(2)
+
+    assert [event["device_id"] for event in recorder.events] == [1]
+    assert recorder.pending(2, datetime.utcnow().date())[0] == 0
+
+
+async def test_full_buffer_drops_new_events():
+    recorder = UsageRecorder(flush_interval=60, batch_size=100, max_buffered=2)
+    for _ in range(3):
+        recorder.record(1, "single_brew", "api")
+
+    assert len(recorder.events) == 2
+
+
+async def test_stop_flushes_the_buffer(database):
+    await add_devices(1)
+    recorder = UsageRecorder(flush_interval=60, batch_size=100, max_buffered=100)
+    recorder.start()
+    recorder.record(1, "single_brew", "button")
+    await asyncio.sleep(0)
+
+    await recorder.stop()
+
+    assert await stored_events() == [(1, "single_brew")]